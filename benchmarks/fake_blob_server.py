@@ -0,0 +1,371 @@
+import base64
+import bisect
+import hashlib
+import re
+import threading
+import uuid
+from email.utils import formatdate
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, Optional, Tuple
+from urllib.parse import parse_qsl, unquote, urlsplit
+from xml.sax.saxutils import escape
+
+ACCOUNT_NAME = "devstoreaccount1"
+# Well-known key of the storage emulators, requests are not authenticated
+ACCOUNT_KEY = "Eby8vdM02xNOcqFlqUwJPLlmEtlCDXJ1OUzFT50uSRZ6IFsuFq2UVErCz4I6tq/K1SZFPTOtr/KBHBeksoGMGw=="
+API_VERSION = "2021-08-06"
+
+
+class _Blob:
+    def __init__(self, data: bytes, content_encoding: Optional[str] = None):
+        self.data = data
+        self.content_encoding = content_encoding
+        self.etag = '"0x{}"'.format(uuid.uuid4().hex[:16].upper())
+        self.last_modified = formatdate(usegmt=True)
+        self.content_md5 = base64.b64encode(hashlib.md5(data).digest()).decode()
+
+    def get_headers(self) -> Dict[str, str]:
+        headers = {
+            "ETag": self.etag,
+            "Last-Modified": self.last_modified,
+            "Content-MD5": self.content_md5,
+            "Content-Type": "application/octet-stream",
+            "x-ms-blob-type": "BlockBlob",
+        }
+        if self.content_encoding is not None:
+            headers["Content-Encoding"] = self.content_encoding
+        return headers
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # Headers & body are written separately: avoid waiting for delayed ACKs
+    disable_nagle_algorithm = True
+    server: "FakeBlobServer"
+
+    def log_message(self, *args):
+        pass
+
+    def _parse(self) -> Tuple[str, Optional[str], Dict[str, str]]:
+        url = urlsplit(self.path)
+        # Path-style URLs of the emulators: /account/container/blob
+        parts = url.path.lstrip("/").split("/", 2)
+        container = parts[1] if len(parts) > 1 else ""
+        blob = unquote(parts[2]) if len(parts) > 2 and parts[2] else None
+        return container, blob, dict(parse_qsl(url.query, keep_blank_values=True))
+
+    def _read_body(self) -> bytes:
+        return self.rfile.read(int(self.headers.get("Content-Length") or 0))
+
+    def _send(
+        self,
+        status: int,
+        body: bytes = b"",
+        headers: Optional[Dict[str, str]] = None,
+        content_length: Optional[int] = None,
+    ):
+        self.send_response(status)
+        self.send_header("x-ms-request-id", str(uuid.uuid4()))
+        self.send_header("x-ms-version", API_VERSION)
+        self.send_header("Date", formatdate(usegmt=True))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header(
+            "Content-Length",
+            str(len(body) if content_length is None else content_length),
+        )
+        self.end_headers()
+        # Responses to HEAD requests have headers only, even for errors
+        if body and self.command != "HEAD":
+            self.wfile.write(body)
+
+    def _send_error(self, status: int, code: str):
+        body = '<?xml version="1.0" encoding="utf-8"?><Error><Code>{0}</Code><Message>{0}</Message></Error>'.format(
+            code
+        ).encode()
+        self._send(
+            status, body, {"x-ms-error-code": code, "Content-Type": "application/xml"}
+        )
+
+    def do_PUT(self):
+        container, blob, query = self._parse()
+        body = self._read_body()
+        store = self.server.store
+        with self.server.lock:
+            if blob is None:
+                if container in store:
+                    return self._send_error(409, "ContainerAlreadyExists")
+                store[container] = {}
+                return self._send(
+                    201,
+                    headers={"ETag": '"0x1"', "Last-Modified": formatdate(usegmt=True)},
+                )
+            if container not in store:
+                return self._send_error(404, "ContainerNotFound")
+            blobs = store[container]
+            if query.get("comp") == "block":
+                self.server.blocks[(container, blob, query["blockid"])] = body
+                return self._send(201)
+            if self.headers.get("If-None-Match") == "*" and blob in blobs:
+                return self._send_error(409, "BlobAlreadyExists")
+            if query.get("comp") == "blocklist":
+                block_ids = re.findall(
+                    r"<(?:Latest|Committed|Uncommitted)>([^<]*)</", body.decode()
+                )
+                try:
+                    data = b"".join(
+                        self.server.blocks.pop((container, blob, block_id))
+                        for block_id in block_ids
+                    )
+                except KeyError:
+                    return self._send_error(400, "InvalidBlockList")
+            else:
+                data = body
+            blobs[blob] = _Blob(data, self.headers.get("x-ms-blob-content-encoding"))
+            headers = blobs[blob].get_headers()
+            del headers["Content-Type"], headers["x-ms-blob-type"]
+            headers.pop("Content-Encoding", None)
+            return self._send(201, headers=headers)
+
+    def do_HEAD(self):
+        self._get(head=True)
+
+    def do_GET(self):
+        self._get(head=False)
+
+    def _get(self, head: bool):
+        container, blob, query = self._parse()
+        with self.server.lock:
+            blobs = self.server.store.get(container)
+            if blobs is None:
+                return self._send_error(404, "ContainerNotFound")
+            if blob is None:
+                if query.get("comp") == "list":
+                    return self._list(container, blobs, query)
+                return self._send(
+                    200,
+                    headers={"ETag": '"0x1"', "Last-Modified": formatdate(usegmt=True)},
+                )
+            if query.get("comp") == "blocklist":
+                return self._block_list(container, blob)
+            item = blobs.get(blob)
+        if item is None:
+            return self._send_error(404, "BlobNotFound")
+        if self.headers.get("If-Match") not in (None, "*", item.etag):
+            return self._send_error(412, "ConditionNotMet")
+        headers = item.get_headers()
+        size = len(item.data)
+        if head:
+            return self._send(200, headers=headers, content_length=size)
+        data, status = item.data, 200
+        byte_range = self.headers.get("x-ms-range") or self.headers.get("Range")
+        if byte_range:
+            start, _, end = byte_range.split("=", 1)[1].partition("-")
+            start = int(start)
+            if start >= size:
+                return self._send_error(416, "InvalidRange")
+            end = min(int(end), size - 1) if end else size - 1
+            data, status = item.data[start : end + 1], 206
+            headers["Content-Range"] = "bytes {}-{}/{}".format(start, end, size)
+        self._send(status, data, headers)
+
+    def _block_list(self, container: str, blob: str):
+        # Only uncommitted blocks are kept once a block list is committed
+        blocks = "".join(
+            "<Block><Name>{}</Name><Size>{}</Size></Block>".format(
+                escape(block_id), len(data)
+            )
+            for (
+                block_container,
+                block_blob,
+                block_id,
+            ), data in self.server.blocks.items()
+            if (block_container, block_blob) == (container, blob)
+        )
+        if not blocks and blob not in self.server.store[container]:
+            return self._send_error(404, "BlobNotFound")
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?><BlockList><CommittedBlocks />'
+            "<UncommittedBlocks>{}</UncommittedBlocks></BlockList>".format(blocks)
+        ).encode()
+        self._send(200, body, {"Content-Type": "application/xml"})
+
+    def _list(self, container: str, blobs: Dict[str, _Blob], query: Dict[str, str]):
+        prefix = query.get("prefix", "")
+        delimiter = query.get("delimiter")
+        max_results = int(query.get("maxresults") or 5000)
+        names = sorted(blobs)
+        i = bisect.bisect_left(names, query.get("marker") or prefix)
+        entries, next_marker = [], None
+        while i < len(names) and names[i].startswith(prefix):
+            name = names[i]
+            if len(entries) >= max_results:
+                next_marker = name
+                break
+            cut = name.find(delimiter, len(prefix)) if delimiter else -1
+            if cut >= 0:
+                sub_prefix = name[: cut + len(delimiter)]
+                entries.append(
+                    "<BlobPrefix><Name>{}</Name></BlobPrefix>".format(
+                        escape(sub_prefix)
+                    )
+                )
+                # Skip the blobs of the virtual directory
+                i = bisect.bisect_left(
+                    names, sub_prefix[:-1] + chr(ord(sub_prefix[-1]) + 1)
+                )
+                continue
+            item = blobs[name]
+            entries.append(
+                "<Blob><Name>{}</Name><Properties><Last-Modified>{}</Last-Modified><Etag>{}</Etag>"
+                "<Content-Length>{}</Content-Length><Content-Type>application/octet-stream</Content-Type>"
+                "<Content-MD5>{}</Content-MD5><BlobType>BlockBlob</BlobType></Properties></Blob>".format(
+                    escape(name),
+                    item.last_modified,
+                    item.etag.strip('"'),
+                    len(item.data),
+                    item.content_md5,
+                )
+            )
+            i += 1
+        body = (
+            '<?xml version="1.0" encoding="utf-8"?><EnumerationResults ContainerName="{}">'
+            "<Prefix>{}</Prefix><MaxResults>{}</MaxResults>{}<Blobs>{}</Blobs><NextMarker>{}</NextMarker>"
+            "</EnumerationResults>".format(
+                escape(container),
+                escape(prefix),
+                max_results,
+                (
+                    "<Delimiter>{}</Delimiter>".format(escape(delimiter))
+                    if delimiter
+                    else ""
+                ),
+                "".join(entries),
+                escape(next_marker or ""),
+            )
+        ).encode()
+        self._send(200, body, {"Content-Type": "application/xml"})
+
+    def do_DELETE(self):
+        container, blob, _ = self._parse()
+        self._read_body()
+        with self.server.lock:
+            if blob is None:
+                if self.server.store.pop(container, None) is None:
+                    return self._send_error(404, "ContainerNotFound")
+                return self._send(202)
+            if self.server.store.get(container, {}).pop(blob, None) is None:
+                return self._send_error(404, "BlobNotFound")
+        self._send(202)
+
+    def do_POST(self):
+        container, _, query = self._parse()
+        body = self._read_body()
+        if query.get("comp") != "batch":
+            return self._send_error(400, "UnsupportedQueryParameter")
+        boundary = "batchresponse_{}".format(uuid.uuid4())
+        parts = []
+        paths = re.findall(r"^DELETE (\S+) HTTP/1.1", body.decode(), re.MULTILINE)
+        if len(paths) > 256:
+            return self._send_error(400, "ExceedsMaxBatchRequestCount")
+        with self.server.lock:
+            blobs = self.server.store.get(container, {})
+            for content_id, path in enumerate(paths):
+                name = unquote(urlsplit(path).path.lstrip("/").split("/", 2)[-1])
+                if blobs.pop(name, None) is None:
+                    status = "404 The specified blob does not exist.\r\nx-ms-error-code: BlobNotFound"
+                else:
+                    status = "202 Accepted\r\nx-ms-delete-type-permanent: true"
+                parts.append(
+                    "--{}\r\nContent-Type: application/http\r\nContent-ID: {}\r\n\r\n"
+                    "HTTP/1.1 {}\r\nx-ms-request-id: {}\r\nx-ms-version: {}\r\n"
+                    "Content-Length: 0\r\n\r\n".format(
+                        boundary, content_id, status, uuid.uuid4(), API_VERSION
+                    )
+                )
+        response = ("".join(parts) + "--{}--\r\n".format(boundary)).encode()
+        self._send(
+            202,
+            response,
+            {"Content-Type": "multipart/mixed; boundary={}".format(boundary)},
+        )
+
+
+class FakeBlobServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host: Optional[str] = "127.0.0.1", port: Optional[int] = 0):
+        """
+        In-memory Blob Storage service served over HTTP in a background thread, for benchmarks
+
+        It implements the subset of the REST API used by the library (containers, block blobs, ranged reads,
+        listings, batch deletes), with path-style URLs like Azurite. Requests are not authenticated.
+
+        Args:
+            host: address to listen on
+            port: port to listen on, 0 for a free port
+        """
+        super().__init__((host, port), _Handler)
+        self.store = {}
+        self.blocks = {}
+        self.lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def connection_string(self) -> str:
+        """
+        Connection string of the fake account
+
+        Returns:
+
+        """
+        host, port = self.server_address[:2]
+        return (
+            "DefaultEndpointsProtocol=http;AccountName={0};AccountKey={1};"
+            "BlobEndpoint=http://{2}:{3}/{0};".format(
+                ACCOUNT_NAME, ACCOUNT_KEY, host, port
+            )
+        )
+
+    def start(self) -> "FakeBlobServer":
+        """
+        Serve requests in a background thread
+
+        Returns:
+
+        """
+        self._thread = threading.Thread(target=self.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        """
+        Stop serving and close the socket
+
+        Returns:
+
+        """
+        self.shutdown()
+        self.server_close()
+
+    def put_blobs(self, container: str, blobs: Dict[str, bytes]):
+        """
+        Store blobs directly, without HTTP requests, eg. to seed large listings quickly
+
+        Args:
+            container: Name of the container, created if needed
+            blobs: content of the blobs by name
+
+        Returns:
+
+        """
+        with self.lock:
+            store = self.store.setdefault(container, {})
+            for name, data in blobs.items():
+                store[name] = _Blob(data)
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *args):
+        self.stop()
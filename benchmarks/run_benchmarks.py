@@ -0,0 +1,819 @@
+"""
+Benchmarks of the sync & async transfer paths
+
+By default, they run against an in-process fake of the Blob service (see fake_blob_server.py), which measures the
+overhead of the library & the SDK over loopback HTTP. Give the connection string of Azurite or of a storage
+account to run them against a real endpoint:
+
+    python benchmarks/run_benchmarks.py
+    python benchmarks/run_benchmarks.py --connection-string "DefaultEndpointsProtocol=http;AccountName=..."
+    python benchmarks/run_benchmarks.py --save-baseline   # store the results in benchmarks/baseline.json
+    python benchmarks/run_benchmarks.py --check           # exit with 1 if a scenario is slower than the baseline
+
+Throughput depends on the machine: store baselines from the machine that checks them.
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import math
+import os
+import platform
+import sys
+import tempfile
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from azure_blobstorage_utils import BlobStorageBase, BlobStorageBaseAsync
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+from fake_blob_server import FakeBlobServer  # noqa: E402
+
+try:
+    import numpy as np
+    import pandas as pd
+    from simplejpeg import encode_jpeg
+
+    from azure_blobstorage_utils import BlobStorageExtended, BlobStorageExtendedAsync
+except ImportError:
+    BlobStorageExtended = BlobStorageExtendedAsync = None
+
+BASELINE_FILE_NAME = os.path.join(os.path.dirname(__file__), "baseline.json")
+KIB = 1024
+MIB = 1024 * 1024
+
+# Latencies of each timed call, number of items (blobs, images...) processed, bytes transferred
+Measures = Tuple[List[float], int, int]
+
+
+class Config:
+    def __init__(self, scale: float = 1.0):
+        """
+        Sizes of the benchmarks
+
+        Args:
+            scale: factor applied to the number & size of the blobs
+        """
+        self.small_count = max(int(200 * scale), 1)
+        self.small_size = 4 * KIB
+        self.large_size = max(int(32 * MIB * scale), MIB)
+        self.large_repeat = 3
+        self.block_size = 4 * MIB
+        self.directory_count = max(int(100 * scale), 1)
+        self.directory_file_size = 64 * KIB
+        self.directory_repeat = 3
+        self.listing_count = max(int(2000 * scale), 1)
+        self.listing_directories = 20
+        self.listing_repeat = 5
+        self.concurrency = 8
+        self.dataframe_rows = max(int(100000 * scale), 1)
+        self.dataframe_repeat = 5
+        self.image_count = max(int(64 * scale), 1)
+        self.image_size = 256
+        self.image_repeat = 5
+
+
+def _timed(latencies: List[float], func: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+async def _timed_async(latencies: List[float], func: Callable, *args, **kwargs):
+    start = time.perf_counter()
+    result = await func(*args, **kwargs)
+    latencies.append(time.perf_counter() - start)
+    return result
+
+
+def _populate(
+    client: BlobStorageBase, container_name: str, names: Iterable[str], data: bytes
+):
+    """
+    Upload the blobs read by a scenario, outside of the timed section
+    """
+    with ThreadPoolExecutor(max_workers=16) as executor:
+        list(
+            executor.map(
+                lambda name: client.upload_bytes(
+                    data, container_name, name, overwrite=True
+                ),
+                names,
+            )
+        )
+
+
+def _write_local_directory(directory: str, count: int, size: int):
+    os.makedirs(directory, exist_ok=True)
+    for i in range(count):
+        with open(os.path.join(directory, "file_{:05d}.bin".format(i)), "wb") as f:
+            f.write(os.urandom(size))
+
+
+def _get_dataframe(rows: int) -> "pd.DataFrame":
+    rng = np.random.default_rng(0)
+    return pd.DataFrame(
+        {
+            "id": np.arange(rows),
+            "value": rng.random(rows),
+            "label": rng.choice(["a", "b", "c", "d"], rows),
+        }
+    )
+
+
+def _get_jpeg(size: int) -> bytes:
+    rng = np.random.default_rng(0)
+    image = rng.integers(0, 256, (size, size, 3), dtype=np.uint8)
+    return encode_jpeg(image, quality=85)
+
+
+class SyncScenarios:
+    def __init__(self, client: BlobStorageBase, workdir: str, config: Config):
+        self.client = client
+        self.workdir = workdir
+        self.config = config
+        self.container_name = "bench-sync-{}".format(uuid.uuid4().hex[:8])
+        client.create_container(self.container_name)
+
+    def small_upload(self) -> Measures:
+        config, latencies = self.config, []
+        data = os.urandom(config.small_size)
+        for i in range(config.small_count):
+            _timed(
+                latencies,
+                self.client.upload_bytes,
+                data,
+                self.container_name,
+                "small_upload/{:05d}".format(i),
+                overwrite=True,
+            )
+        return latencies, config.small_count, config.small_count * config.small_size
+
+    def small_download(self) -> Measures:
+        config, latencies = self.config, []
+        names = ["small_download/{:05d}".format(i) for i in range(config.small_count)]
+        _populate(
+            self.client, self.container_name, names, os.urandom(config.small_size)
+        )
+        for name in names:
+            _timed(latencies, self.client.get_file_as_bytes, self.container_name, name)
+        return latencies, len(names), len(names) * config.small_size
+
+    def large_upload(self) -> Measures:
+        config, latencies = self.config, []
+        local_file_name = os.path.join(self.workdir, "large_upload.bin")
+        with open(local_file_name, "wb") as f:
+            f.write(os.urandom(config.large_size))
+        for _ in range(config.large_repeat):
+            _timed(
+                latencies,
+                self.client.upload_file,
+                self.container_name,
+                local_file_name,
+                "large/upload.bin",
+                overwrite=True,
+                block_size=config.block_size,
+                max_concurrency=config.concurrency,
+            )
+        return latencies, config.large_repeat, config.large_repeat * config.large_size
+
+    def large_download(self) -> Measures:
+        config, latencies = self.config, []
+        _populate(
+            self.client,
+            self.container_name,
+            ["large/download.bin"],
+            os.urandom(config.large_size),
+        )
+        for _ in range(config.large_repeat):
+            _timed(
+                latencies,
+                self.client.download_file,
+                self.container_name,
+                "large/download.bin",
+                os.path.join(self.workdir, "large_download.bin"),
+                chunk_size=config.block_size,
+                max_concurrency=config.concurrency,
+                large_file_threshold=config.block_size,
+            )
+        return latencies, config.large_repeat, config.large_repeat * config.large_size
+
+    def directory_upload(self) -> Measures:
+        config, latencies = self.config, []
+        directory = os.path.join(self.workdir, "directory_upload")
+        _write_local_directory(
+            directory, config.directory_count, config.directory_file_size
+        )
+        for _ in range(config.directory_repeat):
+            _timed(
+                latencies,
+                self.client.upload_directory,
+                self.container_name,
+                directory,
+                "directory_upload/",
+                overwrite=True,
+            )
+        items = config.directory_repeat * config.directory_count
+        return latencies, items, items * config.directory_file_size
+
+    def directory_download(self) -> Measures:
+        config, latencies = self.config, []
+        names = [
+            "directory_download/{:05d}".format(i) for i in range(config.directory_count)
+        ]
+        _populate(
+            self.client,
+            self.container_name,
+            names,
+            os.urandom(config.directory_file_size),
+        )
+        for i in range(config.directory_repeat):
+            _timed(
+                latencies,
+                self.client.download_directory,
+                self.container_name,
+                "directory_download/",
+                os.path.join(self.workdir, "directory_download_{}/".format(i)),
+                max_workers=config.concurrency,
+            )
+        items = config.directory_repeat * config.directory_count
+        return latencies, items, items * config.directory_file_size
+
+    def _populate_listing(self) -> str:
+        config = self.config
+        names = [
+            "listing/{:03d}/{:05d}".format(i % config.listing_directories, i)
+            for i in range(config.listing_count)
+        ]
+        _populate(self.client, self.container_name, names, b"")
+        return "listing/"
+
+    def listing(self) -> Measures:
+        config, latencies = self.config, []
+        prefix = self._populate_listing()
+        for _ in range(config.listing_repeat):
+            _timed(
+                latencies,
+                self.client.get_list_blobs_name,
+                self.container_name,
+                prefix,
+            )
+        return latencies, config.listing_repeat * config.listing_count, 0
+
+    def listing_parallel(self) -> Measures:
+        config, latencies = self.config, []
+        prefix = self._populate_listing()
+        for _ in range(config.listing_repeat):
+            _timed(
+                latencies,
+                lambda: list(
+                    self.client.list_blobs_parallel(
+                        self.container_name, prefix, max_concurrency=config.concurrency
+                    )
+                ),
+            )
+        return latencies, config.listing_repeat * config.listing_count, 0
+
+    def delete(self) -> Measures:
+        config, latencies = self.config, []
+        prefix = self._populate_listing()
+        _timed(
+            latencies,
+            self.client.delete_prefix,
+            self.container_name,
+            prefix,
+            max_concurrency=config.concurrency,
+        )
+        return latencies, config.listing_count, 0
+
+    def pandas_upload(self) -> Measures:
+        config, latencies = self.config, []
+        df = _get_dataframe(config.dataframe_rows)
+        for _ in range(config.dataframe_repeat):
+            _timed(
+                latencies,
+                self.client.upload_pandas_df,
+                df,
+                self.container_name,
+                "pandas/upload.parquet",
+                overwrite=True,
+            )
+        size = len(
+            self.client.get_file_as_bytes(self.container_name, "pandas/upload.parquet")
+        )
+        return latencies, config.dataframe_repeat, config.dataframe_repeat * size
+
+    def pandas_download(self) -> Measures:
+        config, latencies = self.config, []
+        data = io.BytesIO()
+        _get_dataframe(config.dataframe_rows).to_parquet(data)
+        _populate(
+            self.client,
+            self.container_name,
+            ["pandas/download.parquet"],
+            data.getvalue(),
+        )
+        for _ in range(config.dataframe_repeat):
+            _timed(
+                latencies,
+                self.client.get_file_as_pandas_df,
+                self.container_name,
+                "pandas/download.parquet",
+            )
+        return (
+            latencies,
+            config.dataframe_repeat,
+            config.dataframe_repeat * len(data.getvalue()),
+        )
+
+    def jpeg_batch(self) -> Measures:
+        config, latencies = self.config, []
+        names = ["jpeg/{:05d}.jpg".format(i) for i in range(config.image_count)]
+        data = _get_jpeg(config.image_size)
+        _populate(self.client, self.container_name, names, data)
+        for _ in range(config.image_repeat):
+            _timed(
+                latencies,
+                self.client.get_images_as_numpy_batch,
+                self.container_name,
+                names,
+                max_concurrency=config.concurrency,
+            )
+        items = config.image_repeat * config.image_count
+        return latencies, items, items * len(data)
+
+
+class AsyncScenarios:
+    def __init__(
+        self,
+        client: BlobStorageBaseAsync,
+        setup_client: BlobStorageBase,
+        workdir: str,
+        config: Config,
+    ):
+        self.client = client
+        self.setup_client = setup_client
+        self.workdir = workdir
+        self.config = config
+        self.container_name = "bench-async-{}".format(uuid.uuid4().hex[:8])
+        setup_client.create_container(self.container_name)
+
+    async def small_upload(self) -> Measures:
+        config, latencies = self.config, []
+        data = os.urandom(config.small_size)
+        for i in range(config.small_count):
+            await _timed_async(
+                latencies,
+                self.client.upload_bytes,
+                data,
+                self.container_name,
+                "small_upload/{:05d}".format(i),
+                overwrite=True,
+            )
+        return latencies, config.small_count, config.small_count * config.small_size
+
+    async def small_download(self) -> Measures:
+        config, latencies = self.config, []
+        names = ["small_download/{:05d}".format(i) for i in range(config.small_count)]
+        _populate(
+            self.setup_client,
+            self.container_name,
+            names,
+            os.urandom(config.small_size),
+        )
+        for name in names:
+            await _timed_async(
+                latencies, self.client.get_file_as_bytes, self.container_name, name
+            )
+        return latencies, len(names), len(names) * config.small_size
+
+    async def large_upload(self) -> Measures:
+        config, latencies = self.config, []
+        local_file_name = os.path.join(self.workdir, "large_upload_async.bin")
+        with open(local_file_name, "wb") as f:
+            f.write(os.urandom(config.large_size))
+        for _ in range(config.large_repeat):
+            await _timed_async(
+                latencies,
+                self.client.upload_file,
+                self.container_name,
+                local_file_name,
+                "large/upload.bin",
+                overwrite=True,
+                block_size=config.block_size,
+                max_concurrency=config.concurrency,
+            )
+        return latencies, config.large_repeat, config.large_repeat * config.large_size
+
+    async def large_download(self) -> Measures:
+        config, latencies = self.config, []
+        _populate(
+            self.setup_client,
+            self.container_name,
+            ["large/download.bin"],
+            os.urandom(config.large_size),
+        )
+        for _ in range(config.large_repeat):
+            await _timed_async(
+                latencies,
+                self.client.download_file,
+                self.container_name,
+                "large/download.bin",
+                os.path.join(self.workdir, "large_download_async.bin"),
+                chunk_size=config.block_size,
+                max_concurrency=config.concurrency,
+                large_file_threshold=config.block_size,
+            )
+        return latencies, config.large_repeat, config.large_repeat * config.large_size
+
+    async def directory_upload(self) -> Measures:
+        config, latencies = self.config, []
+        directory = os.path.join(self.workdir, "directory_upload_async")
+        _write_local_directory(
+            directory, config.directory_count, config.directory_file_size
+        )
+        for _ in range(config.directory_repeat):
+            await _timed_async(
+                latencies,
+                self.client.upload_directory,
+                self.container_name,
+                directory,
+                "directory_upload/",
+                overwrite=True,
+                concurrency=config.concurrency,
+            )
+        items = config.directory_repeat * config.directory_count
+        return latencies, items, items * config.directory_file_size
+
+    async def directory_download(self) -> Measures:
+        config, latencies = self.config, []
+        names = [
+            "directory_download/{:05d}".format(i) for i in range(config.directory_count)
+        ]
+        _populate(
+            self.setup_client,
+            self.container_name,
+            names,
+            os.urandom(config.directory_file_size),
+        )
+        for i in range(config.directory_repeat):
+            await _timed_async(
+                latencies,
+                self.client.download_directory,
+                self.container_name,
+                "directory_download/",
+                os.path.join(self.workdir, "directory_download_async_{}/".format(i)),
+                concurrency=config.concurrency,
+            )
+        items = config.directory_repeat * config.directory_count
+        return latencies, items, items * config.directory_file_size
+
+    def _populate_listing(self) -> str:
+        config = self.config
+        names = [
+            "listing/{:03d}/{:05d}".format(i % config.listing_directories, i)
+            for i in range(config.listing_count)
+        ]
+        _populate(self.setup_client, self.container_name, names, b"")
+        return "listing/"
+
+    async def listing(self) -> Measures:
+        config, latencies = self.config, []
+        prefix = self._populate_listing()
+        for _ in range(config.listing_repeat):
+            await _timed_async(
+                latencies,
+                self.client.get_list_blobs_name,
+                self.container_name,
+                prefix,
+            )
+        return latencies, config.listing_repeat * config.listing_count, 0
+
+    async def listing_parallel(self) -> Measures:
+        config, latencies = self.config, []
+        prefix = self._populate_listing()
+
+        async def _list():
+            return [
+                blob
+                async for blob in self.client.list_blobs_parallel(
+                    self.container_name, prefix, concurrency=config.concurrency
+                )
+            ]
+
+        for _ in range(config.listing_repeat):
+            await _timed_async(latencies, _list)
+        return latencies, config.listing_repeat * config.listing_count, 0
+
+    async def delete(self) -> Measures:
+        config, latencies = self.config, []
+        prefix = self._populate_listing()
+        await _timed_async(
+            latencies,
+            self.client.delete_prefix,
+            self.container_name,
+            prefix,
+            max_concurrency=config.concurrency,
+        )
+        return latencies, config.listing_count, 0
+
+    async def pandas_upload(self) -> Measures:
+        config, latencies = self.config, []
+        df = _get_dataframe(config.dataframe_rows)
+        for _ in range(config.dataframe_repeat):
+            await _timed_async(
+                latencies,
+                self.client.upload_pandas_df,
+                df,
+                self.container_name,
+                "pandas/upload.parquet",
+                overwrite=True,
+            )
+        size = len(
+            self.setup_client.get_file_as_bytes(
+                self.container_name, "pandas/upload.parquet"
+            )
+        )
+        return latencies, config.dataframe_repeat, config.dataframe_repeat * size
+
+    async def pandas_download(self) -> Measures:
+        config, latencies = self.config, []
+        data = io.BytesIO()
+        _get_dataframe(config.dataframe_rows).to_parquet(data)
+        _populate(
+            self.setup_client,
+            self.container_name,
+            ["pandas/download.parquet"],
+            data.getvalue(),
+        )
+        for _ in range(config.dataframe_repeat):
+            await _timed_async(
+                latencies,
+                self.client.get_file_as_pandas_df,
+                self.container_name,
+                "pandas/download.parquet",
+            )
+        return (
+            latencies,
+            config.dataframe_repeat,
+            config.dataframe_repeat * len(data.getvalue()),
+        )
+
+    async def jpeg_batch(self) -> Measures:
+        config, latencies = self.config, []
+        names = ["jpeg/{:05d}.jpg".format(i) for i in range(config.image_count)]
+        data = _get_jpeg(config.image_size)
+        _populate(self.setup_client, self.container_name, names, data)
+        for _ in range(config.image_repeat):
+            await _timed_async(
+                latencies,
+                self.client.get_images_as_numpy_batch,
+                self.container_name,
+                names,
+                concurrency=config.concurrency,
+            )
+        items = config.image_repeat * config.image_count
+        return latencies, items, items * len(data)
+
+
+BASE_SCENARIOS = (
+    "small_upload",
+    "small_download",
+    "large_upload",
+    "large_download",
+    "directory_upload",
+    "directory_download",
+    "listing",
+    "listing_parallel",
+    "delete",
+)
+EXTENDED_SCENARIOS = ("pandas_upload", "pandas_download", "jpeg_batch")
+
+
+def get_percentile(values: List[float], percentile: float) -> float:
+    """
+    Get a percentile of values with the nearest-rank method
+
+    Args:
+        values: measured values
+        percentile: percentile between 0 and 100
+
+    Returns:
+
+    """
+    values = sorted(values)
+    rank = max(math.ceil(percentile / 100 * len(values)), 1)
+    return values[rank - 1]
+
+
+def summarize(measures: Measures) -> Dict[str, float]:
+    """
+    Summarize the measures of a scenario
+
+    Args:
+        measures: latencies of the timed calls, number of items, bytes transferred
+
+    Returns: a dict with ops_per_s (items per second), mb_per_s, p50_ms & p99_ms (latency of the timed calls)
+
+    """
+    latencies, items, size = measures
+    total = sum(latencies)
+    return {
+        "ops_per_s": round(items / total, 2),
+        "mb_per_s": round(size / total / 1e6, 2),
+        "p50_ms": round(get_percentile(latencies, 50) * 1000, 3),
+        "p99_ms": round(get_percentile(latencies, 99) * 1000, 3),
+        "calls": len(latencies),
+    }
+
+
+def run_sync(
+    connection_string: str, workdir: str, config: Config, scenarios: List[str]
+) -> Dict[str, Dict[str, float]]:
+    client_class = BlobStorageExtended or BlobStorageBase
+    results = {}
+    with client_class(
+        connection_string,
+        os.path.join(workdir, "sync/"),
+        connection_pool_size=4 * config.concurrency,
+    ) as client:
+        bench = SyncScenarios(client, workdir, config)
+        try:
+            for name in scenarios:
+                results[name] = summarize(getattr(bench, name)())
+                print_result("sync", name, results[name])
+        finally:
+            client.delete_container(bench.container_name)
+    return results
+
+
+async def run_async(
+    connection_string: str, workdir: str, config: Config, scenarios: List[str]
+) -> Dict[str, Dict[str, float]]:
+    client_class = BlobStorageExtendedAsync or BlobStorageBaseAsync
+    results = {}
+    with BlobStorageBase(
+        connection_string,
+        os.path.join(workdir, "setup/"),
+        connection_pool_size=16,
+    ) as setup_client:
+        async with client_class(
+            connection_string,
+            os.path.join(workdir, "async/"),
+            connection_pool_size=4 * config.concurrency,
+        ) as client:
+            bench = AsyncScenarios(client, setup_client, workdir, config)
+            try:
+                for name in scenarios:
+                    results[name] = summarize(await getattr(bench, name)())
+                    print_result("async", name, results[name])
+            finally:
+                setup_client.delete_container(bench.container_name)
+    return results
+
+
+def print_result(
+    mode: str,
+    name: str,
+    result: Dict[str, float],
+    baseline: Optional[Dict[str, float]] = None,
+):
+    line = "{:<6} {:<20} {:>12.1f} ops/s {:>10.2f} MB/s   p50 {:>10.3f} ms   p99 {:>10.3f} ms".format(
+        mode,
+        name,
+        result["ops_per_s"],
+        result["mb_per_s"],
+        result["p50_ms"],
+        result["p99_ms"],
+    )
+    if baseline is not None:
+        line += "   {:+.0%} vs baseline".format(
+            result["ops_per_s"] / baseline["ops_per_s"] - 1
+        )
+    print(line, flush=True)
+
+
+def compare(
+    results: Dict[str, Dict[str, Dict[str, float]]],
+    baseline: Dict[str, Dict[str, Dict[str, float]]],
+    tolerance: float,
+) -> List[str]:
+    """
+    Compare results with a baseline
+
+    Args:
+        results: {mode: {scenario: summary}}
+        baseline: {mode: {scenario: summary}} of a previous run
+        tolerance: relative loss of throughput tolerated (eg. 0.2 for 20 %)
+
+    Returns: the "mode/scenario" whose throughput is below the baseline by more than tolerance
+
+    """
+    regressions = []
+    print("\nComparison with the baseline")
+    for mode, scenarios in results.items():
+        for name, result in scenarios.items():
+            reference = baseline.get(mode, {}).get(name)
+            if reference is None:
+                continue
+            print_result(mode, name, result, reference)
+            if result["ops_per_s"] < reference["ops_per_s"] * (1 - tolerance):
+                regressions.append("{}/{}".format(mode, name))
+    return regressions
+
+
+def main(argv: Optional[List[str]] = None) -> int:
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        "--connection-string",
+        default=os.environ.get("AZURE_STORAGE_CONNECTION_STRING"),
+        help="connection string of Azurite or of a storage account (default: in-process fake service)",
+    )
+    parser.add_argument(
+        "--scenarios",
+        help="comma separated scenarios (default: all): "
+        + ",".join(BASE_SCENARIOS + EXTENDED_SCENARIOS),
+    )
+    parser.add_argument("--modes", default="sync,async", help="sync, async or both")
+    parser.add_argument(
+        "--scale", type=float, default=1.0, help="factor applied to sizes & counts"
+    )
+    parser.add_argument("--baseline", default=BASELINE_FILE_NAME)
+    parser.add_argument(
+        "--save-baseline", action="store_true", help="store results as the baseline"
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="exit with 1 if a scenario is slower than the baseline by more than --tolerance",
+    )
+    parser.add_argument("--tolerance", type=float, default=0.2)
+    args = parser.parse_args(argv)
+
+    scenarios = list(BASE_SCENARIOS)
+    if BlobStorageExtended is not None:
+        scenarios += EXTENDED_SCENARIOS
+    else:
+        print("Extended scenarios skipped: install with extras to run them")
+    if args.scenarios:
+        scenarios = [name for name in args.scenarios.split(",") if name in scenarios]
+    modes = args.modes.split(",")
+    config = Config(args.scale)
+
+    server = None
+    connection_string = args.connection_string
+    if connection_string is None:
+        server = FakeBlobServer().start()
+        connection_string = server.connection_string
+    results = {}
+    try:
+        with tempfile.TemporaryDirectory() as workdir:
+            if "sync" in modes:
+                results["sync"] = run_sync(
+                    connection_string, workdir, config, scenarios
+                )
+            if "async" in modes:
+                results["async"] = asyncio.run(
+                    run_async(connection_string, workdir, config, scenarios)
+                )
+    finally:
+        if server is not None:
+            server.stop()
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump(
+                dict(
+                    results,
+                    environment={
+                        "endpoint": "fake" if server is not None else "custom",
+                        "python": platform.python_version(),
+                        "platform": platform.platform(),
+                        "scale": args.scale,
+                    },
+                ),
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+        print("\nBaseline stored in {}".format(args.baseline))
+    elif os.path.exists(args.baseline):
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get("environment", {}).get("scale", 1.0) != args.scale:
+            print("\nBaseline was measured with another --scale, not compared")
+            return 0
+        regressions = compare(results, baseline, args.tolerance)
+        if regressions:
+            print("\nRegressions: {}".format(", ".join(regressions)))
+            if args.check:
+                return 1
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,4 +1,39 @@
+import importlib
+from typing import TYPE_CHECKING
+
 from .base import BlobStorageBase
 from .base_async import BlobStorageBaseAsync
-from .extended import BlobStorageExtended
-from .extended_async import BlobStorageExtendedAsync
+from .cache import BlobCache
+from .governor import AsyncConcurrencyGovernor, ConcurrencyGovernor
+from .index import BlobIndex
+from .metrics import (
+    BlobObserver,
+    CallbackObserver,
+    MetricsCollector,
+    OpenTelemetryObserver,
+    PrometheusObserver,
+)
+
+# The extended classes need the extras (numpy, pandas, pyarrow, simplejpeg): they are imported on first access,
+# so that importing the package stays fast, and missing extras raise ImportError only when they are used
+_LAZY_ATTRIBUTES = {
+    "BlobStorageExtended": ".extended",
+    "BlobStorageExtendedAsync": ".extended_async",
+}
+
+if TYPE_CHECKING:
+    from .extended import BlobStorageExtended
+    from .extended_async import BlobStorageExtendedAsync
+
+
+def __getattr__(name: str):
+    module_name = _LAZY_ATTRIBUTES.get(name)
+    if module_name is None:
+        raise AttributeError("module {!r} has no attribute {!r}".format(__name__, name))
+    value = getattr(importlib.import_module(module_name, __name__), name)
+    globals()[name] = value
+    return value
+
+
+def __dir__():
+    return sorted(list(globals()) + list(_LAZY_ATTRIBUTES))
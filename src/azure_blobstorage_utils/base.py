@@ -1,28 +1,161 @@
+import base64
+import contextlib
+import functools
+import hashlib
+import io
 import json
+import logging
+import math
+import mmap
 import os
 import shutil
-from typing import Iterable, List, Optional, Tuple, Union
-
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
-from azure.storage.blob import BlobServiceClient
+import threading
+import time
+import uuid
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+)
+from azure.core.pipeline.transport import HttpTransport
+from azure.storage.blob import BlobBlock, BlobProperties, BlobServiceClient
+
+from .cache import BlobCache
+from .compression import (
+    compress_bytes,
+    decompress_bytes,
+    decompress_chunks,
+    get_content_encoding,
+    get_content_settings,
+)
+from .governor import ConcurrencyGovernor
+from .index import BlobIndex
+from .metrics import BlobObserver, bind_context, instrumented, observe_response
+from .streams import MAX_BLOCK_COUNT, BlobReader, BlobWriter, ChunkIteratorReader
+from .transports import PooledRequestsTransport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+DELETE_BATCH_SIZE = 256
+# Block upload journals are kept under local_base_path, directory walks skip them
+UPLOAD_JOURNAL_DIRECTORY = ".upload_journals"
+# Manifests of incremental downloads are kept in the local directory, directory walks skip them
+DOWNLOAD_MANIFEST_PREFIX = ".manifest-"
+# Parallel listing walks virtual directories until there are this many prefixes per worker
+LISTING_FAN_OUT = 4
 
 
 class BlobStorageBase:
     def __init__(
-        self, connection_string: str, local_base_path: Optional[str] = "azure_tmp/"
+        self,
+        connection_string: str,
+        local_base_path: Optional[str] = "azure_tmp/",
+        container_cache_ttl: Optional[float] = 60.0,
+        cache: Optional[BlobCache] = None,
+        index: Optional[BlobIndex] = None,
+        connection_pool_size: Optional[int] = None,
+        keep_alive: Optional[bool] = True,
+        transport: Optional[HttpTransport] = None,
+        governor: Optional[ConcurrencyGovernor] = None,
+        observers: Optional[List[BlobObserver]] = None,
     ):
         """
+        Use it as a context manager, or call close, to release its connections
 
         Args:
             connection_string: Connection string to Azure Blob Storage
             local_base_path: local folder where data will be downloaded if path is not specified
+            container_cache_ttl: seconds during which a container is known to exist without checking again.
+                None caches forever, 0 disables the cache.
+            cache: if set, get_file_as_* methods read blobs through this cache
+            index: if set, listings (get_list_blobs_name, list_blobs_parallel & directory operations) are
+                answered from this local index, listing from the service only the prefixes not indexed yet
+            connection_pool_size: maximum number of connections kept open per host, to set above max_concurrency
+                or max_workers for concurrent transfers. None for the default of requests (10)
+            keep_alive: if False, connections are closed after each request
+            transport: HTTP transport of the client, overrides connection_pool_size & keep_alive. To share
+                connections between several instances, give them the same transport built on a session that
+                you own and close (eg. RequestsTransport(session=session, session_owner=False))
+            governor: if set, bulk operations (directory transfers, blocks of upload_file, batch deletes) adapt
+                their concurrency to the throttling responses of the service, max_workers / max_concurrency
+                becoming upper bounds
+            observers: observers receiving the measures (bytes, latency, retries, HTTP status) of each
+                download, upload & delete operation (eg. MetricsCollector, PrometheusObserver)
         """
+        if transport is None and (connection_pool_size is not None or not keep_alive):
+            transport = PooledRequestsTransport(
+                pool_size=connection_pool_size or 10, keep_alive=keep_alive
+            )
+        # Observes every attempt of the retry policy
+        client_kwargs = {"raw_response_hook": self._on_response}
+        if transport is not None:
+            client_kwargs["transport"] = transport
         self.blob_service_client = BlobServiceClient.from_connection_string(
-            connection_string
+            connection_string, **client_kwargs
         )
         self.local_base_path = local_base_path
+        self.container_cache_ttl = container_cache_ttl
+        self._container_clients = {}
+        self.cache = cache
+        self.index = index
+        self.governor = governor
+        self.observers = list(observers or [])
         self.create_local_dir(self.local_base_path)
-        print("Using path: [{}] as local storage".format(self.local_base_path))
+        logger.info("Using path: [%s] as local storage", self.local_base_path)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    def close(self):
+        """
+        Close the client and its connections
+
+        Returns:
+
+        """
+        self._container_clients = {}
+        self.blob_service_client.close()
+
+    def _on_response(self, response):
+        """
+        Hook called with every response of the service, feeding the governor & the measured operation
+
+        Args:
+            response: azure.core PipelineResponse
+
+        Returns:
+
+        """
+        if self.governor is not None:
+            self.governor.on_response(response)
+        observe_response(response)
+
+    @contextlib.contextmanager
+    def _governed(self) -> Iterator[None]:
+        """
+        Context manager running one operation of a bulk operation within the limit of the governor, if any
+
+        Nested calls (eg. for the blocks of a file of a directory transfer) run within the slot of the outer one.
+
+        Returns:
+
+        """
+        if self.governor is None:
+            yield
+        else:
+            with self.governor.slot():
+                yield
 
     @classmethod
     def create_local_dir(cls, directory_name: str):
@@ -58,20 +191,81 @@ class BlobStorageBase:
         """
         Get container client from container_name
 
+        Existence of the container is checked once, then cached for container_cache_ttl seconds.
+
         Args:
             container_name: Name of the container
 
         Returns:
 
         """
+        cached = self._container_clients.get(container_name)
+        if cached is not None:
+            container_client, checked_at = cached
+            if (
+                self.container_cache_ttl is None
+                or time.monotonic() - checked_at < self.container_cache_ttl
+            ):
+                return container_client
+
         container_client = self.blob_service_client.get_container_client(container_name)
         if container_client.exists():
+            self._cache_container_client(container_name, container_client)
             return container_client
         else:
+            self.invalidate_container_cache(container_name)
             raise ResourceNotFoundError(
                 "Container [{}] does not exist.".format(container_name)
             )
 
+    def _cache_container_client(self, container_name: str, container_client):
+        """
+        Remember that container_name exists
+
+        Args:
+            container_name: Name of the container
+            container_client: client of the container
+
+        Returns:
+
+        """
+        if self.container_cache_ttl != 0:
+            self._container_clients[container_name] = (
+                container_client,
+                time.monotonic(),
+            )
+
+    def invalidate_container_cache(self, container_name: Optional[str] = None):
+        """
+        Forget cached container existence, eg. when a container was deleted by another process
+
+        Args:
+            container_name: Name of the container. If None, the whole cache is cleared
+
+        Returns:
+
+        """
+        if container_name is None:
+            self._container_clients.clear()
+        else:
+            self._container_clients.pop(container_name, None)
+
+    def _get_or_create_container_client(self, container_name: str):
+        """
+        Get container client from container_name, creating the container if needed
+
+        Args:
+            container_name: Name of the container
+
+        Returns:
+
+        """
+        try:
+            return self.get_container_client(container_name)
+        except ResourceNotFoundError:
+            self.create_container(container_name)
+            return self.get_container_client(container_name)
+
     def create_container(self, container_name: str):
         """
         Create a container named container_name
@@ -83,11 +277,14 @@ class BlobStorageBase:
 
         """
         try:
-            self.blob_service_client.create_container(name=container_name)
-        except ResourceExistsError(
-            "Container [{}] already exists. Skipping creation".format(container_name)
-        ):
-            pass
+            container_client = self.blob_service_client.create_container(
+                name=container_name
+            )
+            self._cache_container_client(container_name, container_client)
+        except ResourceExistsError:
+            logger.info(
+                "Container [%s] already exists. Skipping creation", container_name
+            )
 
     def delete_container(self, container_name: str):
         """
@@ -99,7 +296,12 @@ class BlobStorageBase:
         Returns:
 
         """
+        self.invalidate_container_cache(container_name)
         self.blob_service_client.delete_container(container_name)
+        if self.cache is not None:
+            self.cache.invalidate(container_name)
+        if self.index is not None:
+            self.index.clear(container_name)
 
     def get_blob_client(self, container_name: str, blob_name: str):
         """
@@ -125,19 +327,197 @@ class BlobStorageBase:
         """
         shutil.rmtree(self.local_base_path)
 
-    def get_file_as_bytes(self, container_name: str, remote_file_name: str) -> bytes:
+    @instrumented("download")
+    def get_file_as_bytes(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        max_concurrency: Optional[int] = 1,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        large_file_threshold: Optional[int] = DEFAULT_LARGE_FILE_THRESHOLD,
+    ) -> bytes:
         """
         Get blob as bytes (in memory object)
 
+        If a cache was given to the constructor, the blob is read through it and max_concurrency
+        is passed to the SDK download instead. Blobs stored with a gzip or zstd Content-Encoding are
+        decompressed.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            max_concurrency: if greater than 1, blobs larger than large_file_threshold are fetched as
+                ranges of chunk_size bytes by max_concurrency threads into one preallocated buffer
+            chunk_size: size in bytes of each ranged request in large-file mode
+            large_file_threshold: minimum blob size in bytes to use large-file mode
+
+        Returns: the content of the blob
+
+        """
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        if self.cache is not None:
+            return self._get_cached_file_as_bytes(
+                blob_client, container_name, remote_file_name, max_concurrency
+            )
+        if max_concurrency <= 1:
+            stream = blob_client.download_blob(decompress=False)
+            content_encoding = get_content_encoding(stream.properties)
+            if content_encoding is None:
+                return stream.readall()
+            return b"".join(decompress_chunks(stream.chunks(), content_encoding))
+
+        stream, size, conditions = self._get_first_range(blob_client, chunk_size)
+        if stream is None:
+            return b""
+        content_encoding = get_content_encoding(stream.properties)
+        data = stream.readall()
+        if len(data) < size < large_file_threshold:
+            # Below the threshold, the rest of the blob is fetched in one request
+            stream = blob_client.download_blob(
+                offset=len(data), decompress=False, **conditions
+            )
+            data += stream.readall()
+        elif len(data) < size:
+            buffer = bytearray(size)
+            buffer[: len(data)] = data
+
+            def _write(offset: int, range_data: bytes):
+                buffer[offset : offset + len(range_data)] = range_data
+
+            self._download_ranges(
+                blob_client,
+                len(data),
+                size,
+                chunk_size,
+                max_concurrency,
+                conditions,
+                _write,
+            )
+            data = bytes(buffer)
+        if content_encoding is not None:
+            # Ranges are downloaded as stored, the blob is decompressed once complete
+            return decompress_bytes(data, content_encoding)
+        return data
+
+    def _get_cached_file_as_bytes(
+        self,
+        blob_client,
+        container_name: str,
+        remote_file_name: str,
+        max_concurrency: int,
+    ) -> bytes:
+        """
+        Get blob as bytes through the cache, revalidating the cached copy with its ETag
+
+        Args:
+            blob_client: client of the blob
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            max_concurrency: number of parallel connections of the SDK download
+
+        Returns:
+
+        """
+        entry = self.cache.get(container_name, remote_file_name)
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry.data
+
+        conditions = {}
+        if entry is not None:
+            conditions = {
+                "etag": entry.etag,
+                "match_condition": MatchConditions.IfModified,
+            }
+        try:
+            stream = blob_client.download_blob(
+                max_concurrency=max_concurrency, decompress=False, **conditions
+            )
+        except HttpResponseError as e:
+            if entry is not None and e.status_code == 304:
+                self.cache.touch(container_name, remote_file_name)
+                return entry.data
+            raise
+        data = stream.readall()
+        content_encoding = get_content_encoding(stream.properties)
+        if content_encoding is not None:
+            data = decompress_bytes(data, content_encoding)
+        self.cache.put(container_name, remote_file_name, data, stream.properties.etag)
+        return data
+
+    def open_blob(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        mode: Optional[str] = "rb",
+        block_size: Optional[int] = DEFAULT_BLOCK_SIZE,
+        read_ahead: Optional[int] = 4,
+        cache_blocks: Optional[int] = 16,
+        overwrite: Optional[bool] = False,
+        max_concurrency: Optional[int] = 1,
+        content_encoding: Optional[str] = None,
+    ) -> Union[io.BufferedReader, BlobWriter]:
+        """
+        Open a blob as a file-like object
+
+        In "rb" mode, the blob is seekable and only the ranges that are accessed are read: it can be given to
+        pandas, pyarrow, zipfile or tarfile, which then only fetch the parts they read. Blobs stored with a
+        gzip or zstd Content-Encoding are decompressed as they are read sequentially, and are not seekable.
+        In "wb" mode, written data is staged as blocks while the buffer fills and the blob is committed on
+        close, without any local file. Leaving a with block on an exception discards the written data.
+
         Args:
             container_name: Name of the container
             remote_file_name: Name of the blob
+            mode: "rb" or "wb"
+            block_size: size in bytes of each range request ("rb") or staged block ("wb")
+            read_ahead: number of blocks fetched ahead of the current one during sequential reads ("rb")
+            cache_blocks: number of blocks kept in memory ("rb")
+            overwrite: set to True if needed ("wb")
+            max_concurrency: number of blocks staged at the same time ("wb")
+            content_encoding: "gzip" or "zstd" to compress the data as it is written ("wb")
 
         Returns:
 
         """
+        if mode == "wb":
+            container_client = self._get_or_create_container_client(container_name)
+            blob_client = container_client.get_blob_client(remote_file_name)
+            if not overwrite and blob_client.exists():
+                raise ResourceExistsError(
+                    "Blob [{}] already exists.".format(remote_file_name)
+                )
+            on_commit = functools.partial(
+                self._on_blob_written, container_name, remote_file_name
+            )
+            return BlobWriter(
+                blob_client,
+                overwrite,
+                block_size,
+                max_concurrency,
+                on_commit,
+                content_encoding,
+            )
+        if mode != "rb":
+            raise ValueError(
+                "Mode [{}] not supported - only ['rb', 'wb'].".format(mode)
+            )
         blob_client = self.get_blob_client(container_name, remote_file_name)
-        return blob_client.download_blob().readall()
+        properties = blob_client.get_blob_properties()
+        if get_content_encoding(properties) is not None:
+            chunks = self._iter_blob_chunks(
+                container_name, remote_file_name, block_size
+            )
+            return io.BufferedReader(ChunkIteratorReader(lambda: next(chunks, b"")))
+        return io.BufferedReader(
+            BlobReader(
+                blob_client,
+                properties.size,
+                properties.etag,
+                block_size,
+                read_ahead,
+                cache_blocks,
+            )
+        )
 
     def get_file_as_text(self, container_name: str, remote_file_name: str) -> str:
         """
@@ -170,238 +550,1551 @@ class BlobStorageBase:
         container_name: str,
         prefix: Optional[str] = None,
         return_list: Optional[bool] = True,
-    ) -> Union[List[str], Iterable[str]]:
+        include_properties: Optional[bool] = False,
+        results_per_page: Optional[int] = None,
+    ) -> Union[
+        List[str], List[BlobProperties], Iterable[str], Iterable[BlobProperties]
+    ]:
         """
         Get list/generator of objects in container_name
 
         Args:
             container_name: Name of the container
             prefix: filter blobs with prefix
-            return_list: if False, returns a generator
+            return_list: if False, returns a generator fetching the listing page by page
+            include_properties: if True, yields BlobProperties instead of names (size, etag, last_modified,
+                content_settings.content_md5...), without any request per blob
+            results_per_page: maximum number of blobs per listing request, None for the service default (5000)
 
         Returns:
 
         """
-        container_client = self.get_container_client(container_name)
-        if prefix is not None:
-            res = (
-                blob.name
-                for blob in container_client.list_blobs(name_starts_with=prefix)
+        if self.index is not None:
+            res = iter(
+                self._get_indexed_blobs(container_name, prefix, include_properties)
             )
         else:
-            res = (blob.name for blob in container_client.list_blobs())
+            container_client = self.get_container_client(container_name)
+            res = (
+                blob if include_properties else blob.name
+                for blob in container_client.list_blobs(
+                    name_starts_with=prefix, results_per_page=results_per_page
+                )
+            )
 
         if return_list:
             res = list(res)
         return res
 
-    def download_file(
+    def list_blobs_parallel(
         self,
         container_name: str,
-        remote_file_name: str,
-        local_file_name: Optional[str] = None,
-    ):
+        prefix: Optional[str] = None,
+        max_concurrency: Optional[int] = 8,
+        delimiter: Optional[str] = "/",
+        sort: Optional[bool] = False,
+        include_properties: Optional[bool] = False,
+        results_per_page: Optional[int] = None,
+    ) -> Iterator[Union[str, BlobProperties]]:
         """
-        Download a blob named remote_file_name from a container named container_name
+        List blobs with concurrent requests, for containers too large for one sequential listing
+
+        Virtual directories are first walked with delimiter, level by level, until there are enough
+        sub-prefixes to keep max_concurrency threads busy. The sub-prefixes are then listed concurrently.
+        A prefix without virtual directories is listed sequentially, at no extra cost, its blobs yielded as the
+        listing pages arrive. Other blobs found while walking are held until they can be yielded.
 
         Args:
             container_name: Name of the container
-            remote_file_name: Name of the blob
-            local_file_name: Name of the local file where the blob will be downloaded
+            prefix: filter blobs with prefix
+            max_concurrency: number of listing requests sent at the same time
+            delimiter: separator of virtual directories in blob names
+            sort: if True, yields blobs in name order like get_list_blobs_name. Otherwise blobs are yielded as
+                soon as their sub-prefix is listed
+            include_properties: if True, yields BlobProperties instead of names
+            results_per_page: maximum number of blobs per listing request, None for the service default (5000)
 
-        Returns:
+        Returns: a generator of blob names (or BlobProperties)
 
         """
-        if local_file_name is None:
-            directory_name, file_name = self.get_directory_and_filename_from_full_path(
-                remote_file_name
-            )
-            if directory_name is None:
-                self.create_local_dir(self.local_base_path)
-                local_file_name = self.local_base_path + file_name
-            else:
-                self.create_local_dir(self.local_base_path + directory_name)
-                local_file_name = self.local_base_path + directory_name + file_name
-        else:
-            directory_name, file_name = self.get_directory_and_filename_from_full_path(
-                local_file_name
+        if self.index is not None:
+            yield from self._get_indexed_blobs(
+                container_name, prefix, include_properties, max_concurrency
             )
-            if directory_name is None:
-                self.create_local_dir(self.local_base_path)
-                local_file_name = self.local_base_path + file_name
-            else:
-                self.create_local_dir(directory_name)
-                local_file_name = directory_name + file_name
-
-        blob_client = self.get_blob_client(container_name, remote_file_name)
-        print("Downloading {} to {}".format(remote_file_name, local_file_name))
-        with open(local_file_name, "wb") as my_blob:
-            my_blob.write(blob_client.download_blob().readall())
+            return
+        yield from self._list_blobs_parallel(
+            container_name,
+            prefix,
+            max_concurrency,
+            delimiter,
+            sort,
+            include_properties,
+            results_per_page,
+        )
 
-    def download_directory(
+    def _list_blobs_parallel(
         self,
         container_name: str,
-        remote_directory: str,
-        local_directory: Optional[str] = None,
-    ):
+        prefix: Optional[str],
+        max_concurrency: int,
+        delimiter: str = "/",
+        sort: bool = False,
+        include_properties: bool = False,
+        results_per_page: Optional[int] = None,
+    ) -> Iterator[Union[str, BlobProperties]]:
         """
-        Download all blobs in directory
+        List blobs from the service with concurrent requests, see list_blobs_parallel
 
         Args:
             container_name: Name of the container
-            remote_directory: Name of the remote directory
-            local_directory: Name of the local directory where files will be downloaded
+            prefix: filter blobs with prefix
+            max_concurrency: number of listing requests sent at the same time
+            delimiter: separator of virtual directories in blob names
+            sort: if True, yields blobs in name order
+            include_properties: if True, yields BlobProperties instead of names
+            results_per_page: maximum number of blobs per listing request
 
         Returns:
 
         """
-        blob_gen = self.get_list_blobs_name(
-            container_name, prefix=remote_directory, return_list=False
-        )
-
-        for blob_name in blob_gen:
-            if local_directory is not None:
-                self.download_file(
-                    container_name,
-                    blob_name,
-                    (local_directory + blob_name).replace("//", "/"),
+        container_client = self.get_container_client(container_name)
+        max_concurrency = max(max_concurrency, 1)
+
+        def _walk(walk_prefix: str) -> Iterator[Union[BlobProperties, str]]:
+            # Blobs and sub-prefixes, in name order: each page lists its sub-prefixes before its blobs
+            for page in container_client.walk_blobs(
+                name_starts_with=walk_prefix,
+                delimiter=delimiter,
+                results_per_page=results_per_page,
+            ).by_page():
+                for item in sorted(page, key=lambda item: item.name):
+                    yield item if isinstance(item, BlobProperties) else item.name
+
+        def _list(list_prefix: str) -> List[BlobProperties]:
+            return list(
+                container_client.list_blobs(
+                    name_starts_with=list_prefix, results_per_page=results_per_page
                 )
-            else:
-                self.download_file(container_name, blob_name)
+            )
 
-    def upload_file(
+        def _output(blobs: Iterable[BlobProperties]) -> Iterator:
+            for blob in blobs:
+                yield blob if include_properties else blob.name
+
+        executor = ThreadPoolExecutor(max_workers=max_concurrency)
+        try:
+            # Blobs found while walking and sub-prefixes (str) still to list, in name order
+            segments = [prefix or ""]
+            prefix_count = 1
+            while 0 < prefix_count < LISTING_FAN_OUT * max_concurrency:
+                if len(segments) == 1:
+                    # A lone prefix is walked as its pages arrive, and blobs which can already be output are
+                    # not held: the blobs of a flat prefix are streamed
+                    for item in _walk(segments.pop()):
+                        if isinstance(item, str) or (sort and segments):
+                            segments.append(item)
+                        else:
+                            yield from _output([item])
+                else:
+                    prefixes = [
+                        segment for segment in segments if isinstance(segment, str)
+                    ]
+                    walked = dict(
+                        zip(prefixes, executor.map(lambda p: list(_walk(p)), prefixes))
+                    )
+                    segments = [
+                        item
+                        for segment in segments
+                        for item in (
+                            walked[segment] if isinstance(segment, str) else [segment]
+                        )
+                    ]
+                prefix_count = sum(isinstance(segment, str) for segment in segments)
+
+            # Bound the number of sub-prefix listings held in memory
+            window = 2 * max_concurrency
+            if sort:
+                pending = deque()
+                in_flight = 0
+                for segment in segments:
+                    if isinstance(segment, str):
+                        pending.append(executor.submit(_list, segment))
+                        in_flight += 1
+                    else:
+                        pending.append([segment])
+                    while in_flight > window:
+                        blobs = pending.popleft()
+                        if isinstance(blobs, Future):
+                            in_flight -= 1
+                            blobs = blobs.result()
+                        yield from _output(blobs)
+                for blobs in pending:
+                    yield from _output(
+                        blobs.result() if isinstance(blobs, Future) else blobs
+                    )
+            else:
+                yield from _output(
+                    segment for segment in segments if not isinstance(segment, str)
+                )
+                futures = set()
+                for segment in segments:
+                    if isinstance(segment, str):
+                        futures.add(executor.submit(_list, segment))
+                    while len(futures) > window:
+                        done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                        for future in done:
+                            yield from _output(future.result())
+                while futures:
+                    done, futures = wait(futures, return_when=FIRST_COMPLETED)
+                    for future in done:
+                        yield from _output(future.result())
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def refresh_index(
         self,
         container_name: str,
-        local_file_name: str,
-        remote_file_name: Optional[str] = None,
-        overwrite: Optional[bool] = False,
+        prefix: Optional[str] = None,
+        max_concurrency: Optional[int] = None,
     ):
         """
-        Upload a local file to a blob
+        List blobs starting with prefix from the service into the index given to the constructor
 
         Args:
             container_name: Name of the container
-            local_file_name: Name of the local file
-            remote_file_name: Name of the blob where file will be uploaded
-            overwrite: set to True if needed
+            prefix: prefix to list, None for the whole container
+            max_concurrency: if set, list with list_blobs_parallel and max_concurrency threads
 
         Returns:
 
         """
-        container_client = self.get_container_client(container_name)
-        if not container_client.exists():
-            self.create_container(container_name)
-            container_client = self.get_container_client(container_name)
-
-        if remote_file_name is None:
-            directory_name, file_name = self.get_directory_and_filename_from_full_path(
-                local_file_name
-            )
-            remote_file_name = (
-                directory_name.replace(self.local_base_path, "") + file_name
+        if max_concurrency is not None:
+            blobs = self._list_blobs_parallel(
+                container_name, prefix, max_concurrency, include_properties=True
             )
-
-        blob_client = container_client.get_blob_client(remote_file_name)
-        try:
-            with open(local_file_name, "rb") as data:
-                blob_client.upload_blob(data, overwrite=overwrite)
-        except ResourceExistsError as e:
-            print(
-                "File [{}] already exists. Use overwrite = True if needed".format(
-                    remote_file_name
-                )
+        else:
+            blobs = self.get_container_client(container_name).list_blobs(
+                name_starts_with=prefix
             )
-            raise e
+        self.index.refresh(container_name, prefix, blobs)
 
-    @classmethod
-    def _get_file_paths_from_directory(cls, directory_name: str):
+    def query_index(
+        self,
+        container_name: str,
+        prefix: Optional[str] = None,
+        pattern: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        include_properties: Optional[bool] = False,
+    ) -> Union[List[str], List[BlobProperties]]:
         """
-        Get all file paths from local directory
+        Query the blobs of the index given to the constructor, listing prefix first if it is not indexed yet
+
         Args:
-            directory_name: Name of the local directory
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+            pattern: filter blobs with a glob pattern on the whole name (eg. "images/*/*.jpg"), case-sensitive
+            min_size: filter blobs of at least min_size bytes
+            max_size: filter blobs of at most max_size bytes
+            include_properties: if True, returns BlobProperties instead of names
 
-        Returns:
+        Returns: names (or BlobProperties) in name order
 
         """
-        file_paths = []  # List which will store all of the full file paths.
-
-        # Walk the tree.
-        for root, directories, files in os.walk(directory_name):
-            for file_name in files:
-                # Join the two strings in order to form the full filepath.
-                file_path = os.path.join(root, file_name)
-                file_paths.append(file_path)  # Add it to the list.
-
-        return file_paths
+        if not self.index.is_fresh(container_name, prefix):
+            self.refresh_index(container_name, prefix)
+        return self.index.query(
+            container_name, prefix, pattern, min_size, max_size, include_properties
+        )
 
-    def upload_directory(
+    def _get_indexed_blobs(
         self,
         container_name: str,
-        local_directory_name: str,
-        remote_directory_name: Optional[str] = None,
-        overwrite: Optional[bool] = False,
-    ):
+        prefix: Optional[str],
+        include_properties: bool,
+        max_concurrency: Optional[int] = None,
+    ) -> Union[List[str], List[BlobProperties]]:
         """
-        Upload local folder to blobs
+        Get blobs starting with prefix from the index, listing prefix first if it is not indexed yet
 
         Args:
             container_name: Name of the container
-            local_directory_name: Name of the local directory
-            remote_directory_name: Name of the remote directory where file will be uploaded
-            overwrite: set to True if needed
+            prefix: filter blobs with prefix
+            include_properties: if True, returns BlobProperties instead of names
+            max_concurrency: if set, a listing is done with list_blobs_parallel and max_concurrency threads
 
         Returns:
 
         """
-        file_paths = self._get_file_paths_from_directory(local_directory_name)
-        for filepath in file_paths:
-            if remote_directory_name is not None:
-                self.upload_file(
-                    container_name,
-                    filepath,
-                    (remote_directory_name + filepath).replace("//", "/"),
-                    overwrite,
-                )
-            else:
-                self.upload_file(container_name, filepath, filepath, overwrite)
+        if not self.index.is_fresh(container_name, prefix):
+            self.refresh_index(container_name, prefix, max_concurrency)
+        return self.index.query(
+            container_name, prefix, include_properties=include_properties
+        )
 
-    def upload_bytes(
-        self,
-        my_bytes: bytes,
-        container_name: str,
-        remote_file_name: str,
-        overwrite: Optional[bool] = False,
+    def _on_blob_written(
+        self, container_name: str, remote_file_name: str, response: Dict, size: int
     ):
         """
-        Uploaded in memory byte object to blob
+        Update what the cache & index know about a blob after it was written
+
+        The cached content is dropped, and the index gets the properties of the new blob from the upload
+        response, so that indexed listings stay fresh without any request to the service.
 
         Args:
-            my_bytes: in memory object
             container_name: Name of the container
-            remote_file_name: Name of the blob where object will be uploaded
-            overwrite: set to True if needed
+            remote_file_name: Name of the blob
+            response: response of the upload or of the block list commit
+            size: size of the written blob
 
         Returns:
 
         """
-        container_client = self.get_container_client(container_name)
-        if not container_client.exists():
-            self.create_container(container_name)
-            container_client = self.get_container_client(container_name)
-
-        blob_client = container_client.get_blob_client(remote_file_name)
-        blob_client.upload_blob(my_bytes, overwrite=overwrite)
-
-    def delete_blobs(self, container_name: str, remote_file_names: List[str]):
+        if self.cache is not None:
+            self.cache.invalidate(container_name, remote_file_name)
+        if self.index is not None:
+            self.index.update_written(container_name, remote_file_name, size, response)
+
+    def _get_local_file_name(
+        self, remote_file_name: str, local_file_name: Optional[str] = None
+    ) -> str:
         """
-        Delete list of blobs from container_name
+        Get the local path where download_file writes a blob
 
         Args:
-            container_name: Name of the container
-            remote_file_names: list of blob names
+            remote_file_name: Name of the blob
+            local_file_name: Name of the local file where the blob will be downloaded
 
         Returns:
 
         """
-        container_client = self.get_container_client(container_name)
-        container_client.delete_blobs(*remote_file_names)
+        if local_file_name is None:
+            directory_name, file_name = self.get_directory_and_filename_from_full_path(
+                remote_file_name
+            )
+            if directory_name is None:
+                return self.local_base_path + file_name
+            return self.local_base_path + directory_name + file_name
+        directory_name, file_name = self.get_directory_and_filename_from_full_path(
+            local_file_name
+        )
+        if directory_name is None:
+            return self.local_base_path + file_name
+        return directory_name + file_name
+
+    @instrumented("download")
+    def download_file(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        local_file_name: Optional[str] = None,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        max_concurrency: Optional[int] = 1,
+        large_file_threshold: Optional[int] = DEFAULT_LARGE_FILE_THRESHOLD,
+    ):
+        """
+        Download a blob named remote_file_name from a container named container_name
+
+        The blob is streamed chunk by chunk to a temporary file which is renamed to local_file_name
+        once complete, so memory stays bounded by chunk_size and an interrupted download never
+        leaves a partial file under the final name.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            local_file_name: Name of the local file where the blob will be downloaded
+            chunk_size: size in bytes of each ranged request
+            max_concurrency: if greater than 1, blobs larger than large_file_threshold are fetched as
+                ranges of chunk_size bytes by max_concurrency threads, each written at its offset
+                into a preallocated file
+            large_file_threshold: minimum blob size in bytes to use large-file mode
+
+        Returns:
+
+        """
+        local_file_name = self._get_local_file_name(remote_file_name, local_file_name)
+        self.create_local_dir(os.path.dirname(local_file_name) or ".")
+
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        logger.debug("Downloading %s to %s", remote_file_name, local_file_name)
+        self._stream_blob_to_file(
+            blob_client,
+            local_file_name,
+            chunk_size,
+            max_concurrency,
+            large_file_threshold,
+        )
+
+    def _get_first_range(self, blob_client, chunk_size: int):
+        """
+        Download the first range of a blob, which also tells its size
+
+        Args:
+            blob_client: client of the blob to download
+            chunk_size: size in bytes of the range
+
+        Returns: downloader of the range (None if the blob is empty), size of the blob,
+            conditions pinning later ranges to the same version of the blob
+
+        """
+        try:
+            stream = blob_client.download_blob(
+                offset=0, length=chunk_size, decompress=False
+            )
+        except HttpResponseError as e:
+            # Ranged requests are rejected on empty blobs
+            if e.status_code == 416:
+                return None, 0, {}
+            raise
+        conditions = {
+            "etag": stream.properties.etag,
+            "match_condition": MatchConditions.IfNotModified,
+        }
+        return stream, int(stream.properties.content_range.split("/")[-1]), conditions
+
+    @staticmethod
+    def _download_ranges(
+        blob_client,
+        start: int,
+        size: int,
+        chunk_size: int,
+        max_concurrency: int,
+        conditions: Dict,
+        write: Callable[[int, bytes], None],
+    ):
+        """
+        Download bytes [start, size) of a blob as ranges of chunk_size bytes
+
+        Args:
+            blob_client: client of the blob to download
+            start: first byte to download
+            size: size of the blob
+            chunk_size: size in bytes of each ranged request
+            max_concurrency: number of ranges downloaded at the same time
+            conditions: conditions pinning ranges to the same version of the blob
+            write: called with (offset, data) for each downloaded range
+
+        Returns:
+
+        """
+
+        def _download_range(offset: int):
+            stream = blob_client.download_blob(
+                offset=offset,
+                length=min(chunk_size, size - offset),
+                decompress=False,
+                **conditions
+            )
+            write(offset, stream.readall())
+
+        offsets = range(start, size, chunk_size)
+        if max_concurrency <= 1:
+            for offset in offsets:
+                _download_range(offset)
+        else:
+            with ThreadPoolExecutor(max_workers=max_concurrency) as executor:
+                # Consume results so that the first failure is raised
+                list(executor.map(bind_context(_download_range), offsets))
+
+    def _iter_blob_chunks(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+    ) -> Iterator[bytes]:
+        """
+        Generator over the content of a blob, as ranges of chunk_size bytes fetched one at a time
+
+        Blobs stored with a gzip or zstd Content-Encoding are decompressed as the ranges come.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            chunk_size: size in bytes of each ranged request
+
+        Returns:
+
+        """
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        stream, size, conditions = self._get_first_range(blob_client, chunk_size)
+        if stream is None:
+            return
+        content_encoding = get_content_encoding(stream.properties)
+        chunks = self._iter_ranges(blob_client, stream, size, chunk_size, conditions)
+        if content_encoding is not None:
+            chunks = decompress_chunks(chunks, content_encoding)
+        yield from chunks
+
+    @staticmethod
+    def _iter_ranges(
+        blob_client, stream, size: int, chunk_size: int, conditions: Dict
+    ) -> Iterator[bytes]:
+        """
+        Generator over the stored bytes of a blob, from its first range then ranges of chunk_size bytes
+
+        Args:
+            blob_client: client of the blob to download
+            stream: downloader of the first range
+            size: size of the blob
+            chunk_size: size in bytes of each ranged request
+            conditions: conditions pinning ranges to the same version of the blob
+
+        Returns:
+
+        """
+        offset = 0
+        while True:
+            data = stream.readall()
+            offset += len(data)
+            yield data
+            if offset >= size:
+                return
+            stream = blob_client.download_blob(
+                offset=offset, length=chunk_size, decompress=False, **conditions
+            )
+
+    def _stream_blob_to_file(
+        self,
+        blob_client,
+        local_file_name: str,
+        chunk_size: int,
+        max_concurrency: Optional[int] = 1,
+        large_file_threshold: Optional[int] = DEFAULT_LARGE_FILE_THRESHOLD,
+    ):
+        """
+        Download a blob with ranged requests of chunk_size bytes into local_file_name
+
+        Blobs stored with a gzip or zstd Content-Encoding are decompressed as the ranges come, one at a time.
+
+        Args:
+            blob_client: client of the blob to download
+            local_file_name: Name of the local file
+            chunk_size: size in bytes of each ranged request
+            max_concurrency: number of ranges downloaded at the same time for large blobs
+            large_file_threshold: minimum blob size in bytes to download ranges concurrently
+
+        Returns:
+
+        """
+        tmp_file_name = "{}.{}.part".format(local_file_name, uuid.uuid4().hex)
+        try:
+            stream, size, conditions = self._get_first_range(blob_client, chunk_size)
+            content_encoding = (
+                None if stream is None else get_content_encoding(stream.properties)
+            )
+            with open(tmp_file_name, "xb") as my_blob:
+                if content_encoding is not None:
+                    # A compressed stream is decoded in order: ranges can't be written at their offsets
+                    for data in decompress_chunks(
+                        self._iter_ranges(
+                            blob_client, stream, size, chunk_size, conditions
+                        ),
+                        content_encoding,
+                    ):
+                        my_blob.write(data)
+                else:
+                    self._write_ranges_to_file(
+                        blob_client,
+                        my_blob,
+                        tmp_file_name,
+                        stream,
+                        size,
+                        chunk_size,
+                        conditions,
+                        max_concurrency if size >= large_file_threshold else 1,
+                    )
+            os.replace(tmp_file_name, local_file_name)
+        except BaseException:
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+            raise
+
+    def _write_ranges_to_file(
+        self,
+        blob_client,
+        my_blob,
+        file_name: str,
+        stream,
+        size: int,
+        chunk_size: int,
+        conditions: Dict,
+        max_concurrency: int,
+    ):
+        """
+        Write the stored bytes of a blob into an open file, from its first range then ranges of chunk_size bytes
+
+        Args:
+            blob_client: client of the blob to download
+            my_blob: file opened for writing
+            file_name: name of the file, reopened by each thread when ranges are downloaded concurrently
+            stream: downloader of the first range, None if the blob is empty
+            size: size of the blob
+            chunk_size: size in bytes of each ranged request
+            conditions: conditions pinning ranges to the same version of the blob
+            max_concurrency: number of ranges downloaded at the same time
+
+        Returns:
+
+        """
+        offset = 0 if stream is None else stream.readinto(my_blob)
+        if max_concurrency > 1:
+            # Preallocate the file so each range is written at its offset
+            my_blob.truncate(size)
+            my_blob.flush()
+
+            def _write(range_offset: int, data: bytes):
+                with open(file_name, "r+b") as f:
+                    f.seek(range_offset)
+                    f.write(data)
+
+            self._download_ranges(
+                blob_client,
+                offset,
+                size,
+                chunk_size,
+                max_concurrency,
+                conditions,
+                _write,
+            )
+        else:
+            while offset < size:
+                stream = blob_client.download_blob(
+                    offset=offset, length=chunk_size, decompress=False, **conditions
+                )
+                offset += stream.readinto(my_blob)
+
+    def download_directory(
+        self,
+        container_name: str,
+        remote_directory: str,
+        local_directory: Optional[str] = None,
+        max_workers: Optional[int] = None,
+        incremental: Optional[bool] = False,
+        delete_missing: Optional[bool] = False,
+    ) -> Optional[Dict[str, Optional[Exception]]]:
+        """
+        Download all blobs in directory
+
+        Args:
+            container_name: Name of the container
+            remote_directory: Name of the remote directory
+            local_directory: Name of the local directory where files will be downloaded
+            max_workers: if set, download blobs concurrently on a pool of max_workers threads.
+                The prefix is listed with list_blobs_parallel, downloads start while the listing is still running
+                and a failure does not stop the others.
+            incremental: if True, keep a manifest of downloaded blobs (ETag, size, local path) in the local directory
+                and skip blobs whose ETag did not change since the last run
+            delete_missing: in incremental mode, remove local files of blobs which no longer exist
+
+        Returns: in incremental mode, a dict with lists of "downloaded" and "unchanged" blobs and "deleted" local files
+            (and "failed", a dict {blob_name: exception}, if max_workers is set).
+            Otherwise None in sequential mode, otherwise a dict {blob_name: None if downloaded else the raised exception}
+
+        """
+        if incremental:
+            return self._download_directory_incremental(
+                container_name,
+                remote_directory,
+                local_directory,
+                delete_missing,
+                max_workers,
+            )
+
+        if max_workers is not None:
+            return self._download_blobs_concurrently(
+                container_name,
+                self.list_blobs_parallel(
+                    container_name, remote_directory, max_concurrency=max_workers
+                ),
+                local_directory,
+                max_workers,
+            )
+
+        blob_gen = self.get_list_blobs_name(
+            container_name, prefix=remote_directory, return_list=False
+        )
+
+        for blob_name in blob_gen:
+            self._download_directory_file(container_name, blob_name, local_directory)
+
+    def _download_directory_file(
+        self, container_name: str, blob_name: str, local_directory: Optional[str]
+    ):
+        """
+        Download one blob of a directory, within the limit of the governor
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob
+            local_directory: Name of the local directory where files will be downloaded
+
+        Returns:
+
+        """
+        with self._governed():
+            if local_directory is not None:
+                self.download_file(
+                    container_name,
+                    blob_name,
+                    (local_directory + blob_name).replace("//", "/"),
+                )
+            else:
+                self.download_file(container_name, blob_name)
+
+    def _download_blobs_concurrently(
+        self,
+        container_name: str,
+        blob_names: Iterable[str],
+        local_directory: Optional[str],
+        max_workers: int,
+    ) -> Dict[str, Optional[Exception]]:
+        """
+        Download blobs on a thread pool while blob_names is consumed
+
+        Args:
+            container_name: Name of the container
+            blob_names: iterable of blob names (may be a lazy listing)
+            local_directory: Name of the local directory where files will be downloaded
+            max_workers: number of threads
+
+        Returns: a dict {blob_name: None if downloaded else the raised exception}
+
+        """
+        results = {}
+        # Bound the number of queued downloads so a huge listing is not materialized as futures.
+        slots = threading.BoundedSemaphore(2 * max_workers)
+
+        def _download(blob_name: str):
+            try:
+                self._download_directory_file(
+                    container_name, blob_name, local_directory
+                )
+                results[blob_name] = None
+            except Exception as e:
+                results[blob_name] = e
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for blob_name in blob_names:
+                slots.acquire()
+                executor.submit(bind_context(_download), blob_name)
+        return results
+
+    def _download_directory_incremental(
+        self,
+        container_name: str,
+        remote_directory: str,
+        local_directory: Optional[str],
+        delete_missing: bool,
+        max_workers: Optional[int],
+    ) -> Dict:
+        """
+        Download only blobs whose ETag changed since the last run, see download_directory
+
+        Args:
+            container_name: Name of the container
+            remote_directory: Name of the remote directory
+            local_directory: Name of the local directory where files will be downloaded
+            delete_missing: remove local files of blobs which no longer exist
+            max_workers: if set, download blobs concurrently on a pool of max_workers threads
+
+        Returns: a dict with lists of "downloaded" and "unchanged" blobs and "deleted" local files
+            (and "failed", a dict {blob_name: exception}, if max_workers is set)
+
+        """
+        manifest_file_name = self._get_download_manifest_file_name(
+            container_name, remote_directory, local_directory
+        )
+        manifest = self._read_download_manifest(manifest_file_name)
+        remote_blobs = self._get_blobs_properties(
+            container_name, remote_directory, max_workers
+        )
+        summary = {"downloaded": [], "unchanged": [], "deleted": []}
+        to_download = []
+        for blob_name, blob in remote_blobs.items():
+            if self._is_blob_in_manifest(manifest, blob):
+                summary["unchanged"].append(blob_name)
+            else:
+                to_download.append(blob_name)
+
+        try:
+            if max_workers is not None:
+                results = self._download_blobs_concurrently(
+                    container_name, to_download, local_directory, max_workers
+                )
+                summary["failed"] = {n: e for n, e in results.items() if e is not None}
+                for blob_name in to_download:
+                    if results[blob_name] is None:
+                        self._add_to_download_manifest(
+                            manifest, remote_blobs[blob_name], local_directory
+                        )
+                        summary["downloaded"].append(blob_name)
+            else:
+                for blob_name in to_download:
+                    self._download_directory_file(
+                        container_name, blob_name, local_directory
+                    )
+                    self._add_to_download_manifest(
+                        manifest, remote_blobs[blob_name], local_directory
+                    )
+                    summary["downloaded"].append(blob_name)
+
+            summary["deleted"] = self._remove_missing_from_download_manifest(
+                manifest, remote_blobs, delete_missing
+            )
+        finally:
+            self._write_download_manifest(manifest_file_name, manifest)
+        return summary
+
+    def _get_download_manifest_file_name(
+        self, container_name: str, remote_directory: str, local_directory: Optional[str]
+    ) -> str:
+        """
+        Get the path of the manifest of an incremental download_directory
+
+        Args:
+            container_name: Name of the container
+            remote_directory: Name of the remote directory
+            local_directory: Name of the local directory where files will be downloaded
+
+        Returns:
+
+        """
+        directory_name = local_directory or self.local_base_path
+        self.create_local_dir(directory_name)
+        key = hashlib.sha1(
+            "{}/{}".format(container_name, remote_directory).encode()
+        ).hexdigest()
+        return os.path.join(
+            directory_name, "{}{}.json".format(DOWNLOAD_MANIFEST_PREFIX, key)
+        )
+
+    @staticmethod
+    def _read_download_manifest(manifest_file_name: str) -> Dict[str, Dict]:
+        """
+        Read the manifest of an incremental download_directory
+
+        Args:
+            manifest_file_name: path of the manifest
+
+        Returns: a dict {blob_name: {"etag", "size", "local_file_name"}}
+
+        """
+        if not os.path.exists(manifest_file_name):
+            return {}
+        with open(manifest_file_name, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_download_manifest(manifest_file_name: str, manifest: Dict[str, Dict]):
+        """
+        Atomically write the manifest of an incremental download_directory
+
+        Args:
+            manifest_file_name: path of the manifest
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+
+        Returns:
+
+        """
+        tmp_file_name = "{}.{}.part".format(manifest_file_name, uuid.uuid4().hex)
+        with open(tmp_file_name, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_file_name, manifest_file_name)
+
+    @staticmethod
+    def _is_blob_in_manifest(manifest: Dict[str, Dict], blob) -> bool:
+        """
+        Check if a blob was already downloaded and did not change since
+
+        Args:
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+            blob: BlobProperties of the blob
+
+        Returns:
+
+        """
+        entry = manifest.get(blob.name)
+        return (
+            entry is not None
+            and entry["etag"] == blob.etag
+            and os.path.exists(entry["local_file_name"])
+        )
+
+    def _add_to_download_manifest(
+        self, manifest: Dict[str, Dict], blob, local_directory: Optional[str]
+    ):
+        """
+        Record a downloaded blob in the manifest
+
+        Args:
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+            blob: BlobProperties of the blob
+            local_directory: Name of the local directory where files are downloaded
+
+        Returns:
+
+        """
+        if local_directory is not None:
+            local_file_name = self._get_local_file_name(
+                blob.name, (local_directory + blob.name).replace("//", "/")
+            )
+        else:
+            local_file_name = self._get_local_file_name(blob.name)
+        manifest[blob.name] = {
+            "etag": blob.etag,
+            "size": blob.size,
+            "local_file_name": local_file_name,
+        }
+
+    @staticmethod
+    def _remove_missing_from_download_manifest(
+        manifest: Dict[str, Dict], remote_blobs: Dict, delete_missing: bool
+    ) -> List[str]:
+        """
+        Forget blobs of the manifest which no longer exist
+
+        Args:
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+            remote_blobs: a dict {blob_name: BlobProperties} of existing blobs
+            delete_missing: also remove the local files of these blobs
+
+        Returns: list of removed local files
+
+        """
+        deleted = []
+        for blob_name in [name for name in manifest if name not in remote_blobs]:
+            local_file_name = manifest.pop(blob_name)["local_file_name"]
+            if delete_missing and os.path.exists(local_file_name):
+                os.remove(local_file_name)
+                deleted.append(local_file_name)
+        return deleted
+
+    @instrumented("upload", ("remote_file_name", "local_file_name"))
+    def upload_file(
+        self,
+        container_name: str,
+        local_file_name: str,
+        remote_file_name: Optional[str] = None,
+        overwrite: Optional[bool] = False,
+        block_size: Optional[int] = None,
+        max_concurrency: Optional[int] = 1,
+        content_encoding: Optional[str] = None,
+    ):
+        """
+        Upload a local file to a blob
+
+        Args:
+            container_name: Name of the container
+            local_file_name: Name of the local file
+            remote_file_name: Name of the blob where file will be uploaded
+            overwrite: set to True if needed
+            block_size: if set, the file is read through a memory map and staged as blocks of block_size bytes,
+                then the block list is committed. Staged blocks are journaled so that a retry of a failed
+                upload only sends the missing blocks.
+            max_concurrency: number of blocks staged at the same time when block_size is set
+            content_encoding: "gzip" or "zstd" to compress the file as it is read and staged as blocks of
+                block_size bytes (DEFAULT_BLOCK_SIZE if not set). The blocks of a compressed upload are not
+                journaled.
+
+        Returns:
+
+        """
+        container_client = self._get_or_create_container_client(container_name)
+
+        if remote_file_name is None:
+            directory_name, file_name = self.get_directory_and_filename_from_full_path(
+                local_file_name
+            )
+            remote_file_name = (
+                directory_name.replace(self.local_base_path, "") + file_name
+            )
+
+        blob_client = container_client.get_blob_client(remote_file_name)
+        try:
+            if content_encoding is not None:
+                response, size = self._upload_file_compressed(
+                    blob_client,
+                    local_file_name,
+                    overwrite,
+                    block_size or DEFAULT_BLOCK_SIZE,
+                    max_concurrency,
+                    content_encoding,
+                )
+            elif block_size is None:
+                with open(local_file_name, "rb") as data:
+                    size = os.fstat(data.fileno()).st_size
+                    response = blob_client.upload_blob(data, overwrite=overwrite)
+            else:
+                response, size = self._upload_file_in_blocks(
+                    blob_client,
+                    container_name,
+                    local_file_name,
+                    remote_file_name,
+                    overwrite,
+                    block_size,
+                    max_concurrency,
+                )
+        except ResourceExistsError as e:
+            logger.warning(
+                "File [%s] already exists. Use overwrite = True if needed",
+                remote_file_name,
+            )
+            raise e
+        self._on_blob_written(container_name, remote_file_name, response, size)
+
+    def _upload_file_compressed(
+        self,
+        blob_client,
+        local_file_name: str,
+        overwrite: bool,
+        block_size: int,
+        max_concurrency: int,
+        content_encoding: str,
+    ):
+        """
+        Upload a local file compressed as it is read, staged as blocks of compressed data
+
+        Args:
+            blob_client: client of the blob where file will be uploaded
+            local_file_name: Name of the local file
+            overwrite: set to True if needed
+            block_size: size in bytes of each block
+            max_concurrency: number of blocks staged at the same time
+            content_encoding: "gzip" or "zstd"
+
+        Returns: response of the block list commit, size of the blob
+
+        """
+        committed = []
+        # Without overwrite, the commit fails with ResourceExistsError if the blob exists
+        with open(local_file_name, "rb") as data, BlobWriter(
+            blob_client,
+            overwrite,
+            block_size,
+            max_concurrency,
+            on_commit=lambda response, size: committed.extend([response, size]),
+            content_encoding=content_encoding,
+            slot=self._governed,
+        ) as writer:
+            shutil.copyfileobj(data, writer, block_size)
+        return tuple(committed)
+
+    def _upload_file_in_blocks(
+        self,
+        blob_client,
+        container_name: str,
+        local_file_name: str,
+        remote_file_name: str,
+        overwrite: bool,
+        block_size: int,
+        max_concurrency: int,
+    ):
+        """
+        Upload a local file as blocks staged concurrently from a memory map, then commit the block list
+
+        Args:
+            blob_client: client of the blob where file will be uploaded
+            container_name: Name of the container
+            local_file_name: Name of the local file
+            remote_file_name: Name of the blob where file will be uploaded
+            overwrite: set to True if needed
+            block_size: size in bytes of each block
+            max_concurrency: number of blocks staged at the same time
+
+        Returns: response of the block list commit, size of the blob
+
+        """
+        file_size = os.path.getsize(local_file_name)
+        if file_size == 0:
+            # An empty file can't be memory mapped and has no block
+            return blob_client.upload_blob(b"", overwrite=overwrite), 0
+        block_count = math.ceil(file_size / block_size)
+        if block_count > MAX_BLOCK_COUNT:
+            raise ValueError(
+                "block_size {} is too small: a blob has at most {} blocks.".format(
+                    block_size, MAX_BLOCK_COUNT
+                )
+            )
+        if not overwrite and blob_client.exists():
+            raise ResourceExistsError(
+                "Blob [{}] already exists.".format(remote_file_name)
+            )
+
+        journal_file_name, staged = self._open_upload_journal(
+            container_name, local_file_name, remote_file_name, block_size
+        )
+        if staged:
+            # Uncommitted blocks are discarded by the service after a week
+            try:
+                _, uncommitted = blob_client.get_block_list("uncommitted")
+                staged &= {block.id for block in uncommitted}
+            except ResourceNotFoundError:
+                staged = set()
+
+        block_ids = [
+            base64.b64encode("{:08d}".format(i).encode()).decode()
+            for i in range(block_count)
+        ]
+        with open(local_file_name, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data, open(journal_file_name, "a") as journal:
+            lock = threading.Lock()
+
+            def _stage_block(index: int):
+                block_id = block_ids[index]
+                if block_id in staged:
+                    return
+                offset = index * block_size
+                with self._governed():
+                    blob_client.stage_block(
+                        block_id, data[offset : offset + block_size]
+                    )
+                with lock:
+                    journal.write(block_id + "\n")
+                    journal.flush()
+
+            with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+                # Consume results so that the first failure is raised
+                list(executor.map(bind_context(_stage_block), range(len(block_ids))))
+        conditions = {} if overwrite else {"match_condition": MatchConditions.IfMissing}
+        response = blob_client.commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids], **conditions
+        )
+        os.remove(journal_file_name)
+        return response, file_size
+
+    def _open_upload_journal(
+        self,
+        container_name: str,
+        local_file_name: str,
+        remote_file_name: str,
+        block_size: int,
+    ) -> Tuple[str, set]:
+        """
+        Get the journal of a block upload, stored in local_base_path
+
+        The journal is reset if the local file or block_size changed since it was written.
+
+        Args:
+            container_name: Name of the container
+            local_file_name: Name of the local file
+            remote_file_name: Name of the blob where file will be uploaded
+            block_size: size in bytes of each block
+
+        Returns: journal file name, set of block ids already staged
+
+        """
+        local_file_name = os.path.abspath(local_file_name)
+        journal_directory = os.path.join(self.local_base_path, UPLOAD_JOURNAL_DIRECTORY)
+        self.create_local_dir(journal_directory)
+        journal_file_name = os.path.join(
+            journal_directory,
+            hashlib.sha1(
+                "{}/{}|{}".format(
+                    container_name, remote_file_name, local_file_name
+                ).encode()
+            ).hexdigest(),
+        )
+        stat = os.stat(local_file_name)
+        header = json.dumps(
+            {
+                "container": container_name,
+                "blob": remote_file_name,
+                "file": local_file_name,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "block_size": block_size,
+            }
+        )
+        if os.path.exists(journal_file_name):
+            with open(journal_file_name, "r") as journal:
+                lines = journal.read().splitlines()
+            if lines and lines[0] == header:
+                return journal_file_name, set(lines[1:])
+        with open(journal_file_name, "w") as journal:
+            journal.write(header + "\n")
+        return journal_file_name, set()
+
+    @classmethod
+    def _get_file_paths_from_directory(cls, directory_name: str):
+        """
+        Get all file paths from local directory
+        Args:
+            directory_name: Name of the local directory
+
+        Returns:
+
+        """
+        file_paths = []  # List which will store all of the full file paths.
+
+        # Walk the tree.
+        for root, directories, files in os.walk(directory_name):
+            # Upload journals & download manifests are not data to upload
+            directories[:] = [d for d in directories if d != UPLOAD_JOURNAL_DIRECTORY]
+            for file_name in files:
+                if file_name.startswith(DOWNLOAD_MANIFEST_PREFIX):
+                    continue
+                # Join the two strings in order to form the full filepath.
+                file_path = os.path.join(root, file_name)
+                file_paths.append(file_path)  # Add it to the list.
+
+        return file_paths
+
+    def upload_directory(
+        self,
+        container_name: str,
+        local_directory_name: str,
+        remote_directory_name: Optional[str] = None,
+        overwrite: Optional[bool] = False,
+        block_size: Optional[int] = None,
+        max_concurrency: Optional[int] = 1,
+        incremental: Optional[bool] = False,
+        delete_missing: Optional[bool] = False,
+        checksum: Optional[bool] = False,
+    ):
+        """
+        Upload local folder to blobs
+
+        Args:
+            container_name: Name of the container
+            local_directory_name: Name of the local directory
+            remote_directory_name: Name of the remote directory where file will be uploaded
+            overwrite: set to True if needed
+            block_size: if set, files are uploaded as blocks of block_size bytes (see upload_file)
+            max_concurrency: number of blocks of a file staged at the same time when block_size is set
+            incremental: if True, list the remote directory once and only upload files that are new or changed
+                (different size, or local file modified after the blob). Changed files are overwritten.
+            delete_missing: in incremental mode, also delete blobs of the remote directory with no local file
+            checksum: in incremental mode, compare MD5 of files having the same size instead of modification time
+                (when the blob has a Content-MD5)
+
+        Returns: in incremental mode, a dict with lists of "uploaded", "unchanged" and "deleted" files
+
+        """
+        if incremental:
+            return self._upload_directory_incremental(
+                container_name,
+                local_directory_name,
+                remote_directory_name,
+                delete_missing,
+                checksum,
+                block_size,
+                max_concurrency,
+            )
+
+        file_paths = self._get_file_paths_from_directory(local_directory_name)
+        for filepath in file_paths:
+            if remote_directory_name is not None:
+                remote_file_name = (remote_directory_name + filepath).replace("//", "/")
+            else:
+                remote_file_name = filepath
+            # The blocks of the file are staged within the slot of the file
+            with self._governed():
+                self.upload_file(
+                    container_name,
+                    filepath,
+                    remote_file_name,
+                    overwrite,
+                    block_size,
+                    max_concurrency,
+                )
+
+    def _upload_directory_incremental(
+        self,
+        container_name: str,
+        local_directory_name: str,
+        remote_directory_name: Optional[str],
+        delete_missing: bool,
+        checksum: bool,
+        block_size: Optional[int],
+        max_concurrency: int,
+    ) -> Dict[str, List[str]]:
+        """
+        Upload only new or changed files of a local folder, see upload_directory
+
+        Args:
+            container_name: Name of the container
+            local_directory_name: Name of the local directory
+            remote_directory_name: Name of the remote directory where file will be uploaded
+            delete_missing: delete blobs of the remote directory with no local file
+            checksum: compare MD5 of files having the same size instead of modification time
+            block_size: if set, files are uploaded as blocks of block_size bytes
+            max_concurrency: number of blocks of a file staged at the same time
+
+        Returns: a dict with lists of "uploaded", "unchanged" and "deleted" files
+
+        """
+        remote_blobs = self._get_blobs_properties(
+            container_name,
+            self._get_remote_directory_prefix(
+                local_directory_name, remote_directory_name
+            ),
+        )
+        summary = {"uploaded": [], "unchanged": [], "deleted": []}
+        for filepath in self._get_file_paths_from_directory(local_directory_name):
+            if remote_directory_name is not None:
+                remote_file_name = (remote_directory_name + filepath).replace("//", "/")
+            else:
+                remote_file_name = filepath
+            blob = remote_blobs.pop(remote_file_name, None)
+            if blob is not None and not self._is_local_file_changed(
+                filepath, blob, checksum
+            ):
+                summary["unchanged"].append(filepath)
+                continue
+            with self._governed():
+                self.upload_file(
+                    container_name,
+                    filepath,
+                    remote_file_name,
+                    True,
+                    block_size,
+                    max_concurrency,
+                )
+            summary["uploaded"].append(filepath)
+
+        if delete_missing and remote_blobs:
+            self.delete_blobs(container_name, list(remote_blobs))
+            summary["deleted"] = list(remote_blobs)
+        return summary
+
+    @staticmethod
+    def _get_remote_directory_prefix(
+        local_directory_name: str, remote_directory_name: Optional[str]
+    ) -> str:
+        """
+        Get the blob prefix under which upload_directory puts the files of local_directory_name
+
+        Args:
+            local_directory_name: Name of the local directory
+            remote_directory_name: Name of the remote directory where file will be uploaded
+
+        Returns:
+
+        """
+        if remote_directory_name is not None:
+            prefix = (remote_directory_name + local_directory_name).replace("//", "/")
+        else:
+            prefix = local_directory_name
+        # Do not match sibling directories sharing the same beginning
+        if not prefix.endswith("/"):
+            prefix += "/"
+        return prefix
+
+    def _get_blobs_properties(
+        self,
+        container_name: str,
+        prefix: str,
+        max_concurrency: Optional[int] = None,
+    ) -> Dict:
+        """
+        List blobs with their properties (size, last_modified, content_md5...) in one listing
+
+        Args:
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+            max_concurrency: if set, list with list_blobs_parallel and max_concurrency threads
+
+        Returns: a dict {blob_name: BlobProperties}, empty if the container does not exist
+
+        """
+        try:
+            container_client = self.get_container_client(container_name)
+        except ResourceNotFoundError:
+            return {}
+        if self.index is not None:
+            blobs = self._get_indexed_blobs(
+                container_name, prefix, True, max_concurrency
+            )
+        elif max_concurrency is not None:
+            blobs = self.list_blobs_parallel(
+                container_name,
+                prefix,
+                max_concurrency=max_concurrency,
+                include_properties=True,
+            )
+        else:
+            blobs = container_client.list_blobs(name_starts_with=prefix)
+        return {blob.name: blob for blob in blobs}
+
+    @staticmethod
+    def _is_local_file_changed(file_path: str, blob, checksum: bool) -> bool:
+        """
+        Compare a local file with the properties of a blob
+
+        Args:
+            file_path: path of the local file
+            blob: BlobProperties of the blob
+            checksum: compare MD5 instead of modification time when sizes are equal
+
+        Returns: True if the local file differs from the blob
+
+        """
+        if os.path.getsize(file_path) != blob.size:
+            return True
+        content_md5 = blob.content_settings.content_md5
+        if checksum and content_md5:
+            md5 = hashlib.md5()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                    md5.update(chunk)
+            return md5.digest() != bytes(content_md5)
+        return os.path.getmtime(file_path) > blob.last_modified.timestamp()
+
+    @instrumented("upload")
+    def upload_bytes(
+        self,
+        my_bytes: bytes,
+        container_name: str,
+        remote_file_name: str,
+        overwrite: Optional[bool] = False,
+        content_encoding: Optional[str] = None,
+    ):
+        """
+        Uploaded in memory byte object to blob
+
+        Args:
+            my_bytes: in memory object
+            container_name: Name of the container
+            remote_file_name: Name of the blob where object will be uploaded
+            overwrite: set to True if needed
+            content_encoding: "gzip" or "zstd" to store the object compressed, with this Content-Encoding
+
+        Returns:
+
+        """
+        container_client = self._get_or_create_container_client(container_name)
+
+        content_settings = get_content_settings(content_encoding)
+        if content_encoding is not None:
+            my_bytes = compress_bytes(my_bytes, content_encoding)
+        blob_client = container_client.get_blob_client(remote_file_name)
+        response = blob_client.upload_blob(
+            my_bytes, overwrite=overwrite, content_settings=content_settings
+        )
+        self._on_blob_written(container_name, remote_file_name, response, len(my_bytes))
+
+    @instrumented("delete", None)
+    def delete_blobs(
+        self,
+        container_name: str,
+        remote_file_names: List[str],
+        max_concurrency: Optional[int] = 1,
+    ) -> int:
+        """
+        Delete list of blobs from container_name
+
+        Blobs are deleted in batches of DELETE_BATCH_SIZE, the maximum accepted by the service.
+
+        Args:
+            container_name: Name of the container
+            remote_file_names: list of blob names
+            max_concurrency: number of batches sent at the same time
+
+        Returns: number of deleted blobs
+
+        """
+        return self._delete_blobs_in_batches(
+            container_name, remote_file_names, max_concurrency
+        )
+
+    @instrumented("delete", None)
+    def delete_prefix(
+        self, container_name: str, prefix: str, max_concurrency: Optional[int] = 1
+    ) -> int:
+        """
+        Delete all blobs whose name starts with prefix
+
+        The listing is streamed into batches, so blob names are never all held in memory.
+        With max_concurrency > 1, the listing itself is parallelized like list_blobs_parallel.
+        Blobs are always listed from the service, even with an index which could miss blobs written by other
+        clients, and the deleted blobs are removed from the index.
+
+        Args:
+            container_name: Name of the container
+            prefix: prefix of the blobs to delete
+            max_concurrency: number of batches (and listing requests) sent at the same time
+
+        Returns: number of deleted blobs
+
+        """
+        if max_concurrency > 1:
+            names = self._list_blobs_parallel(container_name, prefix, max_concurrency)
+        else:
+            container_client = self.get_container_client(container_name)
+            names = (
+                blob.name
+                for blob in container_client.list_blobs(name_starts_with=prefix)
+            )
+        return self._delete_blobs_in_batches(container_name, names, max_concurrency)
+
+    def _delete_blobs_in_batches(
+        self,
+        container_name: str,
+        remote_file_names: Iterable[str],
+        max_concurrency: int,
+    ) -> int:
+        """
+        Delete blobs in batches of DELETE_BATCH_SIZE, max_concurrency batches at a time
+
+        Args:
+            container_name: Name of the container
+            remote_file_names: blob names, consumed lazily
+            max_concurrency: number of batches sent at the same time
+
+        Returns: number of deleted blobs
+
+        """
+        container_client = self.get_container_client(container_name)
+        # Bound the number of queued batches so a huge listing is not materialized
+        slots = threading.BoundedSemaphore(2 * max(max_concurrency, 1))
+        lock = threading.Lock()
+        errors = []
+        count = 0
+
+        def _delete(batch: List[str]):
+            nonlocal count
+            try:
+                with self._governed():
+                    container_client.delete_blobs(*batch)
+                with lock:
+                    count += len(batch)
+                if self.cache is not None:
+                    for remote_file_name in batch:
+                        self.cache.invalidate(container_name, remote_file_name)
+                if self.index is not None:
+                    self.index.remove(container_name, batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                slots.release()
+
+        with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+            for batch in self._iter_batches(remote_file_names):
+                slots.acquire()
+                executor.submit(bind_context(_delete), batch)
+        if errors:
+            raise errors[0]
+        return count
+
+    @staticmethod
+    def _iter_batches(names: Iterable[str]) -> Iterator[List[str]]:
+        """
+        Group names in batches accepted by the blob batch API
+
+        Args:
+            names: iterable of blob names
+
+        Returns:
+
+        """
+        batch = []
+        for name in names:
+            batch.append(name)
+            if len(batch) == DELETE_BATCH_SIZE:
+                yield batch
+                batch = []
+        if batch:
+            yield batch
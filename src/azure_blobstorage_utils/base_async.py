@@ -1,28 +1,204 @@
+import asyncio
+import base64
+import contextlib
+import functools
+import hashlib
 import json
+import logging
+import math
+import mmap
 import os
 import shutil
-from typing import Iterable, List, Optional, Tuple, Union
-
-from azure.core.exceptions import ResourceExistsError, ResourceNotFoundError
+import time
+import uuid
+from collections import deque
+from typing import (
+    AsyncIterable,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
+
+from azure.core import MatchConditions
+from azure.core.exceptions import (
+    HttpResponseError,
+    ResourceExistsError,
+    ResourceNotFoundError,
+)
+from azure.core.pipeline.transport import AsyncHttpTransport
+from azure.storage.blob import BlobBlock, BlobProperties
 from azure.storage.blob.aio import BlobServiceClient
 
+from .cache import BlobCache
+from .compression import (
+    compress_bytes,
+    decompress_bytes,
+    decompress_chunks_async,
+    get_content_encoding,
+    get_content_settings,
+)
+from .governor import AsyncConcurrencyGovernor
+from .index import BlobIndex
+from .metrics import BlobObserver, instrumented, observe_response
+from .streams import (
+    MAX_BLOCK_COUNT,
+    AsyncBlobReader,
+    AsyncBlobWriter,
+    AsyncChunkIteratorReader,
+)
+from .transports import PooledAioHttpTransport
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CHUNK_SIZE = 4 * 1024 * 1024
+DEFAULT_BLOCK_SIZE = 1024 * 1024
+DEFAULT_LARGE_FILE_THRESHOLD = 64 * 1024 * 1024
+DELETE_BATCH_SIZE = 256
+# Block upload journals are kept under local_base_path, directory walks skip them
+UPLOAD_JOURNAL_DIRECTORY = ".upload_journals"
+# Manifests of incremental downloads are kept in the local directory, directory walks skip them
+DOWNLOAD_MANIFEST_PREFIX = ".manifest-"
+# Parallel listing walks virtual directories until there are this many prefixes per task
+LISTING_FAN_OUT = 4
+
+
+async def _gather_or_cancel(*aws: Awaitable) -> List:
+    """
+    Run awaitables concurrently like asyncio.gather, but on the first failure cancel the ones still running
+    and wait for them before raising, so that none outlives the caller's resources
+
+    Args:
+        *aws: awaitables to run
+
+    Returns: their results, in order
+
+    """
+    tasks = [asyncio.ensure_future(aw) for aw in aws]
+    try:
+        return await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
 
 class BlobStorageBaseAsync:
     def __init__(
-        self, connection_string: str, local_base_path: Optional[str] = "azure_tmp/"
+        self,
+        connection_string: str,
+        local_base_path: Optional[str] = "azure_tmp/",
+        container_cache_ttl: Optional[float] = 60.0,
+        cache: Optional[BlobCache] = None,
+        index: Optional[BlobIndex] = None,
+        connection_pool_size: Optional[int] = None,
+        keep_alive_timeout: Optional[float] = None,
+        transport: Optional[AsyncHttpTransport] = None,
+        governor: Optional[AsyncConcurrencyGovernor] = None,
+        observers: Optional[List[BlobObserver]] = None,
     ):
         """
+        Use it with `async with`, or await close, to release its aiohttp session
 
         Args:
             connection_string: Connection string to Azure Blob Storage
             local_base_path: local folder where data will be downloaded if path is not specified
+            container_cache_ttl: seconds during which a container is known to exist without checking again.
+                None caches forever, 0 disables the cache.
+            cache: if set, get_file_as_* methods read blobs through this cache
+            index: if set, listings (get_list_blobs_name, list_blobs_parallel & directory operations) are
+                answered from this local index, listing from the service only the prefixes not indexed yet
+            connection_pool_size: maximum number of simultaneous connections, to set above concurrency for
+                concurrent transfers. None for the default of aiohttp (100)
+            keep_alive_timeout: seconds during which an idle connection is kept open. None for the default of
+                aiohttp (15)
+            transport: HTTP transport of the client, overrides connection_pool_size & keep_alive_timeout.
+                To share connections between several instances, give them the same transport built on a session
+                that you own and close (eg. AioHttpTransport(session=session, session_owner=False))
+            governor: if set, bulk operations (directory transfers, blocks of upload_file, batch deletes) adapt
+                their concurrency to the throttling responses of the service, concurrency / max_concurrency
+                becoming upper bounds
+            observers: observers receiving the measures (bytes, latency, retries, HTTP status) of each
+                download, upload & delete operation (eg. MetricsCollector, PrometheusObserver)
         """
+        if transport is None and (
+            connection_pool_size is not None or keep_alive_timeout is not None
+        ):
+            transport = PooledAioHttpTransport(
+                pool_size=100 if connection_pool_size is None else connection_pool_size,
+                keep_alive_timeout=(
+                    15.0 if keep_alive_timeout is None else keep_alive_timeout
+                ),
+            )
+        # Observes every attempt of the retry policy
+        client_kwargs = {"raw_response_hook": self._on_response}
+        if transport is not None:
+            client_kwargs["transport"] = transport
         self.blob_service_client = BlobServiceClient.from_connection_string(
-            connection_string
+            connection_string, **client_kwargs
         )
         self.local_base_path = local_base_path
+        self.container_cache_ttl = container_cache_ttl
+        self._container_clients = {}
+        self.cache = cache
+        self.index = index
+        self.governor = governor
+        self.observers = list(observers or [])
         self.create_local_dir(self.local_base_path)
-        print("Using path: [{}] as local storage".format(self.local_base_path))
+        logger.info("Using path: [%s] as local storage", self.local_base_path)
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        """
+        Close the client and its aiohttp session
+
+        Returns:
+
+        """
+        self._container_clients = {}
+        await self.blob_service_client.close()
+
+    def _on_response(self, response):
+        """
+        Hook called with every response of the service, feeding the governor & the measured operation
+
+        Args:
+            response: azure.core PipelineResponse
+
+        Returns:
+
+        """
+        if self.governor is not None:
+            self.governor.on_response(response)
+        observe_response(response)
+
+    @contextlib.asynccontextmanager
+    async def _governed(self) -> AsyncIterator[None]:
+        """
+        Async context manager running one operation of a bulk operation within the limit of the governor, if any
+
+        Nested calls (eg. for the blocks of a file of a directory transfer) run within the slot of the outer one.
+
+        Returns:
+
+        """
+        if self.governor is None:
+            yield
+        else:
+            async with self.governor.slot():
+                yield
 
     @classmethod
     def create_local_dir(cls, directory_name: str):
@@ -58,20 +234,81 @@ class BlobStorageBaseAsync:
         """
         Get container client from container_name
 
+        Existence of the container is checked once, then cached for container_cache_ttl seconds.
+
         Args:
             container_name: Name of the container
 
         Returns:
 
         """
+        cached = self._container_clients.get(container_name)
+        if cached is not None:
+            container_client, checked_at = cached
+            if (
+                self.container_cache_ttl is None
+                or time.monotonic() - checked_at < self.container_cache_ttl
+            ):
+                return container_client
+
         container_client = self.blob_service_client.get_container_client(container_name)
         if await container_client.exists():
+            self._cache_container_client(container_name, container_client)
             return container_client
         else:
+            self.invalidate_container_cache(container_name)
             raise ResourceNotFoundError(
                 "Container [{}] does not exist.".format(container_name)
             )
 
+    def _cache_container_client(self, container_name: str, container_client):
+        """
+        Remember that container_name exists
+
+        Args:
+            container_name: Name of the container
+            container_client: client of the container
+
+        Returns:
+
+        """
+        if self.container_cache_ttl != 0:
+            self._container_clients[container_name] = (
+                container_client,
+                time.monotonic(),
+            )
+
+    def invalidate_container_cache(self, container_name: Optional[str] = None):
+        """
+        Forget cached container existence, eg. when a container was deleted by another process
+
+        Args:
+            container_name: Name of the container. If None, the whole cache is cleared
+
+        Returns:
+
+        """
+        if container_name is None:
+            self._container_clients.clear()
+        else:
+            self._container_clients.pop(container_name, None)
+
+    async def _get_or_create_container_client(self, container_name: str):
+        """
+        Get container client from container_name, creating the container if needed
+
+        Args:
+            container_name: Name of the container
+
+        Returns:
+
+        """
+        try:
+            return await self.get_container_client(container_name)
+        except ResourceNotFoundError:
+            await self.create_container(container_name)
+            return await self.get_container_client(container_name)
+
     async def create_container(self, container_name: str):
         """
         Create a container named container_name
@@ -83,11 +320,14 @@ class BlobStorageBaseAsync:
 
         """
         try:
-            await self.blob_service_client.create_container(name=container_name)
-        except ResourceExistsError(
-            "Container [{}] already exists. Skipping creation".format(container_name)
-        ):
-            pass
+            container_client = await self.blob_service_client.create_container(
+                name=container_name
+            )
+            self._cache_container_client(container_name, container_client)
+        except ResourceExistsError:
+            logger.info(
+                "Container [%s] already exists. Skipping creation", container_name
+            )
 
     async def delete_container(self, container_name: str):
         """
@@ -99,7 +339,12 @@ class BlobStorageBaseAsync:
         Returns:
 
         """
+        self.invalidate_container_cache(container_name)
         await self.blob_service_client.delete_container(container_name)
+        if self.cache is not None:
+            self.cache.invalidate(container_name)
+        if self.index is not None:
+            self.index.clear(container_name)
 
     def get_blob_client(self, container_name: str, blob_name: str):
         """
@@ -125,24 +370,209 @@ class BlobStorageBaseAsync:
         """
         shutil.rmtree(self.local_base_path)
 
+    @instrumented("download")
     async def get_file_as_bytes(
-        self, container_name: str, remote_file_name: str
+        self,
+        container_name: str,
+        remote_file_name: str,
+        max_concurrency: Optional[int] = 1,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        large_file_threshold: Optional[int] = DEFAULT_LARGE_FILE_THRESHOLD,
     ) -> bytes:
         """
         Get blob as bytes (in memory object)
 
+        If a cache was given to the constructor, the blob is read through it and max_concurrency
+        is passed to the SDK download instead. Blobs stored with a gzip or zstd Content-Encoding are
+        decompressed.
+
         Args:
             container_name: Name of the container
             remote_file_name: Name of the blob
+            max_concurrency: if greater than 1, blobs larger than large_file_threshold are fetched as
+                ranges of chunk_size bytes, max_concurrency at a time, into one preallocated buffer
+            chunk_size: size in bytes of each ranged request in large-file mode
+            large_file_threshold: minimum blob size in bytes to use large-file mode
 
-        Returns:
+        Returns: the content of the blob
 
         """
         blob_client = self.get_blob_client(container_name, remote_file_name)
-        stream = await blob_client.download_blob()
+        if self.cache is not None:
+            return await self._get_cached_file_as_bytes(
+                blob_client, container_name, remote_file_name, max_concurrency
+            )
+        if max_concurrency <= 1:
+            stream = await blob_client.download_blob(decompress=False)
+            content_encoding = get_content_encoding(stream.properties)
+            if content_encoding is None:
+                data = await stream.readall()
+                return data
+            return b"".join(
+                [
+                    data
+                    async for data in decompress_chunks_async(
+                        stream.chunks(), content_encoding
+                    )
+                ]
+            )
+
+        stream, size, conditions = await self._get_first_range(blob_client, chunk_size)
+        if stream is None:
+            return b""
+        content_encoding = get_content_encoding(stream.properties)
+        data = await stream.readall()
+        if len(data) < size < large_file_threshold:
+            # Below the threshold, the rest of the blob is fetched in one request
+            stream = await blob_client.download_blob(
+                offset=len(data), decompress=False, **conditions
+            )
+            data += await stream.readall()
+        elif len(data) < size:
+            buffer = bytearray(size)
+            buffer[: len(data)] = data
+
+            def _write(offset: int, range_data: bytes):
+                buffer[offset : offset + len(range_data)] = range_data
+
+            await self._download_ranges(
+                blob_client,
+                len(data),
+                size,
+                chunk_size,
+                max_concurrency,
+                conditions,
+                _write,
+            )
+            data = bytes(buffer)
+        if content_encoding is not None:
+            # Ranges are downloaded as stored, the blob is decompressed once complete, out of the event loop
+            return await asyncio.get_running_loop().run_in_executor(
+                None, decompress_bytes, data, content_encoding
+            )
+        return data
+
+    async def _get_cached_file_as_bytes(
+        self,
+        blob_client,
+        container_name: str,
+        remote_file_name: str,
+        max_concurrency: int,
+    ) -> bytes:
+        """
+        Get blob as bytes through the cache, revalidating the cached copy with its ETag
+
+        Args:
+            blob_client: client of the blob
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            max_concurrency: number of parallel connections of the SDK download
+
+        Returns:
+
+        """
+        entry = self.cache.get(container_name, remote_file_name)
+        if entry is not None and self.cache.is_fresh(entry):
+            return entry.data
+
+        conditions = {}
+        if entry is not None:
+            conditions = {
+                "etag": entry.etag,
+                "match_condition": MatchConditions.IfModified,
+            }
+        try:
+            stream = await blob_client.download_blob(
+                max_concurrency=max_concurrency, decompress=False, **conditions
+            )
+        except HttpResponseError as e:
+            if entry is not None and e.status_code == 304:
+                self.cache.touch(container_name, remote_file_name)
+                return entry.data
+            raise
         data = await stream.readall()
+        content_encoding = get_content_encoding(stream.properties)
+        if content_encoding is not None:
+            data = await asyncio.get_running_loop().run_in_executor(
+                None, decompress_bytes, data, content_encoding
+            )
+        self.cache.put(container_name, remote_file_name, data, stream.properties.etag)
         return data
 
+    async def open_blob(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        mode: Optional[str] = "rb",
+        block_size: Optional[int] = DEFAULT_BLOCK_SIZE,
+        read_ahead: Optional[int] = 4,
+        cache_blocks: Optional[int] = 16,
+        overwrite: Optional[bool] = False,
+        max_concurrency: Optional[int] = 1,
+        content_encoding: Optional[str] = None,
+    ) -> Union[AsyncBlobReader, AsyncChunkIteratorReader, AsyncBlobWriter]:
+        """
+        Open a blob as an async file-like object
+
+        Use it with `async with`. In "rb" mode, `await reader.read(size)` only reads the ranges that are
+        accessed; seek and tell are synchronous. Blobs stored with a gzip or zstd Content-Encoding are
+        decompressed as they are read sequentially, and are not seekable. In "wb" mode, `await writer.write(data)` stages blocks while
+        the buffer fills and the blob is committed on close, without any local file. Leaving an async with
+        block on an exception discards the written data.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            mode: "rb" or "wb"
+            block_size: size in bytes of each range request ("rb") or staged block ("wb")
+            read_ahead: number of blocks fetched ahead of the current one during sequential reads ("rb")
+            cache_blocks: number of blocks kept in memory ("rb")
+            overwrite: set to True if needed ("wb")
+            max_concurrency: number of blocks staged at the same time ("wb")
+            content_encoding: "gzip" or "zstd" to compress the data as it is written ("wb")
+
+        Returns:
+
+        """
+        if mode == "wb":
+            container_client = await self._get_or_create_container_client(
+                container_name
+            )
+            blob_client = container_client.get_blob_client(remote_file_name)
+            if not overwrite and await blob_client.exists():
+                raise ResourceExistsError(
+                    "Blob [{}] already exists.".format(remote_file_name)
+                )
+            on_commit = functools.partial(
+                self._on_blob_written, container_name, remote_file_name
+            )
+            return AsyncBlobWriter(
+                blob_client,
+                overwrite,
+                block_size,
+                max_concurrency,
+                on_commit,
+                content_encoding,
+            )
+        if mode != "rb":
+            raise ValueError(
+                "Mode [{}] not supported - only ['rb', 'wb'].".format(mode)
+            )
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        properties = await blob_client.get_blob_properties()
+        if get_content_encoding(properties) is not None:
+            return AsyncChunkIteratorReader(
+                self._iter_blob_chunks(container_name, remote_file_name, block_size)
+            )
+        return AsyncBlobReader(
+            blob_client,
+            properties.size,
+            properties.etag,
+            block_size,
+            read_ahead,
+            cache_blocks,
+        )
+
     async def get_file_as_text(self, container_name: str, remote_file_name: str) -> str:
         """
         Get blob as text
@@ -175,241 +605,1688 @@ class BlobStorageBaseAsync:
         container_name: str,
         prefix: Optional[str] = None,
         return_list: Optional[bool] = True,
-    ) -> Union[List[str], Iterable[str]]:
+        include_properties: Optional[bool] = False,
+        results_per_page: Optional[int] = None,
+    ) -> Union[
+        List[str],
+        List[BlobProperties],
+        AsyncIterator[str],
+        AsyncIterator[BlobProperties],
+    ]:
         """
-        Get list/generator of objects in container_name
+        Get list/async generator of objects in container_name
+
+        With return_list=False, names are yielded as each listing page arrives:
+        `async for name in await storage.get_list_blobs_name(container_name, return_list=False)`
 
         Args:
             container_name: Name of the container
             prefix: filter blobs with prefix
-            return_list: if False, returns a generator
+            return_list: if False, returns an async generator fetching the listing page by page
+            include_properties: if True, yields BlobProperties instead of names (size, etag, last_modified,
+                content_settings.content_md5...), without any request per blob
+            results_per_page: maximum number of blobs per listing request, None for the service default (5000)
 
         Returns:
 
         """
+        if self.index is not None:
+            res = await self._get_indexed_blobs(
+                container_name, prefix, include_properties
+            )
+            return res if return_list else self._iter_items(res)
         container_client = await self.get_container_client(container_name)
-        if prefix is not None:
-            res = []
-            async for blob in container_client.list_blobs(name_starts_with=prefix):
-                res.append(blob.name)
-        else:
-            res = []
-            async for blob in container_client.list_blobs():
-                res.append(blob.name)
-
-        if not return_list:
-            res = (y for y in res)
+        res = self._iter_blobs(
+            container_client, prefix, include_properties, results_per_page
+        )
+        if return_list:
+            res = [blob async for blob in res]
         return res
 
-    async def download_file(
-        self,
-        container_name: str,
-        remote_file_name: str,
-        local_file_name: Optional[str] = None,
-    ):
+    @staticmethod
+    async def _iter_items(items: Iterable) -> AsyncIterator:
         """
-        Download a blob named remote_file_name from a container named container_name
+        Async generator over the items of an iterable
 
         Args:
-            container_name: Name of the container
-            remote_file_name: Name of the blob
-            local_file_name: Name of the local file where the blob will be downloaded
+            items: iterable
 
         Returns:
 
         """
-        if local_file_name is None:
-            directory_name, file_name = self.get_directory_and_filename_from_full_path(
-                remote_file_name
-            )
-            if directory_name is None:
-                self.create_local_dir(self.local_base_path)
-                local_file_name = self.local_base_path + file_name
-            else:
-                self.create_local_dir(self.local_base_path + directory_name)
-                local_file_name = self.local_base_path + directory_name + file_name
-        else:
-            directory_name, file_name = self.get_directory_and_filename_from_full_path(
-                local_file_name
-            )
-            if directory_name is None:
-                self.create_local_dir(self.local_base_path)
-                local_file_name = self.local_base_path + file_name
-            else:
-                self.create_local_dir(directory_name)
-                local_file_name = directory_name + file_name
-
-        blob_client = self.get_blob_client(container_name, remote_file_name)
-        print("Downloading {} to {}".format(remote_file_name, local_file_name))
-        with open(local_file_name, "wb") as my_blob:
-            stream = await blob_client.download_blob()
-            data = await stream.readall()
-            my_blob.write(data)
+        for item in items:
+            yield item
 
-    async def download_directory(
+    async def list_blobs_parallel(
         self,
         container_name: str,
-        remote_directory: str,
-        local_directory: Optional[str] = None,
-    ):
+        prefix: Optional[str] = None,
+        concurrency: Optional[int] = 8,
+        delimiter: Optional[str] = "/",
+        sort: Optional[bool] = False,
+        include_properties: Optional[bool] = False,
+        results_per_page: Optional[int] = None,
+    ) -> AsyncIterator[Union[str, BlobProperties]]:
         """
-        Download all blobs in directory
+        List blobs with concurrent requests, for containers too large for one sequential listing
+
+        Virtual directories are first walked with delimiter, level by level, until there are enough
+        sub-prefixes to keep concurrency requests in flight. The sub-prefixes are then listed concurrently.
+        A prefix without virtual directories is listed sequentially, at no extra cost, its blobs yielded as the
+        listing pages arrive. Other blobs found while walking are held until they can be yielded.
 
         Args:
             container_name: Name of the container
-            remote_directory: Name of the remote directory
-            local_directory: Name of the local directory where files will be downloaded
+            prefix: filter blobs with prefix
+            concurrency: number of listing requests sent at the same time
+            delimiter: separator of virtual directories in blob names
+            sort: if True, yields blobs in name order like get_list_blobs_name. Otherwise blobs are yielded as
+                soon as their sub-prefix is listed
+            include_properties: if True, yields BlobProperties instead of names
+            results_per_page: maximum number of blobs per listing request, None for the service default (5000)
 
-        Returns:
+        Returns: an async generator of blob names (or BlobProperties)
 
         """
-        blob_gen = await self.get_list_blobs_name(
-            container_name, prefix=remote_directory, return_list=False
-        )
-
-        for blob_name in blob_gen:
-            if local_directory is not None:
-                await self.download_file(
-                    container_name,
-                    blob_name,
-                    (local_directory + blob_name).replace("//", "/"),
-                )
-            else:
-                await self.download_file(container_name, blob_name)
+        if self.index is not None:
+            for blob in await self._get_indexed_blobs(
+                container_name, prefix, include_properties, concurrency
+            ):
+                yield blob
+            return
+        async for blob in self._list_blobs_parallel(
+            container_name,
+            prefix,
+            concurrency,
+            delimiter,
+            sort,
+            include_properties,
+            results_per_page,
+        ):
+            yield blob
 
-    async def upload_file(
+    async def _list_blobs_parallel(
         self,
         container_name: str,
-        local_file_name: str,
-        remote_file_name: Optional[str] = None,
-        overwrite: Optional[bool] = False,
-    ):
+        prefix: Optional[str],
+        concurrency: int,
+        delimiter: str = "/",
+        sort: bool = False,
+        include_properties: bool = False,
+        results_per_page: Optional[int] = None,
+    ) -> AsyncIterator[Union[str, BlobProperties]]:
         """
-        Upload a local file to a blob
+        List blobs from the service with concurrent requests, see list_blobs_parallel
 
         Args:
             container_name: Name of the container
-            local_file_name: Name of the local file
-            remote_file_name: Name of the blob where file will be uploaded
-            overwrite: set to True if needed
+            prefix: filter blobs with prefix
+            concurrency: number of listing requests sent at the same time
+            delimiter: separator of virtual directories in blob names
+            sort: if True, yields blobs in name order
+            include_properties: if True, yields BlobProperties instead of names
+            results_per_page: maximum number of blobs per listing request
 
         Returns:
 
         """
         container_client = await self.get_container_client(container_name)
-        if not await container_client.exists():
-            await self.create_container(container_name)
-            container_client = await self.get_container_client(container_name)
-
-        if remote_file_name is None:
-            directory_name, file_name = self.get_directory_and_filename_from_full_path(
-                local_file_name
-            )
-            remote_file_name = (
-                directory_name.replace(self.local_base_path, "") + file_name
-            )
+        concurrency = max(concurrency, 1)
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def _walk(walk_prefix: str) -> AsyncIterator[Union[BlobProperties, str]]:
+            # Blobs and sub-prefixes, in name order: each page lists its sub-prefixes before its blobs
+            async for page in container_client.walk_blobs(
+                name_starts_with=walk_prefix,
+                delimiter=delimiter,
+                results_per_page=results_per_page,
+            ).by_page():
+                items = [item async for item in page]
+                for item in sorted(items, key=lambda item: item.name):
+                    yield item if isinstance(item, BlobProperties) else item.name
+
+        async def _walk_all(walk_prefix: str) -> List[Union[BlobProperties, str]]:
+            async with semaphore:
+                return [item async for item in _walk(walk_prefix)]
+
+        async def _list(list_prefix: str) -> List[BlobProperties]:
+            async with semaphore:
+                return [
+                    blob
+                    async for blob in container_client.list_blobs(
+                        name_starts_with=list_prefix, results_per_page=results_per_page
+                    )
+                ]
+
+        def _submit(list_prefix: str) -> asyncio.Future:
+            task = asyncio.ensure_future(_list(list_prefix))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+            return task
+
+        def _output(blobs: Iterable[BlobProperties]) -> Iterator:
+            for blob in blobs:
+                yield blob if include_properties else blob.name
 
-        blob_client = container_client.get_blob_client(remote_file_name)
         try:
-            with open(local_file_name, "rb") as data:
-                await blob_client.upload_blob(data, overwrite=overwrite)
-        except ResourceExistsError as e:
-            print(
-                "File [{}] already exists. Use overwrite = True if needed".format(
-                    remote_file_name
-                )
-            )
-            raise e
-
-    @classmethod
-    def _get_file_paths_from_directory(cls, directory_name: str):
+            # Blobs found while walking and sub-prefixes (str) still to list, in name order
+            segments = [prefix or ""]
+            prefix_count = 1
+            while 0 < prefix_count < LISTING_FAN_OUT * concurrency:
+                if len(segments) == 1:
+                    # A lone prefix is walked as its pages arrive, and blobs which can already be output are
+                    # not held: the blobs of a flat prefix are streamed
+                    async for item in _walk(segments.pop()):
+                        if isinstance(item, str) or (sort and segments):
+                            segments.append(item)
+                        else:
+                            for blob in _output([item]):
+                                yield blob
+                else:
+                    prefixes = [
+                        segment for segment in segments if isinstance(segment, str)
+                    ]
+                    walked = dict(
+                        zip(
+                            prefixes,
+                            await _gather_or_cancel(*[_walk_all(p) for p in prefixes]),
+                        )
+                    )
+                    segments = [
+                        item
+                        for segment in segments
+                        for item in (
+                            walked[segment] if isinstance(segment, str) else [segment]
+                        )
+                    ]
+                prefix_count = sum(isinstance(segment, str) for segment in segments)
+
+            # Bound the number of sub-prefix listings held in memory
+            window = 2 * concurrency
+            if sort:
+                pending = deque()
+                in_flight = 0
+                for segment in segments:
+                    if isinstance(segment, str):
+                        pending.append(_submit(segment))
+                        in_flight += 1
+                    else:
+                        pending.append([segment])
+                    while in_flight > window:
+                        blobs = pending.popleft()
+                        if isinstance(blobs, asyncio.Future):
+                            in_flight -= 1
+                            blobs = await blobs
+                        for blob in _output(blobs):
+                            yield blob
+                for blobs in pending:
+                    if isinstance(blobs, asyncio.Future):
+                        blobs = await blobs
+                    for blob in _output(blobs):
+                        yield blob
+            else:
+                for blob in _output(
+                    segment for segment in segments if not isinstance(segment, str)
+                ):
+                    yield blob
+                futures = set()
+                for segment in segments:
+                    if isinstance(segment, str):
+                        futures.add(_submit(segment))
+                    while len(futures) > window:
+                        done, futures = await asyncio.wait(
+                            futures, return_when=asyncio.FIRST_COMPLETED
+                        )
+                        for future in done:
+                            for blob in _output(future.result()):
+                                yield blob
+                while futures:
+                    done, futures = await asyncio.wait(
+                        futures, return_when=asyncio.FIRST_COMPLETED
+                    )
+                    for future in done:
+                        for blob in _output(future.result()):
+                            yield blob
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+    async def refresh_index(
+        self,
+        container_name: str,
+        prefix: Optional[str] = None,
+        concurrency: Optional[int] = None,
+    ):
         """
-        Get all file paths from local directory
+        List blobs starting with prefix from the service into the index given to the constructor
+
         Args:
-            directory_name: Name of the local directory
+            container_name: Name of the container
+            prefix: prefix to list, None for the whole container
+            concurrency: if set, list with list_blobs_parallel and concurrency requests in flight
 
         Returns:
 
         """
-        file_paths = []  # List which will store all of the full file paths.
-
-        # Walk the tree.
-        for root, _, files in os.walk(directory_name):
-            for file_name in files:
-                # Join the two strings in order to form the full filepath.
-                file_path = os.path.join(root, file_name)
-                file_paths.append(file_path)  # Add it to the list.
-
-        return file_paths
+        if concurrency is not None:
+            listing = self._list_blobs_parallel(
+                container_name, prefix, concurrency, include_properties=True
+            )
+        else:
+            container_client = await self.get_container_client(container_name)
+            listing = self._iter_blobs(container_client, prefix, True)
+        blobs = [blob async for blob in listing]
+        # Writing a large listing to SQLite would block the event loop
+        await asyncio.get_running_loop().run_in_executor(
+            None, self.index.refresh, container_name, prefix, blobs
+        )
 
-    async def upload_directory(
+    async def query_index(
         self,
         container_name: str,
-        local_directory_name: str,
-        remote_directory_name: Optional[str] = None,
-        overwrite: Optional[bool] = False,
-    ):
+        prefix: Optional[str] = None,
+        pattern: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        include_properties: Optional[bool] = False,
+    ) -> Union[List[str], List[BlobProperties]]:
         """
-        Upload local folder to blobs
+        Query the blobs of the index given to the constructor, listing prefix first if it is not indexed yet
 
         Args:
             container_name: Name of the container
-            local_directory_name: Name of the local directory
-            remote_directory_name: Name of the remote directory where file will be uploaded
-            overwrite: set to True if needed
+            prefix: filter blobs with prefix
+            pattern: filter blobs with a glob pattern on the whole name (eg. "images/*/*.jpg"), case-sensitive
+            min_size: filter blobs of at least min_size bytes
+            max_size: filter blobs of at most max_size bytes
+            include_properties: if True, returns BlobProperties instead of names
 
-        Returns:
+        Returns: names (or BlobProperties) in name order
 
         """
-        file_paths = self._get_file_paths_from_directory(local_directory_name)
-        for filepath in file_paths:
-            if remote_directory_name is not None:
-                await self.upload_file(
-                    container_name,
-                    filepath,
-                    (remote_directory_name + filepath).replace("//", "/"),
-                    overwrite,
-                )
-            else:
-                await self.upload_file(container_name, filepath, filepath, overwrite)
+        if not self.index.is_fresh(container_name, prefix):
+            await self.refresh_index(container_name, prefix)
+        return self.index.query(
+            container_name, prefix, pattern, min_size, max_size, include_properties
+        )
 
-    async def upload_bytes(
+    async def _get_indexed_blobs(
         self,
-        my_bytes: bytes,
         container_name: str,
-        remote_file_name: str,
-        overwrite: Optional[bool] = False,
-    ):
+        prefix: Optional[str],
+        include_properties: bool,
+        concurrency: Optional[int] = None,
+    ) -> Union[List[str], List[BlobProperties]]:
         """
-        Uploaded in memory byte object to blob
+        Get blobs starting with prefix from the index, listing prefix first if it is not indexed yet
 
         Args:
-            my_bytes: in memory object
             container_name: Name of the container
-            remote_file_name: Name of the blob where object will be uploaded
-            overwrite: set to True if needed
+            prefix: filter blobs with prefix
+            include_properties: if True, returns BlobProperties instead of names
+            concurrency: if set, a listing is done with list_blobs_parallel and concurrency requests in flight
 
         Returns:
 
         """
-        container_client = await self.get_container_client(container_name)
-        if not await container_client.exists():
-            await self.create_container(container_name)
-            container_client = await self.get_container_client(container_name)
-
-        blob_client = container_client.get_blob_client(remote_file_name)
-        await blob_client.upload_blob(my_bytes, overwrite=overwrite)
+        if not self.index.is_fresh(container_name, prefix):
+            await self.refresh_index(container_name, prefix, concurrency)
+        return self.index.query(
+            container_name, prefix, include_properties=include_properties
+        )
 
-    async def delete_blobs(self, container_name: str, remote_file_names: List[str]):
+    async def _on_blob_written(
+        self, container_name: str, remote_file_name: str, response: Dict, size: int
+    ):
+        """
+        Update what the cache & index know about a blob after it was written
+
+        The cached content is dropped, and the index gets the properties of the new blob from the upload
+        response, so that indexed listings stay fresh without any request to the service.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            response: response of the upload or of the block list commit
+            size: size of the written blob
+
+        Returns:
+
+        """
+        if self.cache is not None:
+            self.cache.invalidate(container_name, remote_file_name)
+        if self.index is not None:
+            self.index.update_written(container_name, remote_file_name, size, response)
+
+    async def _iter_blobs_name(
+        self, container_name: str, prefix: Optional[str] = None
+    ) -> AsyncIterator[str]:
+        """
+        Async generator over blob names in container_name, page by page
+
+        Args:
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+
+        Returns:
+
+        """
+        if self.index is not None:
+            for name in await self._get_indexed_blobs(container_name, prefix, False):
+                yield name
+            return
+        container_client = await self.get_container_client(container_name)
+        async for name in self._iter_blobs(container_client, prefix):
+            yield name
+
+    @staticmethod
+    async def _iter_blobs(
+        container_client,
+        prefix: Optional[str] = None,
+        include_properties: bool = False,
+        results_per_page: Optional[int] = None,
+    ) -> AsyncIterator[Union[str, BlobProperties]]:
+        """
+        Async generator over the blobs of a container, page by page
+
+        Args:
+            container_client: async client of the container
+            prefix: filter blobs with prefix
+            include_properties: if True, yields BlobProperties instead of names
+            results_per_page: maximum number of blobs per listing request
+
+        Returns:
+
+        """
+        async for blob in container_client.list_blobs(
+            name_starts_with=prefix, results_per_page=results_per_page
+        ):
+            yield blob if include_properties else blob.name
+
+    async def _run_concurrently(
+        self,
+        func: Callable[[str], Awaitable],
+        items: Union[Iterable[str], AsyncIterable[str]],
+        concurrency: int,
+    ) -> Dict[str, Optional[Exception]]:
+        """
+        Run func on every item with at most concurrency calls in flight
+
+        Items are consumed lazily, and a failing call does not cancel the others.
+        If consuming items fails, the calls in flight are cancelled before the error is raised.
+
+        Args:
+            func: coroutine function called with each item
+            items: iterable or async iterable of items
+            concurrency: maximum number of concurrent calls
+
+        Returns: a dict {item: None if func succeeded else the raised exception}
+
+        """
+        results = {}
+        semaphore = asyncio.Semaphore(concurrency)
+        tasks = set()
+
+        async def _run(item: str):
+            try:
+                async with self._governed():
+                    await func(item)
+                results[item] = None
+            except Exception as e:
+                results[item] = e
+            finally:
+                semaphore.release()
+
+        async def _submit(item: str):
+            await semaphore.acquire()
+            task = asyncio.ensure_future(_run(item))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+
+        try:
+            if hasattr(items, "__aiter__"):
+                async for item in items:
+                    await _submit(item)
+            else:
+                for item in items:
+                    await _submit(item)
+        except BaseException:
+            # Calls already submitted must not outlive a failed (or cancelled) listing
+            pending = list(tasks)
+            for task in pending:
+                task.cancel()
+            await asyncio.gather(*pending, return_exceptions=True)
+            raise
+        await asyncio.gather(*tasks)
+        return results
+
+    def _get_local_file_name(
+        self, remote_file_name: str, local_file_name: Optional[str] = None
+    ) -> str:
+        """
+        Get the local path where download_file writes a blob
+
+        Args:
+            remote_file_name: Name of the blob
+            local_file_name: Name of the local file where the blob will be downloaded
+
+        Returns:
+
+        """
+        if local_file_name is None:
+            directory_name, file_name = self.get_directory_and_filename_from_full_path(
+                remote_file_name
+            )
+            if directory_name is None:
+                return self.local_base_path + file_name
+            return self.local_base_path + directory_name + file_name
+        directory_name, file_name = self.get_directory_and_filename_from_full_path(
+            local_file_name
+        )
+        if directory_name is None:
+            return self.local_base_path + file_name
+        return directory_name + file_name
+
+    @instrumented("download")
+    async def download_file(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        local_file_name: Optional[str] = None,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        max_concurrency: Optional[int] = 1,
+        large_file_threshold: Optional[int] = DEFAULT_LARGE_FILE_THRESHOLD,
+    ):
+        """
+        Download a blob named remote_file_name from a container named container_name
+
+        The blob is streamed chunk by chunk to a temporary file which is renamed to local_file_name
+        once complete, so memory stays bounded by chunk_size and an interrupted download never
+        leaves a partial file under the final name.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            local_file_name: Name of the local file where the blob will be downloaded
+            chunk_size: size in bytes of each ranged request
+            max_concurrency: if greater than 1, blobs larger than large_file_threshold are fetched as
+                ranges of chunk_size bytes, max_concurrency at a time, each written at its offset
+                into a preallocated file
+            large_file_threshold: minimum blob size in bytes to use large-file mode
+
+        Returns:
+
+        """
+        local_file_name = self._get_local_file_name(remote_file_name, local_file_name)
+        self.create_local_dir(os.path.dirname(local_file_name) or ".")
+
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        logger.debug("Downloading %s to %s", remote_file_name, local_file_name)
+        await self._stream_blob_to_file(
+            blob_client,
+            local_file_name,
+            chunk_size,
+            max_concurrency,
+            large_file_threshold,
+        )
+
+    async def _get_first_range(self, blob_client, chunk_size: int):
+        """
+        Download the first range of a blob, which also tells its size
+
+        Args:
+            blob_client: client of the blob to download
+            chunk_size: size in bytes of the range
+
+        Returns: downloader of the range (None if the blob is empty), size of the blob,
+            conditions pinning later ranges to the same version of the blob
+
+        """
+        try:
+            stream = await blob_client.download_blob(
+                offset=0, length=chunk_size, decompress=False
+            )
+        except HttpResponseError as e:
+            # Ranged requests are rejected on empty blobs
+            if e.status_code == 416:
+                return None, 0, {}
+            raise
+        conditions = {
+            "etag": stream.properties.etag,
+            "match_condition": MatchConditions.IfNotModified,
+        }
+        return stream, int(stream.properties.content_range.split("/")[-1]), conditions
+
+    @staticmethod
+    async def _download_ranges(
+        blob_client,
+        start: int,
+        size: int,
+        chunk_size: int,
+        max_concurrency: int,
+        conditions: Dict,
+        write: Callable[[int, bytes], None],
+    ):
+        """
+        Download bytes [start, size) of a blob as ranges of chunk_size bytes
+
+        Args:
+            blob_client: client of the blob to download
+            start: first byte to download
+            size: size of the blob
+            chunk_size: size in bytes of each ranged request
+            max_concurrency: number of ranges downloaded at the same time
+            conditions: conditions pinning ranges to the same version of the blob
+            write: called with (offset, data) for each downloaded range
+
+        Returns:
+
+        """
+        semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+        async def _download_range(offset: int):
+            async with semaphore:
+                stream = await blob_client.download_blob(
+                    offset=offset,
+                    length=min(chunk_size, size - offset),
+                    decompress=False,
+                    **conditions
+                )
+                write(offset, await stream.readall())
+
+        await _gather_or_cancel(
+            *(_download_range(offset) for offset in range(start, size, chunk_size))
+        )
+
+    async def _iter_blob_chunks(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+    ) -> AsyncIterator[bytes]:
+        """
+        Generator over the content of a blob, as ranges of chunk_size bytes fetched one at a time
+
+        Blobs stored with a gzip or zstd Content-Encoding are decompressed as the ranges come.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            chunk_size: size in bytes of each ranged request
+
+        Returns:
+
+        """
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        stream, size, conditions = await self._get_first_range(blob_client, chunk_size)
+        if stream is None:
+            return
+        content_encoding = get_content_encoding(stream.properties)
+        chunks = self._iter_ranges(blob_client, stream, size, chunk_size, conditions)
+        if content_encoding is not None:
+            chunks = decompress_chunks_async(chunks, content_encoding)
+        async for data in chunks:
+            yield data
+
+    @staticmethod
+    async def _iter_ranges(
+        blob_client, stream, size: int, chunk_size: int, conditions: Dict
+    ) -> AsyncIterator[bytes]:
+        """
+        Generator over the stored bytes of a blob, from its first range then ranges of chunk_size bytes
+
+        Args:
+            blob_client: client of the blob to download
+            stream: downloader of the first range
+            size: size of the blob
+            chunk_size: size in bytes of each ranged request
+            conditions: conditions pinning ranges to the same version of the blob
+
+        Returns:
+
+        """
+        offset = 0
+        while True:
+            data = await stream.readall()
+            offset += len(data)
+            yield data
+            if offset >= size:
+                return
+            stream = await blob_client.download_blob(
+                offset=offset, length=chunk_size, decompress=False, **conditions
+            )
+
+    async def _stream_blob_to_file(
+        self,
+        blob_client,
+        local_file_name: str,
+        chunk_size: int,
+        max_concurrency: Optional[int] = 1,
+        large_file_threshold: Optional[int] = DEFAULT_LARGE_FILE_THRESHOLD,
+    ):
+        """
+        Download a blob with ranged requests of chunk_size bytes into local_file_name
+
+        Blobs stored with a gzip or zstd Content-Encoding are decompressed as the ranges come, one at a time.
+
+        Args:
+            blob_client: client of the blob to download
+            local_file_name: Name of the local file
+            chunk_size: size in bytes of each ranged request
+            max_concurrency: number of ranges downloaded at the same time for large blobs
+            large_file_threshold: minimum blob size in bytes to download ranges concurrently
+
+        Returns:
+
+        """
+        tmp_file_name = "{}.{}.part".format(local_file_name, uuid.uuid4().hex)
+        try:
+            stream, size, conditions = await self._get_first_range(
+                blob_client, chunk_size
+            )
+            content_encoding = (
+                None if stream is None else get_content_encoding(stream.properties)
+            )
+            with open(tmp_file_name, "xb") as my_blob:
+                if content_encoding is not None:
+                    # A compressed stream is decoded in order: ranges can't be written at their offsets
+                    async for data in decompress_chunks_async(
+                        self._iter_ranges(
+                            blob_client, stream, size, chunk_size, conditions
+                        ),
+                        content_encoding,
+                    ):
+                        my_blob.write(data)
+                else:
+                    await self._write_ranges_to_file(
+                        blob_client,
+                        my_blob,
+                        stream,
+                        size,
+                        chunk_size,
+                        conditions,
+                        max_concurrency if size >= large_file_threshold else 1,
+                    )
+            os.replace(tmp_file_name, local_file_name)
+        except BaseException:
+            if os.path.exists(tmp_file_name):
+                os.remove(tmp_file_name)
+            raise
+
+    async def _write_ranges_to_file(
+        self,
+        blob_client,
+        my_blob,
+        stream,
+        size: int,
+        chunk_size: int,
+        conditions: Dict,
+        max_concurrency: int,
+    ):
+        """
+        Write the stored bytes of a blob into an open file, from its first range then ranges of chunk_size bytes
+
+        Args:
+            blob_client: client of the blob to download
+            my_blob: file opened for writing
+            stream: downloader of the first range, None if the blob is empty
+            size: size of the blob
+            chunk_size: size in bytes of each ranged request
+            conditions: conditions pinning ranges to the same version of the blob
+            max_concurrency: number of ranges downloaded at the same time
+
+        Returns:
+
+        """
+        offset = 0 if stream is None else await stream.readinto(my_blob)
+        if max_concurrency > 1:
+            # Preallocate the file so each range is written at its offset
+            my_blob.truncate(size)
+
+            def _write(range_offset: int, data: bytes):
+                my_blob.seek(range_offset)
+                my_blob.write(data)
+
+            await self._download_ranges(
+                blob_client,
+                offset,
+                size,
+                chunk_size,
+                max_concurrency,
+                conditions,
+                _write,
+            )
+        else:
+            while offset < size:
+                stream = await blob_client.download_blob(
+                    offset=offset, length=chunk_size, decompress=False, **conditions
+                )
+                offset += await stream.readinto(my_blob)
+
+    async def download_directory(
+        self,
+        container_name: str,
+        remote_directory: str,
+        local_directory: Optional[str] = None,
+        concurrency: Optional[int] = None,
+        incremental: Optional[bool] = False,
+        delete_missing: Optional[bool] = False,
+    ) -> Optional[Dict[str, Optional[Exception]]]:
+        """
+        Download all blobs in directory
+
+        Args:
+            container_name: Name of the container
+            remote_directory: Name of the remote directory
+            local_directory: Name of the local directory where files will be downloaded
+            concurrency: if set, download up to concurrency blobs at the same time while the listing is paging.
+                A failure does not cancel the other downloads.
+            incremental: if True, keep a manifest of downloaded blobs (ETag, size, local path) in the local directory
+                and skip blobs whose ETag did not change since the last run
+            delete_missing: in incremental mode, remove local files of blobs which no longer exist
+
+        Returns: in incremental mode, a dict with lists of "downloaded" and "unchanged" blobs and "deleted" local files
+            (and "failed", a dict {blob_name: exception}, if concurrency is set).
+            Otherwise None in sequential mode, otherwise a dict {blob_name: None if downloaded else the raised exception}
+
+        """
+
+        async def _download(blob_name: str):
+            if local_directory is not None:
+                await self.download_file(
+                    container_name,
+                    blob_name,
+                    (local_directory + blob_name).replace("//", "/"),
+                )
+            else:
+                await self.download_file(container_name, blob_name)
+
+        if incremental:
+            return await self._download_directory_incremental(
+                container_name,
+                remote_directory,
+                local_directory,
+                delete_missing,
+                _download,
+                concurrency,
+            )
+
+        if concurrency is not None:
+            return await self._run_concurrently(
+                _download,
+                self.list_blobs_parallel(
+                    container_name, remote_directory, concurrency=concurrency
+                ),
+                concurrency,
+            )
+
+        blob_gen = await self.get_list_blobs_name(
+            container_name, prefix=remote_directory, return_list=False
+        )
+        async for blob_name in blob_gen:
+            await _download(blob_name)
+
+    async def _download_directory_incremental(
+        self,
+        container_name: str,
+        remote_directory: str,
+        local_directory: Optional[str],
+        delete_missing: bool,
+        download: Callable[[str], Awaitable],
+        concurrency: Optional[int],
+    ) -> Dict:
+        """
+        Download only blobs whose ETag changed since the last run, see download_directory
+
+        Args:
+            container_name: Name of the container
+            remote_directory: Name of the remote directory
+            local_directory: Name of the local directory where files will be downloaded
+            delete_missing: remove local files of blobs which no longer exist
+            download: coroutine function downloading a blob name
+            concurrency: if set, download up to concurrency blobs at the same time
+
+        Returns: a dict with lists of "downloaded" and "unchanged" blobs and "deleted" local files
+            (and "failed", a dict {blob_name: exception}, if concurrency is set)
+
+        """
+        manifest_file_name = self._get_download_manifest_file_name(
+            container_name, remote_directory, local_directory
+        )
+        manifest = self._read_download_manifest(manifest_file_name)
+        remote_blobs = await self._get_blobs_properties(
+            container_name, remote_directory, concurrency
+        )
+        summary = {"downloaded": [], "unchanged": [], "deleted": []}
+        to_download = []
+        for blob_name, blob in remote_blobs.items():
+            if self._is_blob_in_manifest(manifest, blob):
+                summary["unchanged"].append(blob_name)
+            else:
+                to_download.append(blob_name)
+
+        try:
+            if concurrency is not None:
+                results = await self._run_concurrently(
+                    download, to_download, concurrency
+                )
+                summary["failed"] = {n: e for n, e in results.items() if e is not None}
+                for blob_name in to_download:
+                    if results[blob_name] is None:
+                        self._add_to_download_manifest(
+                            manifest, remote_blobs[blob_name], local_directory
+                        )
+                        summary["downloaded"].append(blob_name)
+            else:
+                for blob_name in to_download:
+                    await download(blob_name)
+                    self._add_to_download_manifest(
+                        manifest, remote_blobs[blob_name], local_directory
+                    )
+                    summary["downloaded"].append(blob_name)
+
+            summary["deleted"] = self._remove_missing_from_download_manifest(
+                manifest, remote_blobs, delete_missing
+            )
+        finally:
+            self._write_download_manifest(manifest_file_name, manifest)
+        return summary
+
+    def _get_download_manifest_file_name(
+        self, container_name: str, remote_directory: str, local_directory: Optional[str]
+    ) -> str:
+        """
+        Get the path of the manifest of an incremental download_directory
+
+        Args:
+            container_name: Name of the container
+            remote_directory: Name of the remote directory
+            local_directory: Name of the local directory where files will be downloaded
+
+        Returns:
+
+        """
+        directory_name = local_directory or self.local_base_path
+        self.create_local_dir(directory_name)
+        key = hashlib.sha1(
+            "{}/{}".format(container_name, remote_directory).encode()
+        ).hexdigest()
+        return os.path.join(
+            directory_name, "{}{}.json".format(DOWNLOAD_MANIFEST_PREFIX, key)
+        )
+
+    @staticmethod
+    def _read_download_manifest(manifest_file_name: str) -> Dict[str, Dict]:
+        """
+        Read the manifest of an incremental download_directory
+
+        Args:
+            manifest_file_name: path of the manifest
+
+        Returns: a dict {blob_name: {"etag", "size", "local_file_name"}}
+
+        """
+        if not os.path.exists(manifest_file_name):
+            return {}
+        with open(manifest_file_name, "r") as f:
+            return json.load(f)
+
+    @staticmethod
+    def _write_download_manifest(manifest_file_name: str, manifest: Dict[str, Dict]):
+        """
+        Atomically write the manifest of an incremental download_directory
+
+        Args:
+            manifest_file_name: path of the manifest
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+
+        Returns:
+
+        """
+        tmp_file_name = "{}.{}.part".format(manifest_file_name, uuid.uuid4().hex)
+        with open(tmp_file_name, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_file_name, manifest_file_name)
+
+    @staticmethod
+    def _is_blob_in_manifest(manifest: Dict[str, Dict], blob) -> bool:
+        """
+        Check if a blob was already downloaded and did not change since
+
+        Args:
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+            blob: BlobProperties of the blob
+
+        Returns:
+
+        """
+        entry = manifest.get(blob.name)
+        return (
+            entry is not None
+            and entry["etag"] == blob.etag
+            and os.path.exists(entry["local_file_name"])
+        )
+
+    def _add_to_download_manifest(
+        self, manifest: Dict[str, Dict], blob, local_directory: Optional[str]
+    ):
+        """
+        Record a downloaded blob in the manifest
+
+        Args:
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+            blob: BlobProperties of the blob
+            local_directory: Name of the local directory where files are downloaded
+
+        Returns:
+
+        """
+        if local_directory is not None:
+            local_file_name = self._get_local_file_name(
+                blob.name, (local_directory + blob.name).replace("//", "/")
+            )
+        else:
+            local_file_name = self._get_local_file_name(blob.name)
+        manifest[blob.name] = {
+            "etag": blob.etag,
+            "size": blob.size,
+            "local_file_name": local_file_name,
+        }
+
+    @staticmethod
+    def _remove_missing_from_download_manifest(
+        manifest: Dict[str, Dict], remote_blobs: Dict, delete_missing: bool
+    ) -> List[str]:
+        """
+        Forget blobs of the manifest which no longer exist
+
+        Args:
+            manifest: a dict {blob_name: {"etag", "size", "local_file_name"}}
+            remote_blobs: a dict {blob_name: BlobProperties} of existing blobs
+            delete_missing: also remove the local files of these blobs
+
+        Returns: list of removed local files
+
+        """
+        deleted = []
+        for blob_name in [name for name in manifest if name not in remote_blobs]:
+            local_file_name = manifest.pop(blob_name)["local_file_name"]
+            if delete_missing and os.path.exists(local_file_name):
+                os.remove(local_file_name)
+                deleted.append(local_file_name)
+        return deleted
+
+    @instrumented("upload", ("remote_file_name", "local_file_name"))
+    async def upload_file(
+        self,
+        container_name: str,
+        local_file_name: str,
+        remote_file_name: Optional[str] = None,
+        overwrite: Optional[bool] = False,
+        block_size: Optional[int] = None,
+        max_concurrency: Optional[int] = 1,
+        content_encoding: Optional[str] = None,
+    ):
+        """
+        Upload a local file to a blob
+
+        Args:
+            container_name: Name of the container
+            local_file_name: Name of the local file
+            remote_file_name: Name of the blob where file will be uploaded
+            overwrite: set to True if needed
+            block_size: if set, the file is read through a memory map and staged as blocks of block_size bytes,
+                then the block list is committed. Staged blocks are journaled so that a retry of a failed
+                upload only sends the missing blocks.
+            max_concurrency: number of blocks staged at the same time when block_size is set
+            content_encoding: "gzip" or "zstd" to compress the file as it is read and staged as blocks of
+                block_size bytes (DEFAULT_BLOCK_SIZE if not set). The blocks of a compressed upload are not
+                journaled.
+
+        Returns:
+
+        """
+        container_client = await self._get_or_create_container_client(container_name)
+
+        if remote_file_name is None:
+            directory_name, file_name = self.get_directory_and_filename_from_full_path(
+                local_file_name
+            )
+            remote_file_name = (
+                directory_name.replace(self.local_base_path, "") + file_name
+            )
+
+        blob_client = container_client.get_blob_client(remote_file_name)
+        try:
+            if content_encoding is not None:
+                response, size = await self._upload_file_compressed(
+                    blob_client,
+                    local_file_name,
+                    overwrite,
+                    block_size or DEFAULT_BLOCK_SIZE,
+                    max_concurrency,
+                    content_encoding,
+                )
+            elif block_size is None:
+                with open(local_file_name, "rb") as data:
+                    size = os.fstat(data.fileno()).st_size
+                    response = await blob_client.upload_blob(data, overwrite=overwrite)
+            else:
+                response, size = await self._upload_file_in_blocks(
+                    blob_client,
+                    container_name,
+                    local_file_name,
+                    remote_file_name,
+                    overwrite,
+                    block_size,
+                    max_concurrency,
+                )
+        except ResourceExistsError as e:
+            logger.warning(
+                "File [%s] already exists. Use overwrite = True if needed",
+                remote_file_name,
+            )
+            raise e
+        await self._on_blob_written(container_name, remote_file_name, response, size)
+
+    async def _upload_file_compressed(
+        self,
+        blob_client,
+        local_file_name: str,
+        overwrite: bool,
+        block_size: int,
+        max_concurrency: int,
+        content_encoding: str,
+    ):
+        """
+        Upload a local file compressed as it is read, staged as blocks of compressed data
+
+        Args:
+            blob_client: async client of the blob where file will be uploaded
+            local_file_name: Name of the local file
+            overwrite: set to True if needed
+            block_size: size in bytes of each block
+            max_concurrency: number of blocks staged at the same time
+            content_encoding: "gzip" or "zstd"
+
+        Returns: response of the block list commit, size of the blob
+
+        """
+        committed = []
+
+        async def _on_commit(response: Dict, size: int):
+            committed.extend([response, size])
+
+        # Without overwrite, the commit fails with ResourceExistsError if the blob exists
+        async with AsyncBlobWriter(
+            blob_client,
+            overwrite,
+            block_size,
+            max_concurrency,
+            on_commit=_on_commit,
+            content_encoding=content_encoding,
+            slot=self._governed,
+        ) as writer:
+            with open(local_file_name, "rb") as data:
+                chunk = data.read(block_size)
+                while chunk:
+                    await writer.write(chunk)
+                    chunk = data.read(block_size)
+        return tuple(committed)
+
+    async def _upload_file_in_blocks(
+        self,
+        blob_client,
+        container_name: str,
+        local_file_name: str,
+        remote_file_name: str,
+        overwrite: bool,
+        block_size: int,
+        max_concurrency: int,
+    ):
+        """
+        Upload a local file as blocks staged concurrently from a memory map, then commit the block list
+
+        Args:
+            blob_client: client of the blob where file will be uploaded
+            container_name: Name of the container
+            local_file_name: Name of the local file
+            remote_file_name: Name of the blob where file will be uploaded
+            overwrite: set to True if needed
+            block_size: size in bytes of each block
+            max_concurrency: number of blocks staged at the same time
+
+        Returns: response of the block list commit, size of the blob
+
+        """
+        file_size = os.path.getsize(local_file_name)
+        if file_size == 0:
+            # An empty file can't be memory mapped and has no block
+            return await blob_client.upload_blob(b"", overwrite=overwrite), 0
+        block_count = math.ceil(file_size / block_size)
+        if block_count > MAX_BLOCK_COUNT:
+            raise ValueError(
+                "block_size {} is too small: a blob has at most {} blocks.".format(
+                    block_size, MAX_BLOCK_COUNT
+                )
+            )
+        if not overwrite and await blob_client.exists():
+            raise ResourceExistsError(
+                "Blob [{}] already exists.".format(remote_file_name)
+            )
+
+        journal_file_name, staged = self._open_upload_journal(
+            container_name, local_file_name, remote_file_name, block_size
+        )
+        if staged:
+            # Uncommitted blocks are discarded by the service after a week
+            try:
+                _, uncommitted = await blob_client.get_block_list("uncommitted")
+                staged &= {block.id for block in uncommitted}
+            except ResourceNotFoundError:
+                staged = set()
+
+        block_ids = [
+            base64.b64encode("{:08d}".format(i).encode()).decode()
+            for i in range(block_count)
+        ]
+        with open(local_file_name, "rb") as f, mmap.mmap(
+            f.fileno(), 0, access=mmap.ACCESS_READ
+        ) as data, open(journal_file_name, "a") as journal:
+            semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+            async def _stage_block(index: int):
+                block_id = block_ids[index]
+                if block_id in staged:
+                    return
+                offset = index * block_size
+                async with semaphore, self._governed():
+                    await blob_client.stage_block(
+                        block_id, data[offset : offset + block_size]
+                    )
+                journal.write(block_id + "\n")
+                journal.flush()
+
+            # Blocks still in flight must not outlive the memory map and the journal
+            await _gather_or_cancel(*(_stage_block(i) for i in range(len(block_ids))))
+        conditions = {} if overwrite else {"match_condition": MatchConditions.IfMissing}
+        response = await blob_client.commit_block_list(
+            [BlobBlock(block_id=block_id) for block_id in block_ids], **conditions
+        )
+        os.remove(journal_file_name)
+        return response, file_size
+
+    def _open_upload_journal(
+        self,
+        container_name: str,
+        local_file_name: str,
+        remote_file_name: str,
+        block_size: int,
+    ) -> Tuple[str, set]:
+        """
+        Get the journal of a block upload, stored in local_base_path
+
+        The journal is reset if the local file or block_size changed since it was written.
+
+        Args:
+            container_name: Name of the container
+            local_file_name: Name of the local file
+            remote_file_name: Name of the blob where file will be uploaded
+            block_size: size in bytes of each block
+
+        Returns: journal file name, set of block ids already staged
+
+        """
+        local_file_name = os.path.abspath(local_file_name)
+        journal_directory = os.path.join(self.local_base_path, UPLOAD_JOURNAL_DIRECTORY)
+        self.create_local_dir(journal_directory)
+        journal_file_name = os.path.join(
+            journal_directory,
+            hashlib.sha1(
+                "{}/{}|{}".format(
+                    container_name, remote_file_name, local_file_name
+                ).encode()
+            ).hexdigest(),
+        )
+        stat = os.stat(local_file_name)
+        header = json.dumps(
+            {
+                "container": container_name,
+                "blob": remote_file_name,
+                "file": local_file_name,
+                "size": stat.st_size,
+                "mtime": stat.st_mtime_ns,
+                "block_size": block_size,
+            }
+        )
+        if os.path.exists(journal_file_name):
+            with open(journal_file_name, "r") as journal:
+                lines = journal.read().splitlines()
+            if lines and lines[0] == header:
+                return journal_file_name, set(lines[1:])
+        with open(journal_file_name, "w") as journal:
+            journal.write(header + "\n")
+        return journal_file_name, set()
+
+    @classmethod
+    def _iter_file_paths_from_directory(cls, directory_name: str) -> Iterator[str]:
+        """
+        Generator over all file paths from local directory
+        Args:
+            directory_name: Name of the local directory
+
+        Returns:
+
+        """
+        # Walk the tree.
+        for root, directories, files in os.walk(directory_name):
+            # Upload journals & download manifests are not data to upload
+            directories[:] = [d for d in directories if d != UPLOAD_JOURNAL_DIRECTORY]
+            for file_name in files:
+                if file_name.startswith(DOWNLOAD_MANIFEST_PREFIX):
+                    continue
+                # Join the two strings in order to form the full filepath.
+                yield os.path.join(root, file_name)
+
+    @classmethod
+    def _get_file_paths_from_directory(cls, directory_name: str):
+        """
+        Get all file paths from local directory
+        Args:
+            directory_name: Name of the local directory
+
+        Returns:
+
+        """
+        return list(cls._iter_file_paths_from_directory(directory_name))
+
+    async def upload_directory(
+        self,
+        container_name: str,
+        local_directory_name: str,
+        remote_directory_name: Optional[str] = None,
+        overwrite: Optional[bool] = False,
+        concurrency: Optional[int] = None,
+        block_size: Optional[int] = None,
+        max_concurrency: Optional[int] = 1,
+        incremental: Optional[bool] = False,
+        delete_missing: Optional[bool] = False,
+        checksum: Optional[bool] = False,
+    ) -> Optional[Dict[str, Optional[Exception]]]:
+        """
+        Upload local folder to blobs
+
+        Args:
+            container_name: Name of the container
+            local_directory_name: Name of the local directory
+            remote_directory_name: Name of the remote directory where file will be uploaded
+            overwrite: set to True if needed
+            concurrency: if set, upload up to concurrency files at the same time while the directory is walked.
+                A failure does not cancel the other uploads.
+            block_size: if set, files are uploaded as blocks of block_size bytes (see upload_file)
+            max_concurrency: number of blocks of a file staged at the same time when block_size is set
+            incremental: if True, list the remote directory once and only upload files that are new or changed
+                (different size, or local file modified after the blob). Changed files are overwritten.
+            delete_missing: in incremental mode, also delete blobs of the remote directory with no local file
+            checksum: in incremental mode, compare MD5 of files having the same size instead of modification time
+                (when the blob has a Content-MD5)
+
+        Returns: in incremental mode, a dict with lists of "uploaded", "unchanged" and "deleted" files
+            (and "failed", a dict {local_file_path: exception}, if concurrency is set).
+            Otherwise None in sequential mode, or a dict {local_file_path: None if uploaded else the raised exception}
+
+        """
+
+        async def _upload(filepath: str):
+            if remote_directory_name is not None:
+                await self.upload_file(
+                    container_name,
+                    filepath,
+                    (remote_directory_name + filepath).replace("//", "/"),
+                    overwrite or incremental,
+                    block_size,
+                    max_concurrency,
+                )
+            else:
+                await self.upload_file(
+                    container_name,
+                    filepath,
+                    filepath,
+                    overwrite or incremental,
+                    block_size,
+                    max_concurrency,
+                )
+
+        if incremental:
+            return await self._upload_directory_incremental(
+                container_name,
+                local_directory_name,
+                remote_directory_name,
+                delete_missing,
+                checksum,
+                _upload,
+                concurrency,
+            )
+
+        if concurrency is not None:
+            return await self._run_concurrently(
+                _upload,
+                self._iter_file_paths_from_directory(local_directory_name),
+                concurrency,
+            )
+
+        for filepath in self._get_file_paths_from_directory(local_directory_name):
+            await _upload(filepath)
+
+    async def _upload_directory_incremental(
+        self,
+        container_name: str,
+        local_directory_name: str,
+        remote_directory_name: Optional[str],
+        delete_missing: bool,
+        checksum: bool,
+        upload: Callable[[str], Awaitable],
+        concurrency: Optional[int],
+    ) -> Dict:
+        """
+        Upload only new or changed files of a local folder, see upload_directory
+
+        Args:
+            container_name: Name of the container
+            local_directory_name: Name of the local directory
+            remote_directory_name: Name of the remote directory where file will be uploaded
+            delete_missing: delete blobs of the remote directory with no local file
+            checksum: compare MD5 of files having the same size instead of modification time
+            upload: coroutine function uploading a local file path
+            concurrency: if set, upload up to concurrency files at the same time
+
+        Returns: a dict with lists of "uploaded", "unchanged" and "deleted" files
+            (and "failed", a dict {local_file_path: exception}, if concurrency is set)
+
+        """
+        remote_blobs = await self._get_blobs_properties(
+            container_name,
+            self._get_remote_directory_prefix(
+                local_directory_name, remote_directory_name
+            ),
+        )
+        summary = {"uploaded": [], "unchanged": [], "deleted": []}
+        to_upload = []
+        for filepath in self._iter_file_paths_from_directory(local_directory_name):
+            if remote_directory_name is not None:
+                remote_file_name = (remote_directory_name + filepath).replace("//", "/")
+            else:
+                remote_file_name = filepath
+            blob = remote_blobs.pop(remote_file_name, None)
+            if blob is None or self._is_local_file_changed(filepath, blob, checksum):
+                to_upload.append(filepath)
+            else:
+                summary["unchanged"].append(filepath)
+
+        if concurrency is not None:
+            results = await self._run_concurrently(upload, to_upload, concurrency)
+            summary["uploaded"] = [f for f, e in results.items() if e is None]
+            summary["failed"] = {f: e for f, e in results.items() if e is not None}
+        else:
+            for filepath in to_upload:
+                await upload(filepath)
+                summary["uploaded"].append(filepath)
+
+        if delete_missing and remote_blobs:
+            await self.delete_blobs(container_name, list(remote_blobs))
+            summary["deleted"] = list(remote_blobs)
+        return summary
+
+    @staticmethod
+    def _get_remote_directory_prefix(
+        local_directory_name: str, remote_directory_name: Optional[str]
+    ) -> str:
+        """
+        Get the blob prefix under which upload_directory puts the files of local_directory_name
+
+        Args:
+            local_directory_name: Name of the local directory
+            remote_directory_name: Name of the remote directory where file will be uploaded
+
+        Returns:
+
+        """
+        if remote_directory_name is not None:
+            prefix = (remote_directory_name + local_directory_name).replace("//", "/")
+        else:
+            prefix = local_directory_name
+        # Do not match sibling directories sharing the same beginning
+        if not prefix.endswith("/"):
+            prefix += "/"
+        return prefix
+
+    async def _get_blobs_properties(
+        self,
+        container_name: str,
+        prefix: str,
+        concurrency: Optional[int] = None,
+    ) -> Dict:
+        """
+        List blobs with their properties (size, last_modified, content_md5...) in one listing
+
+        Args:
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+            concurrency: if set, list with list_blobs_parallel and concurrency requests in flight
+
+        Returns: a dict {blob_name: BlobProperties}, empty if the container does not exist
+
+        """
+        try:
+            container_client = await self.get_container_client(container_name)
+        except ResourceNotFoundError:
+            return {}
+        if self.index is not None:
+            listing = self._iter_items(
+                await self._get_indexed_blobs(container_name, prefix, True, concurrency)
+            )
+        elif concurrency is not None:
+            listing = self.list_blobs_parallel(
+                container_name, prefix, concurrency=concurrency, include_properties=True
+            )
+        else:
+            listing = container_client.list_blobs(name_starts_with=prefix)
+        blobs = {}
+        async for blob in listing:
+            blobs[blob.name] = blob
+        return blobs
+
+    @staticmethod
+    def _is_local_file_changed(file_path: str, blob, checksum: bool) -> bool:
+        """
+        Compare a local file with the properties of a blob
+
+        Args:
+            file_path: path of the local file
+            blob: BlobProperties of the blob
+            checksum: compare MD5 instead of modification time when sizes are equal
+
+        Returns: True if the local file differs from the blob
+
+        """
+        if os.path.getsize(file_path) != blob.size:
+            return True
+        content_md5 = blob.content_settings.content_md5
+        if checksum and content_md5:
+            md5 = hashlib.md5()
+            with open(file_path, "rb") as f:
+                for chunk in iter(lambda: f.read(DEFAULT_CHUNK_SIZE), b""):
+                    md5.update(chunk)
+            return md5.digest() != bytes(content_md5)
+        return os.path.getmtime(file_path) > blob.last_modified.timestamp()
+
+    @instrumented("upload")
+    async def upload_bytes(
+        self,
+        my_bytes: bytes,
+        container_name: str,
+        remote_file_name: str,
+        overwrite: Optional[bool] = False,
+        content_encoding: Optional[str] = None,
+    ):
+        """
+        Uploaded in memory byte object to blob
+
+        Args:
+            my_bytes: in memory object
+            container_name: Name of the container
+            remote_file_name: Name of the blob where object will be uploaded
+            overwrite: set to True if needed
+            content_encoding: "gzip" or "zstd" to store the object compressed, with this Content-Encoding
+
+        Returns:
+
+        """
+        container_client = await self._get_or_create_container_client(container_name)
+
+        content_settings = get_content_settings(content_encoding)
+        if content_encoding is not None:
+            # Compressing a large object would block the event loop
+            my_bytes = await asyncio.get_running_loop().run_in_executor(
+                None, compress_bytes, my_bytes, content_encoding
+            )
+        blob_client = container_client.get_blob_client(remote_file_name)
+        response = await blob_client.upload_blob(
+            my_bytes, overwrite=overwrite, content_settings=content_settings
+        )
+        await self._on_blob_written(
+            container_name, remote_file_name, response, len(my_bytes)
+        )
+
+    @instrumented("delete", None)
+    async def delete_blobs(
+        self,
+        container_name: str,
+        remote_file_names: List[str],
+        max_concurrency: Optional[int] = 1,
+    ) -> int:
         """
         Delete list of blobs from container_name
 
+        Blobs are deleted in batches of DELETE_BATCH_SIZE, the maximum accepted by the service.
+
         Args:
             container_name: Name of the container
             remote_file_names: list of blob names
+            max_concurrency: number of batches sent at the same time
 
-        Returns:
+        Returns: number of deleted blobs
+
+        """
+        return await self._delete_blobs_in_batches(
+            container_name, remote_file_names, max_concurrency
+        )
+
+    @instrumented("delete", None)
+    async def delete_prefix(
+        self, container_name: str, prefix: str, max_concurrency: Optional[int] = 1
+    ) -> int:
+        """
+        Delete all blobs whose name starts with prefix
+
+        The listing is streamed into batches, so blob names are never all held in memory.
+        With max_concurrency > 1, the listing itself is parallelized like list_blobs_parallel.
+        Blobs are always listed from the service, even with an index which could miss blobs written by other
+        clients, and the deleted blobs are removed from the index.
+
+        Args:
+            container_name: Name of the container
+            prefix: prefix of the blobs to delete
+            max_concurrency: number of batches (and listing requests) sent at the same time
+
+        Returns: number of deleted blobs
+
+        """
+        if max_concurrency > 1:
+            names = self._list_blobs_parallel(container_name, prefix, max_concurrency)
+        else:
+            container_client = await self.get_container_client(container_name)
+            names = self._iter_blobs(container_client, prefix)
+        return await self._delete_blobs_in_batches(
+            container_name, names, max_concurrency
+        )
+
+    async def _delete_blobs_in_batches(
+        self,
+        container_name: str,
+        remote_file_names: Union[Iterable[str], AsyncIterable[str]],
+        max_concurrency: int,
+    ) -> int:
+        """
+        Delete blobs in batches of DELETE_BATCH_SIZE, max_concurrency batches at a time
+
+        Args:
+            container_name: Name of the container
+            remote_file_names: blob names, consumed lazily
+            max_concurrency: number of batches sent at the same time
+
+        Returns: number of deleted blobs
 
         """
         container_client = await self.get_container_client(container_name)
-        await container_client.delete_blobs(*remote_file_names)
+        semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+        tasks = set()
+        errors = []
+        count = 0
+
+        async def _delete(batch: List[str]):
+            nonlocal count
+            try:
+                async with self._governed():
+                    await container_client.delete_blobs(*batch)
+                count += len(batch)
+                if self.cache is not None:
+                    for remote_file_name in batch:
+                        self.cache.invalidate(container_name, remote_file_name)
+                if self.index is not None:
+                    self.index.remove(container_name, batch)
+            except Exception as e:
+                errors.append(e)
+            finally:
+                semaphore.release()
+
+        async for batch in self._iter_batches(remote_file_names):
+            await semaphore.acquire()
+            task = asyncio.ensure_future(_delete(batch))
+            tasks.add(task)
+            task.add_done_callback(tasks.discard)
+        await asyncio.gather(*tasks)
+        if errors:
+            raise errors[0]
+        return count
+
+    @staticmethod
+    async def _iter_batches(
+        names: Union[Iterable[str], AsyncIterable[str]],
+    ) -> AsyncIterable[List[str]]:
+        """
+        Group names in batches accepted by the blob batch API
+
+        Args:
+            names: iterable or async iterable of blob names
+
+        Returns:
+
+        """
+        batch = []
+        if hasattr(names, "__aiter__"):
+            async for name in names:
+                batch.append(name)
+                if len(batch) == DELETE_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        else:
+            for name in names:
+                batch.append(name)
+                if len(batch) == DELETE_BATCH_SIZE:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
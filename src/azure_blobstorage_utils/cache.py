@@ -0,0 +1,324 @@
+import hashlib
+import os
+import threading
+import time
+import uuid
+from collections import OrderedDict, namedtuple
+from typing import Iterable, Optional
+
+CacheEntry = namedtuple("CacheEntry", ["data", "etag", "fetched_at"])
+
+
+class BlobCache:
+    def __init__(
+        self,
+        max_memory_size: Optional[int] = 256 * 1024 * 1024,
+        directory: Optional[str] = None,
+        max_disk_size: Optional[int] = 4 * 1024 * 1024 * 1024,
+        ttl: Optional[float] = None,
+    ):
+        """
+        Read-through cache of blob contents, shared by the sync & async classes
+
+        Entries are kept in memory and optionally on disk, both evicted in LRU order when their size limit
+        is reached. A cached blob is revalidated with a conditional request on its ETag, so an unchanged blob
+        costs a 304 instead of a full transfer. With ttl, entries are trusted without any request for ttl seconds.
+
+        On disk, each blob is one file starting with its ETag, written to a temporary file then renamed, so an
+        interrupted write never leaves a partial entry. Temporary files left by a crash are removed when the
+        cache is opened.
+
+        Args:
+            max_memory_size: maximum size in bytes of the blobs kept in memory (0 disables the memory tier)
+            directory: local folder where blobs are cached on disk. If None, the cache is in memory only
+            max_disk_size: maximum size in bytes of the blobs kept in directory
+            ttl: seconds during which a cached blob is returned without revalidation. If None, always revalidate
+        """
+        self.max_memory_size = max_memory_size
+        self.directory = directory
+        self.max_disk_size = max_disk_size
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._memory = OrderedDict()
+        self._memory_size = 0
+        self._disk = OrderedDict()
+        self._disk_size = 0
+        if self.directory is not None:
+            os.makedirs(self.directory, exist_ok=True)
+            self._load_disk_index()
+
+    @staticmethod
+    def _get_key(container_name: str, blob_name: str) -> str:
+        """
+        Get the cache key of a blob
+
+        The key starts with the container name, which only holds characters valid in a file name, so that
+        the entries of a container can be found without reading their metadata.
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob
+
+        Returns:
+
+        """
+        return "{}.{}".format(
+            container_name,
+            hashlib.sha1(
+                "{}/{}".format(container_name, blob_name).encode()
+            ).hexdigest(),
+        )
+
+    def _get_file_name(self, key: str) -> str:
+        """
+        Get the path of the disk entry of a key
+
+        Args:
+            key: cache key
+
+        Returns:
+
+        """
+        return os.path.join(self.directory, key + ".blob")
+
+    def _load_disk_index(self):
+        """
+        Index blobs already cached in directory, least recently used first, and remove partial files
+
+        Returns:
+
+        """
+        entries = []
+        for file_name in os.listdir(self.directory):
+            file_path = os.path.join(self.directory, file_name)
+            try:
+                if file_name.endswith(".part"):
+                    # Left by a write interrupted before its rename
+                    os.remove(file_path)
+                elif file_name.endswith(".blob"):
+                    stat = os.stat(file_path)
+                    entries.append(
+                        (stat.st_atime, file_name[: -len(".blob")], stat.st_size)
+                    )
+            except FileNotFoundError:
+                continue
+        for _, key, size in sorted(entries):
+            self._disk[key] = size
+            self._disk_size += size
+
+    def is_fresh(self, entry: CacheEntry) -> bool:
+        """
+        Check if an entry can be returned without revalidation
+
+        Args:
+            entry: a cached entry
+
+        Returns:
+
+        """
+        return self.ttl is not None and time.time() - entry.fetched_at < self.ttl
+
+    def get(self, container_name: str, blob_name: str) -> Optional[CacheEntry]:
+        """
+        Get a cached blob
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob
+
+        Returns: the cached entry, None if the blob is not cached
+
+        """
+        key = self._get_key(container_name, blob_name)
+        with self._lock:
+            if key in self._memory:
+                self._memory.move_to_end(key)
+                return self._memory[key]
+            if key not in self._disk:
+                return None
+            self._disk.move_to_end(key)
+        file_name = self._get_file_name(key)
+        try:
+            with open(file_name, "rb") as f:
+                etag = f.readline()[:-1].decode()
+                data = f.read()
+                fetched_at = os.fstat(f.fileno()).st_mtime
+            # The access time orders entries for eviction, the modification time is when the blob was fetched
+            os.utime(file_name, (time.time(), fetched_at))
+        except FileNotFoundError:
+            self.invalidate(container_name, blob_name)
+            return None
+        entry = CacheEntry(data, etag, fetched_at)
+        with self._lock:
+            self._put_in_memory(key, entry)
+        return entry
+
+    def put(self, container_name: str, blob_name: str, data: bytes, etag: str):
+        """
+        Cache a blob
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob
+            data: content of the blob
+            etag: ETag of the blob
+
+        Returns:
+
+        """
+        key = self._get_key(container_name, blob_name)
+        entry = CacheEntry(bytes(data), etag, time.time())
+        with self._lock:
+            self._put_in_memory(key, entry)
+        if self.directory is not None:
+            self._put_on_disk(key, entry)
+
+    def touch(self, container_name: str, blob_name: str):
+        """
+        Mark a cached blob as just revalidated
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob
+
+        Returns:
+
+        """
+        key = self._get_key(container_name, blob_name)
+        fetched_at = time.time()
+        with self._lock:
+            entry = self._memory.get(key)
+            if entry is not None:
+                self._memory[key] = entry._replace(fetched_at=fetched_at)
+            on_disk = key in self._disk
+        if on_disk:
+            try:
+                os.utime(self._get_file_name(key), (fetched_at, fetched_at))
+            except FileNotFoundError:
+                pass
+
+    def invalidate(self, container_name: str, blob_name: Optional[str] = None):
+        """
+        Remove a blob or the blobs of a container from the cache
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob. If None, every blob of container_name is removed
+
+        Returns:
+
+        """
+        with self._lock:
+            if blob_name is not None:
+                keys = [self._get_key(container_name, blob_name)]
+            else:
+                keys = [
+                    key
+                    for key in set(self._memory) | set(self._disk)
+                    if key.startswith("{}.".format(container_name))
+                ]
+            self._remove(keys)
+
+    def clear(self):
+        """
+        Remove every blob from the cache
+
+        Returns:
+
+        """
+        with self._lock:
+            self._remove(set(self._memory) | set(self._disk))
+
+    def _remove(self, keys: Iterable[str]):
+        """
+        Remove entries from both tiers. Must hold the lock
+
+        Args:
+            keys: cache keys
+
+        Returns:
+
+        """
+        for key in keys:
+            entry = self._memory.pop(key, None)
+            if entry is not None:
+                self._memory_size -= len(entry.data)
+            size = self._disk.pop(key, None)
+            if size is not None:
+                self._disk_size -= size
+                self._remove_from_disk(key)
+
+    def _put_in_memory(self, key: str, entry: CacheEntry):
+        """
+        Add an entry to the memory tier, evicting least recently used entries. Must hold the lock
+
+        Args:
+            key: cache key
+            entry: entry to add
+
+        Returns:
+
+        """
+        previous = self._memory.pop(key, None)
+        if previous is not None:
+            self._memory_size -= len(previous.data)
+        if len(entry.data) > self.max_memory_size:
+            return
+        self._memory[key] = entry
+        self._memory_size += len(entry.data)
+        while self._memory_size > self.max_memory_size:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted.data)
+
+    def _put_on_disk(self, key: str, entry: CacheEntry):
+        """
+        Add an entry to the disk tier, evicting least recently used entries
+
+        Args:
+            key: cache key
+            entry: entry to add
+
+        Returns:
+
+        """
+        header = entry.etag.encode() + b"\n"
+        size = len(header) + len(entry.data)
+        if size > self.max_disk_size:
+            return
+        file_name = self._get_file_name(key)
+        tmp_file_name = "{}.{}.part".format(file_name, uuid.uuid4().hex)
+        try:
+            with open(tmp_file_name, "wb") as f:
+                f.write(header)
+                f.write(entry.data)
+            os.utime(tmp_file_name, (entry.fetched_at, entry.fetched_at))
+            os.replace(tmp_file_name, file_name)
+        except FileNotFoundError:
+            # Removed as a partial file by another cache opening directory
+            return
+
+        with self._lock:
+            previous = self._disk.pop(key, None)
+            if previous is not None:
+                self._disk_size -= previous
+            self._disk[key] = size
+            self._disk_size += size
+            while self._disk_size > self.max_disk_size:
+                evicted_key, size = self._disk.popitem(last=False)
+                self._disk_size -= size
+                self._remove_from_disk(evicted_key)
+
+    def _remove_from_disk(self, key: str):
+        """
+        Delete the files of an entry of the disk tier
+
+        Args:
+            key: cache key
+
+        Returns:
+
+        """
+        try:
+            os.remove(self._get_file_name(key))
+        except FileNotFoundError:
+            pass
@@ -0,0 +1,203 @@
+import zlib
+from typing import AsyncIterable, AsyncIterator, Iterable, Iterator, Optional
+
+from azure.storage.blob import ContentSettings
+
+CONTENT_ENCODINGS = ("gzip", "zstd")
+GZIP_LEVEL = 6
+ZSTD_LEVEL = 3
+# zlib window bits of the gzip container
+_GZIP_WBITS = 16 + zlib.MAX_WBITS
+
+
+def _import_zstandard():
+    try:
+        import zstandard
+    except ImportError as e:
+        raise ImportError(
+            "The zstd content encoding requires zstandard: pip install zstandard"
+        ) from e
+    return zstandard
+
+
+def _check_content_encoding(content_encoding: str):
+    if content_encoding not in CONTENT_ENCODINGS:
+        raise ValueError(
+            "Content encoding [{}] not supported - only {}.".format(
+                content_encoding, list(CONTENT_ENCODINGS)
+            )
+        )
+
+
+def get_compressor(content_encoding: str):
+    """
+    Get a streaming compressor, with compress(data) & flush() methods
+
+    Args:
+        content_encoding: "gzip" or "zstd"
+
+    Returns:
+
+    """
+    _check_content_encoding(content_encoding)
+    if content_encoding == "gzip":
+        return zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, _GZIP_WBITS)
+    return _import_zstandard().ZstdCompressor(level=ZSTD_LEVEL).compressobj()
+
+
+class Decompressor:
+    def __init__(self, content_encoding: str):
+        """
+        Streaming decompressor of a content encoding
+
+        Concatenated gzip members or zstd frames are decompressed one after the other, as the standard tools do.
+
+        Args:
+            content_encoding: "gzip" or "zstd"
+        """
+        _check_content_encoding(content_encoding)
+        self._content_encoding = content_encoding
+        self._decompressor = self._new_decompressor()
+        self._started = False
+
+    def _new_decompressor(self):
+        if self._content_encoding == "gzip":
+            return zlib.decompressobj(_GZIP_WBITS)
+        return _import_zstandard().ZstdDecompressor().decompressobj()
+
+    def decompress(self, data: bytes) -> bytes:
+        """
+        Decompress the next chunk of compressed data
+
+        Args:
+            data: bytes-like object
+
+        Returns: the decompressed data available so far
+
+        """
+        output = []
+        while data:
+            self._started = True
+            output.append(self._decompressor.decompress(data))
+            data = self._decompressor.unused_data if self._decompressor.eof else b""
+            if data:
+                self._decompressor = self._new_decompressor()
+        return b"".join(output)
+
+    def flush(self):
+        """
+        Check that the compressed data is complete
+
+        Returns:
+
+        """
+        if self._started and not self._decompressor.eof:
+            raise ValueError(
+                "Compressed data ended before the end of the {} stream.".format(
+                    self._content_encoding
+                )
+            )
+
+
+def get_content_encoding(properties) -> Optional[str]:
+    """
+    Get the content encoding of a blob if it is one that is decompressed on download
+
+    Args:
+        properties: BlobProperties of the blob, or of a downloaded range
+
+    Returns: "gzip", "zstd" or None if the blob is read as stored
+
+    """
+    content_encoding = (properties.content_settings.content_encoding or "").lower()
+    return content_encoding if content_encoding in CONTENT_ENCODINGS else None
+
+
+def get_content_settings(content_encoding: Optional[str]) -> Optional[ContentSettings]:
+    """
+    Get the content settings of a blob uploaded with a content encoding
+
+    Args:
+        content_encoding: "gzip", "zstd" or None to upload data as is
+
+    Returns:
+
+    """
+    if content_encoding is None:
+        return None
+    _check_content_encoding(content_encoding)
+    return ContentSettings(content_encoding=content_encoding)
+
+
+def compress_bytes(data: bytes, content_encoding: str) -> bytes:
+    """
+    Compress in memory data
+
+    Args:
+        data: bytes-like object
+        content_encoding: "gzip" or "zstd"
+
+    Returns:
+
+    """
+    compressor = get_compressor(content_encoding)
+    return compressor.compress(data) + compressor.flush()
+
+
+def decompress_bytes(data: bytes, content_encoding: str) -> bytes:
+    """
+    Decompress in memory data
+
+    Args:
+        data: bytes-like object
+        content_encoding: "gzip" or "zstd"
+
+    Returns:
+
+    """
+    decompressor = Decompressor(content_encoding)
+    data = decompressor.decompress(data)
+    decompressor.flush()
+    return data
+
+
+def decompress_chunks(
+    chunks: Iterable[bytes], content_encoding: str
+) -> Iterator[bytes]:
+    """
+    Generator decompressing a stream of chunks as they come
+
+    Args:
+        chunks: chunks of compressed data
+        content_encoding: "gzip" or "zstd"
+
+    Returns:
+
+    """
+    decompressor = Decompressor(content_encoding)
+    for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    decompressor.flush()
+
+
+async def decompress_chunks_async(
+    chunks: AsyncIterable[bytes], content_encoding: str
+) -> AsyncIterator[bytes]:
+    """
+    Async generator decompressing a stream of chunks as they come
+
+    Args:
+        chunks: chunks of compressed data
+        content_encoding: "gzip" or "zstd"
+
+    Returns:
+
+    """
+    decompressor = Decompressor(content_encoding)
+    async for chunk in chunks:
+        data = decompressor.decompress(chunk)
+        if data:
+            yield data
+    decompressor.flush()
@@ -0,0 +1,91 @@
+import io
+from typing import Dict, Iterator, Optional
+
+import pandas as pd
+
+PANDAS_WRITE_EXTENSIONS = (".csv", ".txt", ".parquet", ".json", ".xls", ".xlsx")
+
+
+def read_pandas_df(
+    data: bytes, remote_file_name: str, **kwargs: Optional[Dict]
+) -> pd.DataFrame:
+    """
+    Load the content of a blob as a pandas DataFrame, depending on the extension of remote_file_name
+
+    Args:
+        data: content of the blob
+        remote_file_name: Name of the blob
+        **kwargs: add any kwarg that you would put in pd.read_* methods.
+
+    Returns: a pandas DataFrame
+
+    """
+    if remote_file_name.endswith(".csv") | remote_file_name.endswith(".txt"):
+        return pd.read_csv(io.BytesIO(data), **kwargs)
+    elif remote_file_name.endswith(".parquet"):
+        return pd.read_parquet(io.BytesIO(data), **kwargs)
+    elif remote_file_name.endswith(".json"):
+        return pd.read_json(io.BytesIO(data), **kwargs)
+    elif remote_file_name.endswith(".xls") | remote_file_name.endswith(".xlsx"):
+        return pd.read_excel(io.BytesIO(data), **kwargs)
+    else:
+        raise ValueError(
+            "Extension not recognized - only ['csv','txt','parquet','json','xls','xlsx'] are supported."
+        )
+
+
+def write_pandas_df(
+    df: pd.DataFrame, f, remote_file_name: str, **kwargs: Optional[Dict]
+):
+    """
+    Serialize a pandas DataFrame into a binary file-like object, in the format given by the extension
+
+    Args:
+        df: a pandas DataFrame
+        f: writable binary file-like object
+        remote_file_name: Name of the blob, its extension gives the format
+        **kwargs: add any kwarg that you would put in pd.to_* methods.
+
+    Returns:
+
+    """
+    if remote_file_name.endswith((".csv", ".txt")):
+        df.to_csv(f, **kwargs)
+    elif remote_file_name.endswith(".parquet"):
+        df.to_parquet(f, **kwargs)
+    elif remote_file_name.endswith(".json"):
+        df.to_json(f, **kwargs)
+    elif remote_file_name.endswith((".xls", ".xlsx")):
+        df.to_excel(f, **kwargs)
+
+
+def get_pandas_df_iterator(
+    stream: io.BufferedReader,
+    remote_file_name: str,
+    chunksize: int,
+    **kwargs: Optional[Dict]
+) -> Iterator[pd.DataFrame]:
+    """
+    Get a pandas chunked reader on a stream, depending on the extension of remote_file_name
+
+    Args:
+        stream: file-like object over the content of the blob
+        remote_file_name: Name of the blob
+        chunksize: number of rows per DataFrame
+        **kwargs: add any kwarg that you would put in pd.read_csv / pd.read_json methods.
+
+    Returns:
+
+    """
+    if remote_file_name.endswith(".csv") | remote_file_name.endswith(".txt"):
+        return pd.read_csv(stream, chunksize=chunksize, **kwargs)
+    elif (
+        remote_file_name.endswith(".json")
+        | remote_file_name.endswith(".jsonl")
+        | remote_file_name.endswith(".ndjson")
+    ):
+        return pd.read_json(stream, lines=True, chunksize=chunksize, **kwargs)
+    else:
+        raise ValueError(
+            "Extension not recognized - only ['csv','txt','json','jsonl','ndjson'] are supported."
+        )
@@ -0,0 +1,89 @@
+import itertools
+import random
+import sys
+from typing import Any, Iterable, Iterator, List, Optional
+
+import numpy as np
+import pandas as pd
+
+
+def check_shard(num_shards: int, shard_index: int):
+    """
+    Check that shard_index is a valid shard among num_shards
+
+    Args:
+        num_shards: number of workers sharing the dataset
+        shard_index: index of the current worker
+
+    Returns:
+
+    """
+    if num_shards < 1 or not 0 <= shard_index < num_shards:
+        raise ValueError(
+            "Invalid shard {} of {} shards.".format(shard_index, num_shards)
+        )
+
+
+def shuffle_names(names: Iterable[str], seed: Optional[int] = None) -> List[str]:
+    """
+    Shuffle blob names in a reproducible order
+
+    Names are sorted first, so that every worker given the same seed gets the same order.
+
+    Args:
+        names: blob names
+        seed: seed of the shuffle, None for a random order
+
+    Returns:
+
+    """
+    names = sorted(names)
+    random.Random(seed).shuffle(names)
+    return names
+
+
+def select_dataset_names(
+    names: Iterable[str],
+    shuffle: bool = False,
+    seed: Optional[int] = None,
+    num_shards: int = 1,
+    shard_index: int = 0,
+) -> Iterator[str]:
+    """
+    Shuffle blob names then keep the shard of the current worker
+
+    Without shuffle, names are consumed lazily.
+
+    Args:
+        names: blob names
+        shuffle: if True, names are shuffled with seed
+        seed: seed of the shuffle, must be the same on every worker
+        num_shards: number of workers sharing the dataset
+        shard_index: index of the current worker
+
+    Returns:
+
+    """
+    check_shard(num_shards, shard_index)
+    if shuffle:
+        names = shuffle_names(names, seed)
+    return itertools.islice(names, shard_index, None, num_shards)
+
+
+def get_item_size(item: Any) -> int:
+    """
+    Estimate the memory held by a decoded item
+
+    Args:
+        item: a decoded blob (eg. bytes, numpy array, pandas DataFrame)
+
+    Returns: size in bytes
+
+    """
+    if isinstance(item, np.ndarray):
+        return item.nbytes
+    if isinstance(item, (pd.DataFrame, pd.Series)):
+        return int(np.sum(item.memory_usage(deep=True)))
+    if isinstance(item, (bytes, bytearray, memoryview)):
+        return len(item)
+    return sys.getsizeof(item)
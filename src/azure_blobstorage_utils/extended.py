@@ -1,35 +1,101 @@
 import io
-import os
-import sys
-from typing import Dict, Optional
+import logging
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple, Union
 
-from .base import BlobStorageBase
+from azure.core import MatchConditions
+from azure.core.pipeline.transport import HttpTransport
+
+from .base import DEFAULT_CHUNK_SIZE, BlobStorageBase
+from .cache import BlobCache
+from .compression import get_content_encoding
+from .governor import ConcurrencyGovernor
+from .index import BlobIndex
+from .metrics import BlobObserver, bind_context, instrumented
+from .streams import ChunkIteratorReader, SparseBlobFile
 
 try:
     import numpy as np
     import pandas as pd
+    import pyarrow.parquet as pq
     from simplejpeg import decode_jpeg, encode_jpeg
-except ModuleNotFoundError as moduleErr:
-    print("[Error]: Failed to import (Module Not Found) {}.".format(moduleErr.args[0]))
-    print("Please install with extras")
-    sys.exit(1)
-except ImportError as impErr:
-    print("[Error]: Failed to import (Import Error) {}.".format(impErr.args[0]))
-    print("Please install with extras")
-    sys.exit(1)
+
+    from .dataframes import (
+        PANDAS_WRITE_EXTENSIONS,
+        get_pandas_df_iterator,
+        read_pandas_df,
+        write_pandas_df,
+    )
+    from .datasets import get_item_size, select_dataset_names
+    from .images import JpegBatchDecoder
+    from .parquet import (
+        PARQUET_FOOTER_READ_SIZE,
+        get_columns_to_read,
+        is_parquet_projection,
+        plan_parquet_read,
+        read_parquet_bytes,
+        read_parquet_row_groups,
+    )
+except ImportError as e:
+    raise ImportError(
+        "Failed to import {}. Please install with extras: "
+        "pip install azure_blobstorage_utils[extended]".format(e.name or e.args[0])
+    ) from e
+
+
+logger = logging.getLogger(__name__)
 
 
 class BlobStorageExtended(BlobStorageBase):
     def __init__(
-        self, connection_string: str, local_base_path: Optional[str] = "azure_tmp/"
+        self,
+        connection_string: str,
+        local_base_path: Optional[str] = "azure_tmp/",
+        container_cache_ttl: Optional[float] = 60.0,
+        cache: Optional[BlobCache] = None,
+        index: Optional[BlobIndex] = None,
+        connection_pool_size: Optional[int] = None,
+        keep_alive: Optional[bool] = True,
+        transport: Optional[HttpTransport] = None,
+        governor: Optional[ConcurrencyGovernor] = None,
+        observers: Optional[List[BlobObserver]] = None,
     ):
         """
 
         Args:
             connection_string: Connection string to Azure Blob Storage
             local_base_path: local folder where data will be downloaded if path is not specified
+            container_cache_ttl: seconds during which a container is known to exist without checking again.
+                None caches forever, 0 disables the cache.
+            cache: if set, get_file_as_* methods read blobs through this cache
+            index: if set, listings (get_list_blobs_name, list_blobs_parallel & directory operations) are
+                answered from this local index, listing from the service only the prefixes not indexed yet
+            connection_pool_size: maximum number of connections kept open per host, to set above max_concurrency
+                or max_workers for concurrent transfers. None for the default of requests (10)
+            keep_alive: if False, connections are closed after each request
+            transport: HTTP transport of the client, overrides connection_pool_size & keep_alive. To share
+                connections between several instances, give them the same transport built on a session that
+                you own and close (eg. RequestsTransport(session=session, session_owner=False))
+            governor: if set, bulk operations (directory transfers, blocks of upload_file, batch deletes, image
+                batches & datasets) adapt their concurrency to the throttling responses of the service,
+                max_workers / max_concurrency becoming upper bounds
+            observers: observers receiving the measures (bytes, latency, retries, HTTP status) of each
+                download, upload & delete operation (eg. MetricsCollector, PrometheusObserver)
         """
-        super().__init__(connection_string, local_base_path)
+        super().__init__(
+            connection_string,
+            local_base_path,
+            container_cache_ttl,
+            cache,
+            index,
+            connection_pool_size,
+            keep_alive,
+            transport,
+            governor,
+            observers,
+        )
 
     def get_file_as_pandas_df(
         self, container_name: str, remote_file_name: str, **kwargs: Optional[Dict]
@@ -45,19 +111,123 @@ class BlobStorageExtended(BlobStorageBase):
         Returns: a pandas DataFrame
 
         """
+        if remote_file_name.endswith(".parquet") and is_parquet_projection(kwargs):
+            return self.get_parquet_as_pandas_df(
+                container_name, remote_file_name, **kwargs
+            )
         stream = self.get_file_as_bytes(container_name, remote_file_name)
-        if remote_file_name.endswith(".csv") | remote_file_name.endswith(".txt"):
-            return pd.read_csv(io.BytesIO(stream), **kwargs)
-        elif remote_file_name.endswith(".parquet"):
-            return pd.read_parquet(io.BytesIO(stream), **kwargs)
-        elif remote_file_name.endswith(".json"):
-            return pd.read_json(io.BytesIO(stream), **kwargs)
-        elif remote_file_name.endswith(".xls") | remote_file_name.endswith(".xlsx"):
-            return pd.read_excel(io.BytesIO(stream), **kwargs)
-        else:
+        return read_pandas_df(stream, remote_file_name, **kwargs)
+
+    def get_parquet_as_pandas_df(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        columns: Optional[List[str]] = None,
+        filters: Optional[List[Tuple[str, str, Any]]] = None,
+        max_concurrency: Optional[int] = 8,
+        **kwargs: Optional[Dict]
+    ) -> pd.DataFrame:
+        """
+        Get a parquet blob as a pandas DataFrame, fetching only the needed byte ranges
+
+        The footer is read first, then row groups are selected with their statistics and filters,
+        and only the column chunks of the selected columns & row groups are fetched, in parallel.
+        Ranges of a blob stored with a gzip or zstd Content-Encoding can't be decoded on their own: it is
+        downloaded whole, then filtered. With a cache, a cached copy of the blob (still matching the ETag of
+        the blob) is read instead of fetching ranges, but fetched ranges are not cached: the cache only holds
+        whole blobs.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            columns: columns to return, None for all columns
+            filters: list of (column, operator, value) predicates, all of which rows must match.
+                Operators are those of pd.read_parquet: "==", "!=", "<", "<=", ">", ">=", "in" & "not in"
+            max_concurrency: number of ranges fetched at the same time
+            **kwargs: add any kwarg that you would put in pyarrow.Table.to_pandas.
+
+        Returns: a pandas DataFrame
+
+        """
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(container_name, remote_file_name)
+            if entry is not None and self.cache.is_fresh(entry):
+                return read_parquet_bytes(entry.data, columns, filters, **kwargs)
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        properties = blob_client.get_blob_properties()
+        if properties.size == 0:
             raise ValueError(
-                "Extension not recognized - only ['csv','txt','parquet','json','xls','xlsx'] are supported."
+                "Blob [{}] is empty, it is not a parquet file.".format(remote_file_name)
+            )
+        if entry is not None and entry.etag == properties.etag:
+            self.cache.touch(container_name, remote_file_name)
+            return read_parquet_bytes(entry.data, columns, filters, **kwargs)
+        if get_content_encoding(properties) is not None:
+            return read_parquet_bytes(
+                self.get_file_as_bytes(container_name, remote_file_name),
+                columns,
+                filters,
+                **kwargs
             )
+        conditions = {
+            "etag": properties.etag,
+            "match_condition": MatchConditions.IfNotModified,
+        }
+
+        def _fetch(offset: int, length: int) -> bytes:
+            return blob_client.download_blob(
+                offset=offset, length=length, **conditions
+            ).readall()
+
+        parquet_file = SparseBlobFile(properties.size, _fetch)
+        tail_offset = max(properties.size - PARQUET_FOOTER_READ_SIZE, 0)
+        parquet_file.add(
+            tail_offset, _fetch(tail_offset, properties.size - tail_offset)
+        )
+        metadata = pq.read_metadata(parquet_file)
+        row_groups, ranges = plan_parquet_read(
+            metadata, get_columns_to_read(columns, filters), filters
+        )
+        with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+            for (offset, _), data in zip(
+                ranges, executor.map(lambda r: _fetch(*r), ranges)
+            ):
+                parquet_file.add(offset, data)
+        return read_parquet_row_groups(
+            parquet_file, metadata, row_groups, columns, filters, **kwargs
+        )
+
+    def iter_file_as_pandas_df(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        chunksize: Optional[int] = 100000,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        **kwargs: Optional[Dict]
+    ) -> Iterator[pd.DataFrame]:
+        """
+        Stream a CSV/TXT or newline-delimited JSON blob as pandas DataFrames of chunksize rows
+
+        DataFrames are parsed as the blob is downloaded, so memory is bounded by one DataFrame
+        plus one downloaded chunk. ".json" blobs are expected to hold one JSON object per line.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            chunksize: number of rows per DataFrame
+            chunk_size: size in bytes of each ranged request
+            **kwargs: add any kwarg that you would put in pd.read_csv / pd.read_json methods.
+
+        Returns: an iterator of pandas DataFrames
+
+        """
+        chunks = self._iter_blob_chunks(container_name, remote_file_name, chunk_size)
+        stream = io.BufferedReader(ChunkIteratorReader(lambda: next(chunks, b"")))
+        with get_pandas_df_iterator(
+            stream, remote_file_name, chunksize, **kwargs
+        ) as df_iterator:
+            yield from df_iterator
 
     def get_image_as_numpy_array(
         self, container_name: str, remote_file_name: str, **kwargs: Optional[Dict]
@@ -75,6 +245,147 @@ class BlobStorageExtended(BlobStorageBase):
         stream = self.get_file_as_bytes(container_name, remote_file_name)
         return decode_jpeg(stream, **kwargs)
 
+    def get_images_as_numpy_batch(
+        self,
+        container_name: str,
+        remote_file_names: List[str],
+        max_concurrency: Optional[int] = 8,
+        max_workers: Optional[int] = None,
+        **kwargs: Optional[Dict]
+    ) -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Get image files from blob concurrently & decode them as a batch of numpy arrays
+
+        Blobs are downloaded on a thread pool, and each image is decoded on another one as soon as it is
+        downloaded. When all images decode to the same shape, they are written in place into one preallocated
+        array.
+
+        Args:
+            container_name: Name of the container
+            remote_file_names: Names of the blobs
+            max_concurrency: number of blobs downloaded at the same time
+            max_workers: number of decoding threads, defaults to the number of CPUs
+            **kwargs: add any kwarg that you would put in simplejpeg.decode_jpeg (eg. min_height & min_width
+                to decode a downscaled image)
+
+        Returns: a (N, H, W, 3) RGB numpy array if all shapes match, else a list of RGB numpy arrays
+
+        """
+
+        with JpegBatchDecoder(len(remote_file_names), max_workers, **kwargs) as decoder:
+
+            def _download(index: int):
+                with self._governed():
+                    data = self.get_file_as_bytes(
+                        container_name, remote_file_names[index]
+                    )
+                decoder.submit(index, data)
+
+            with ThreadPoolExecutor(max_workers=max(max_concurrency, 1)) as executor:
+                # Consume results so that the first failure is raised
+                list(
+                    executor.map(bind_context(_download), range(len(remote_file_names)))
+                )
+            return decoder.result()
+
+    def iter_dataset(
+        self,
+        container_name: str,
+        prefix: Optional[str] = None,
+        decode: Optional[Callable[[str, bytes], Any]] = None,
+        prefetch: Optional[int] = 16,
+        max_prefetch_size: Optional[int] = None,
+        shuffle: Optional[bool] = False,
+        seed: Optional[int] = None,
+        num_shards: Optional[int] = 1,
+        shard_index: Optional[int] = 0,
+        max_workers: Optional[int] = 8,
+    ) -> Iterator[Tuple[str, Any]]:
+        """
+        Iterate over the blobs under a prefix, downloaded & decoded ahead of the consumer (eg. a training loop)
+
+        Blobs are downloaded and decoded on a thread pool, at most prefetch items ahead of the one being
+        consumed. Items are yielded in order, so a seeded shuffle gives the same sequence on every run.
+
+        Args:
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+            decode: called on the thread pool as decode(remote_file_name, data). Defaults to decoding JPEG
+                images as RGB numpy arrays and other blobs as pandas DataFrames
+            prefetch: maximum number of items downloaded or decoded ahead
+            max_prefetch_size: if set, no new item is started while the decoded items waiting to be consumed
+                hold more than this many bytes
+            shuffle: if True, the blob names are listed first then shuffled with seed
+            seed: seed of the shuffle, must be the same on every worker when sharding
+            num_shards: number of workers sharing the dataset, each one gets every num_shards-th blob
+            shard_index: index of the current worker, from 0 to num_shards - 1
+            max_workers: number of threads downloading & decoding
+
+        Returns: an iterator of (blob name, decoded item)
+
+        """
+        names = select_dataset_names(
+            self.get_list_blobs_name(container_name, prefix, return_list=False),
+            shuffle,
+            seed,
+            num_shards,
+            shard_index,
+        )
+        decode = decode or self._decode_blob
+        lock = threading.Lock()
+        held_size = 0
+
+        def _load(name: str) -> Tuple[Any, int]:
+            nonlocal held_size
+            with self._governed():
+                data = self.get_file_as_bytes(container_name, name)
+            item = decode(name, data)
+            size = get_item_size(item)
+            with lock:
+                held_size += size
+            return item, size
+
+        def _pop() -> Tuple[str, Any]:
+            nonlocal held_size
+            name, future = pending.popleft()
+            item, size = future.result()
+            with lock:
+                held_size -= size
+            return name, item
+
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=max(max_workers, 1))
+        try:
+            for name in names:
+                # Once the queue is empty an item is started whatever the size held, so iteration can't stall
+                while pending and (
+                    len(pending) >= max(prefetch, 1)
+                    or (
+                        max_prefetch_size is not None and held_size >= max_prefetch_size
+                    )
+                ):
+                    yield _pop()
+                pending.append((name, executor.submit(_load, name)))
+            while pending:
+                yield _pop()
+        finally:
+            executor.shutdown(wait=True, cancel_futures=True)
+
+    def _decode_blob(self, remote_file_name: str, data: bytes) -> Any:
+        """
+        Default decoder of iter_dataset: JPEG images as RGB numpy arrays, other blobs as pandas DataFrames
+
+        Args:
+            remote_file_name: Name of the blob
+            data: content of the blob
+
+        Returns:
+
+        """
+        if remote_file_name.lower().endswith((".jpg", ".jpeg")):
+            return decode_jpeg(data)
+        return read_pandas_df(data, remote_file_name)
+
     def upload_image_bytes_as_jpg_file(
         self,
         img: np.ndarray,
@@ -107,45 +418,42 @@ class BlobStorageExtended(BlobStorageBase):
             overwrite,
         )
 
+    @instrumented("upload")
     def upload_pandas_df(
         self,
         df: pd.DataFrame,
         container_name: str,
         remote_file_name: str,
         overwrite: Optional[bool] = False,
+        content_encoding: Optional[str] = None,
         **kwargs: Optional[Dict]
     ):
         """
         Upload a in memory pandas DataFrame to a blob
+
+        The DataFrame is serialized straight into the blob, staged block by block: there is no local file.
+
         Args:
             df: a pandas DataFrame
             container_name: Name of the container
             remote_file_name: Name of the blob where the dataframe will be uploaded
             overwrite: set to True if needed
+            content_encoding: "gzip" or "zstd" to compress the serialized DataFrame as it is written
             **kwargs: add any kwarg that you would put in pd.to_* methods.
 
         Returns:
 
         """
-        foldername, filename = self.get_directory_and_filename_from_full_path(
-            remote_file_name
-        )
-        if filename.endswith(".csv") | filename.endswith(".txt"):
-            df.to_csv(self.local_base_path + filename, **kwargs)
-        elif remote_file_name.endswith(".parquet"):
-            df.to_parquet(self.local_base_path + filename, **kwargs)
-        elif remote_file_name.endswith(".json"):
-            df.to_json(self.local_base_path + filename, **kwargs)
-        elif remote_file_name.endswith(".xls") | filename.endswith(".xlsx"):
-            df.to_excel(self.local_base_path + filename, **kwargs)
-        else:
-            print(
+        if not remote_file_name.endswith(PANDAS_WRITE_EXTENSIONS):
+            logger.warning(
                 "Extension not recognized - only ['csv','txt','parquet','json','xls','xlsx'] are supported."
             )
-        if os.path.exists(self.local_base_path + filename):
-            self.upload_file(
-                container_name,
-                local_file_name=self.local_base_path + filename,
-                remote_file_name=remote_file_name,
-                overwrite=overwrite,
-            )
+            return
+        with self.open_blob(
+            container_name,
+            remote_file_name,
+            mode="wb",
+            overwrite=overwrite,
+            content_encoding=content_encoding,
+        ) as f:
+            write_pandas_df(df, f, remote_file_name, **kwargs)
@@ -1,35 +1,117 @@
+import asyncio
+import functools
 import io
-import os
-import sys
-from typing import Dict, Optional
+import logging
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    List,
+    Optional,
+    Tuple,
+    Union,
+)
 
-from .base_async import BlobStorageBaseAsync
+from azure.core import MatchConditions
+from azure.core.pipeline.transport import AsyncHttpTransport
+
+from .base_async import (
+    DEFAULT_BLOCK_SIZE,
+    DEFAULT_CHUNK_SIZE,
+    BlobStorageBaseAsync,
+    _gather_or_cancel,
+)
+from .cache import BlobCache
+from .compression import get_content_encoding
+from .governor import AsyncConcurrencyGovernor
+from .index import BlobIndex
+from .metrics import BlobObserver, bind_context, instrumented
+from .streams import CallbackWriter, ChunkIteratorReader, SparseBlobFile
 
 try:
     import numpy as np
     import pandas as pd
+    import pyarrow.parquet as pq
     from simplejpeg import decode_jpeg, encode_jpeg
-except ModuleNotFoundError as moduleErr:
-    print("[Error]: Failed to import (Module Not Found) {}.".format(moduleErr.args[0]))
-    print("Please install with extras")
-    sys.exit(1)
-except ImportError as impErr:
-    print("[Error]: Failed to import (Import Error) {}.".format(impErr.args[0]))
-    print("Please install with extras")
-    sys.exit(1)
+
+    from .dataframes import (
+        PANDAS_WRITE_EXTENSIONS,
+        get_pandas_df_iterator,
+        read_pandas_df,
+        write_pandas_df,
+    )
+    from .datasets import check_shard, get_item_size, shuffle_names
+    from .images import JpegBatchDecoder
+    from .parquet import (
+        PARQUET_FOOTER_READ_SIZE,
+        get_columns_to_read,
+        is_parquet_projection,
+        plan_parquet_read,
+        read_parquet_bytes,
+        read_parquet_row_groups,
+    )
+except ImportError as e:
+    raise ImportError(
+        "Failed to import {}. Please install with extras: "
+        "pip install azure_blobstorage_utils[extended]".format(e.name or e.args[0])
+    ) from e
+
+
+logger = logging.getLogger(__name__)
 
 
 class BlobStorageExtendedAsync(BlobStorageBaseAsync):
     def __init__(
-        self, connection_string: str, local_base_path: Optional[str] = "azure_tmp/"
+        self,
+        connection_string: str,
+        local_base_path: Optional[str] = "azure_tmp/",
+        container_cache_ttl: Optional[float] = 60.0,
+        cache: Optional[BlobCache] = None,
+        index: Optional[BlobIndex] = None,
+        connection_pool_size: Optional[int] = None,
+        keep_alive_timeout: Optional[float] = None,
+        transport: Optional[AsyncHttpTransport] = None,
+        governor: Optional[AsyncConcurrencyGovernor] = None,
+        observers: Optional[List[BlobObserver]] = None,
     ):
         """
 
         Args:
             connection_string: Connection string to Azure Blob Storage
             local_base_path: local folder where data will be downloaded if path is not specified
+            container_cache_ttl: seconds during which a container is known to exist without checking again.
+                None caches forever, 0 disables the cache.
+            cache: if set, get_file_as_* methods read blobs through this cache
+            index: if set, listings (get_list_blobs_name, list_blobs_parallel & directory operations) are
+                answered from this local index, listing from the service only the prefixes not indexed yet
+            connection_pool_size: maximum number of simultaneous connections, to set above concurrency for
+                concurrent transfers. None for the default of aiohttp (100)
+            keep_alive_timeout: seconds during which an idle connection is kept open. None for the default of
+                aiohttp (15)
+            transport: HTTP transport of the client, overrides connection_pool_size & keep_alive_timeout.
+                To share connections between several instances, give them the same transport built on a session
+                that you own and close (eg. AioHttpTransport(session=session, session_owner=False))
+            governor: if set, bulk operations (directory transfers, blocks of upload_file, batch deletes, image
+                batches & datasets) adapt their concurrency to the throttling responses of the service,
+                concurrency / max_concurrency becoming upper bounds
+            observers: observers receiving the measures (bytes, latency, retries, HTTP status) of each
+                download, upload & delete operation (eg. MetricsCollector, PrometheusObserver)
         """
-        super().__init__(connection_string, local_base_path)
+        super().__init__(
+            connection_string,
+            local_base_path,
+            container_cache_ttl,
+            cache,
+            index,
+            connection_pool_size,
+            keep_alive_timeout,
+            transport,
+            governor,
+            observers,
+        )
 
     async def get_file_as_pandas_df(
         self, container_name: str, remote_file_name: str, **kwargs: Optional[Dict]
@@ -45,19 +127,174 @@ class BlobStorageExtendedAsync(BlobStorageBaseAsync):
         Returns: a pandas DataFrame
 
         """
+        if remote_file_name.endswith(".parquet") and is_parquet_projection(kwargs):
+            return await self.get_parquet_as_pandas_df(
+                container_name, remote_file_name, **kwargs
+            )
         stream = await self.get_file_as_bytes(container_name, remote_file_name)
-        if remote_file_name.endswith(".csv") | remote_file_name.endswith(".txt"):
-            return pd.read_csv(io.BytesIO(stream), **kwargs)
-        elif remote_file_name.endswith(".parquet"):
-            return pd.read_parquet(io.BytesIO(stream), **kwargs)
-        elif remote_file_name.endswith(".json"):
-            return pd.read_json(io.BytesIO(stream), **kwargs)
-        elif remote_file_name.endswith(".xls") | remote_file_name.endswith(".xlsx"):
-            return pd.read_excel(io.BytesIO(stream), **kwargs)
-        else:
+        return read_pandas_df(stream, remote_file_name, **kwargs)
+
+    async def get_parquet_as_pandas_df(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        columns: Optional[List[str]] = None,
+        filters: Optional[List[Tuple[str, str, Any]]] = None,
+        max_concurrency: Optional[int] = 8,
+        **kwargs: Optional[Dict]
+    ) -> pd.DataFrame:
+        """
+        Get a parquet blob as a pandas DataFrame, fetching only the needed byte ranges
+
+        The footer is read first, then row groups are selected with their statistics and filters,
+        and only the column chunks of the selected columns & row groups are fetched, in parallel.
+        Ranges of a blob stored with a gzip or zstd Content-Encoding can't be decoded on their own: it is
+        downloaded whole, then filtered. With a cache, a cached copy of the blob (still matching the ETag of
+        the blob) is read instead of fetching ranges, but fetched ranges are not cached: the cache only holds
+        whole blobs.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            columns: columns to return, None for all columns
+            filters: list of (column, operator, value) predicates, all of which rows must match.
+                Operators are those of pd.read_parquet: "==", "!=", "<", "<=", ">", ">=", "in" & "not in"
+            max_concurrency: number of ranges fetched at the same time
+            **kwargs: add any kwarg that you would put in pyarrow.Table.to_pandas.
+
+        Returns: a pandas DataFrame
+
+        """
+        loop = asyncio.get_running_loop()
+        read_bytes = functools.partial(
+            read_parquet_bytes, columns=columns, filters=filters, **kwargs
+        )
+        entry = None
+        if self.cache is not None:
+            entry = self.cache.get(container_name, remote_file_name)
+            if entry is not None and self.cache.is_fresh(entry):
+                return await loop.run_in_executor(None, read_bytes, entry.data)
+        blob_client = self.get_blob_client(container_name, remote_file_name)
+        properties = await blob_client.get_blob_properties()
+        if properties.size == 0:
             raise ValueError(
-                "Extension not recognized - only ['csv','txt','parquet','json','xls','xlsx'] are supported."
+                "Blob [{}] is empty, it is not a parquet file.".format(remote_file_name)
+            )
+        if entry is not None and entry.etag == properties.etag:
+            self.cache.touch(container_name, remote_file_name)
+            return await loop.run_in_executor(None, read_bytes, entry.data)
+        if get_content_encoding(properties) is not None:
+            return await loop.run_in_executor(
+                None,
+                read_bytes,
+                await self.get_file_as_bytes(container_name, remote_file_name),
+            )
+        conditions = {
+            "etag": properties.etag,
+            "match_condition": MatchConditions.IfNotModified,
+        }
+
+        async def _fetch(offset: int, length: int) -> bytes:
+            stream = await blob_client.download_blob(
+                offset=offset, length=length, **conditions
+            )
+            return await stream.readall()
+
+        # pyarrow runs in a worker thread, reads outside prefetched ranges are fetched on the event loop
+        parquet_file = SparseBlobFile(
+            properties.size,
+            lambda offset, length: asyncio.run_coroutine_threadsafe(
+                _fetch(offset, length), loop
+            ).result(),
+        )
+        tail_offset = max(properties.size - PARQUET_FOOTER_READ_SIZE, 0)
+        parquet_file.add(
+            tail_offset, await _fetch(tail_offset, properties.size - tail_offset)
+        )
+        metadata = await loop.run_in_executor(None, pq.read_metadata, parquet_file)
+        row_groups, ranges = plan_parquet_read(
+            metadata, get_columns_to_read(columns, filters), filters
+        )
+        semaphore = asyncio.Semaphore(max(max_concurrency, 1))
+
+        async def _prefetch(offset: int, length: int):
+            async with semaphore:
+                parquet_file.add(offset, await _fetch(offset, length))
+
+        await _gather_or_cancel(*(_prefetch(*r) for r in ranges))
+        return await loop.run_in_executor(
+            None,
+            functools.partial(
+                read_parquet_row_groups,
+                parquet_file,
+                metadata,
+                row_groups,
+                columns,
+                filters,
+                **kwargs,
+            ),
+        )
+
+    async def iter_file_as_pandas_df(
+        self,
+        container_name: str,
+        remote_file_name: str,
+        chunksize: Optional[int] = 100000,
+        chunk_size: Optional[int] = DEFAULT_CHUNK_SIZE,
+        **kwargs: Optional[Dict]
+    ) -> AsyncIterator[pd.DataFrame]:
+        """
+        Stream a CSV/TXT or newline-delimited JSON blob as pandas DataFrames of chunksize rows
+
+        DataFrames are parsed in a worker thread as the blob is downloaded, so memory is bounded by one
+        DataFrame plus one downloaded chunk. ".json" blobs are expected to hold one JSON object per line.
+
+        Args:
+            container_name: Name of the container
+            remote_file_name: Name of the blob
+            chunksize: number of rows per DataFrame
+            chunk_size: size in bytes of each ranged request
+            **kwargs: add any kwarg that you would put in pd.read_csv / pd.read_json methods.
+
+        Returns: an iterator of pandas DataFrames
+
+        """
+        loop = asyncio.get_running_loop()
+        chunks = self._iter_blob_chunks(container_name, remote_file_name, chunk_size)
+
+        async def _next_chunk() -> bytes:
+            try:
+                return await chunks.__anext__()
+            except StopAsyncIteration:
+                return b""
+
+        # The parser runs in a thread and pulls each chunk from the event loop
+        stream = io.BufferedReader(
+            ChunkIteratorReader(
+                lambda: asyncio.run_coroutine_threadsafe(_next_chunk(), loop).result()
+            )
+        )
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            df_iterator = await loop.run_in_executor(
+                executor,
+                functools.partial(
+                    get_pandas_df_iterator,
+                    stream,
+                    remote_file_name,
+                    chunksize,
+                    **kwargs,
+                ),
             )
+            with df_iterator:
+                while True:
+                    df = await loop.run_in_executor(executor, next, df_iterator, None)
+                    if df is None:
+                        break
+                    yield df
+        finally:
+            executor.shutdown(wait=False)
+            await chunks.aclose()
 
     async def get_image_as_numpy_array(
         self, container_name: str, remote_file_name: str
@@ -75,6 +312,154 @@ class BlobStorageExtendedAsync(BlobStorageBaseAsync):
         stream = await self.get_file_as_bytes(container_name, remote_file_name)
         return decode_jpeg(stream)
 
+    async def get_images_as_numpy_batch(
+        self,
+        container_name: str,
+        remote_file_names: List[str],
+        concurrency: Optional[int] = 8,
+        max_workers: Optional[int] = None,
+        **kwargs: Optional[Dict]
+    ) -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Get image files from blob concurrently & decode them as a batch of numpy arrays
+
+        Blobs are downloaded concurrently, and each image is decoded on a thread pool as soon as it is
+        downloaded, without blocking the event loop. When all images decode to the same shape, they are written
+        in place into one preallocated array.
+
+        Args:
+            container_name: Name of the container
+            remote_file_names: Names of the blobs
+            concurrency: number of blobs downloaded at the same time
+            max_workers: number of decoding threads, defaults to the number of CPUs
+            **kwargs: add any kwarg that you would put in simplejpeg.decode_jpeg (eg. min_height & min_width
+                to decode a downscaled image)
+
+        Returns: a (N, H, W, 3) RGB numpy array if all shapes match, else a list of RGB numpy arrays
+
+        """
+        semaphore = asyncio.Semaphore(max(concurrency, 1))
+
+        with JpegBatchDecoder(len(remote_file_names), max_workers, **kwargs) as decoder:
+
+            async def _get(index: int):
+                async with semaphore, self._governed():
+                    data = await self.get_file_as_bytes(
+                        container_name, remote_file_names[index]
+                    )
+                decoder.submit(index, data)
+
+            await _gather_or_cancel(*[_get(i) for i in range(len(remote_file_names))])
+            return await asyncio.get_running_loop().run_in_executor(
+                None, decoder.result
+            )
+
+    async def iter_dataset(
+        self,
+        container_name: str,
+        prefix: Optional[str] = None,
+        decode: Optional[Callable[[str, bytes], Any]] = None,
+        prefetch: Optional[int] = 16,
+        max_prefetch_size: Optional[int] = None,
+        shuffle: Optional[bool] = False,
+        seed: Optional[int] = None,
+        num_shards: Optional[int] = 1,
+        shard_index: Optional[int] = 0,
+        max_workers: Optional[int] = 8,
+    ) -> AsyncIterator[Tuple[str, Any]]:
+        """
+        Iterate over the blobs under a prefix, downloaded & decoded ahead of the consumer (eg. a training loop)
+
+        Blobs are downloaded concurrently and decoded on a thread pool, at most prefetch items ahead of the one
+        being consumed. Items are yielded in order, so a seeded shuffle gives the same sequence on every run.
+
+        Args:
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+            decode: called on the thread pool as decode(remote_file_name, data). Defaults to decoding JPEG
+                images as RGB numpy arrays and other blobs as pandas DataFrames
+            prefetch: maximum number of items downloaded or decoded ahead
+            max_prefetch_size: if set, no new item is started while the decoded items waiting to be consumed
+                hold more than this many bytes
+            shuffle: if True, the blob names are listed first then shuffled with seed
+            seed: seed of the shuffle, must be the same on every worker when sharding
+            num_shards: number of workers sharing the dataset, each one gets every num_shards-th blob
+            shard_index: index of the current worker, from 0 to num_shards - 1
+            max_workers: number of decoding threads
+
+        Returns: an async iterator of (blob name, decoded item)
+
+        """
+        check_shard(num_shards, shard_index)
+        decode = decode or self._decode_blob
+        loop = asyncio.get_running_loop()
+        held_size = 0
+
+        async def _names() -> AsyncIterator[str]:
+            names = self._iter_blobs_name(container_name, prefix)
+            if shuffle:
+                names = shuffle_names([name async for name in names], seed)
+                for name in names[shard_index::num_shards]:
+                    yield name
+            else:
+                i = 0
+                async for name in names:
+                    if i % num_shards == shard_index:
+                        yield name
+                    i += 1
+
+        async def _load(name: str) -> Tuple[Any, int]:
+            nonlocal held_size
+            async with self._governed():
+                data = await self.get_file_as_bytes(container_name, name)
+            item = await loop.run_in_executor(executor, decode, name, data)
+            size = get_item_size(item)
+            held_size += size
+            return item, size
+
+        async def _pop() -> Tuple[str, Any]:
+            nonlocal held_size
+            name, task = pending.popleft()
+            item, size = await task
+            held_size -= size
+            return name, item
+
+        pending = deque()
+        executor = ThreadPoolExecutor(max_workers=max(max_workers, 1))
+        try:
+            async for name in _names():
+                # Once the queue is empty an item is started whatever the size held, so iteration can't stall
+                while pending and (
+                    len(pending) >= max(prefetch, 1)
+                    or (
+                        max_prefetch_size is not None and held_size >= max_prefetch_size
+                    )
+                ):
+                    yield await _pop()
+                pending.append((name, asyncio.ensure_future(_load(name))))
+            while pending:
+                yield await _pop()
+        finally:
+            for _, task in pending:
+                task.cancel()
+            await asyncio.gather(*[task for _, task in pending], return_exceptions=True)
+            executor.shutdown(wait=False, cancel_futures=True)
+
+    def _decode_blob(self, remote_file_name: str, data: bytes) -> Any:
+        """
+        Default decoder of iter_dataset: JPEG images as RGB numpy arrays, other blobs as pandas DataFrames
+
+        Args:
+            remote_file_name: Name of the blob
+            data: content of the blob
+
+        Returns:
+
+        """
+        if remote_file_name.lower().endswith((".jpg", ".jpeg")):
+            return decode_jpeg(data)
+        return read_pandas_df(data, remote_file_name)
+
     async def upload_image_bytes_as_jpg_file(
         self,
         img: np.ndarray,
@@ -102,43 +487,56 @@ class BlobStorageExtendedAsync(BlobStorageBaseAsync):
             overwrite,
         )
 
+    @instrumented("upload")
     async def upload_pandas_df(
         self,
         df: pd.DataFrame,
         container_name: str,
         remote_file_name: str,
         overwrite: Optional[bool] = False,
+        content_encoding: Optional[str] = None,
         **kwargs: Optional[Dict]
     ):
         """
         Upload a in memory pandas DataFrame to a blob
+
+        The DataFrame is serialized straight into the blob in a worker thread, staged block by block: there is
+        no local file.
+
         Args:
             df: a pandas DataFrame
             container_name: Name of the container
             remote_file_name: Name of the blob where the dataframe will be uploaded
             overwrite: set to True if needed
+            content_encoding: "gzip" or "zstd" to compress the serialized DataFrame as it is written
             **kwargs: add any kwarg that you would put in pd.to_* methods.
 
         Returns:
 
         """
-        _, filename = self.get_directory_and_filename_from_full_path(remote_file_name)
-        if filename.endswith(".csv") | filename.endswith(".txt"):
-            df.to_csv(self.local_base_path + filename, **kwargs)
-        elif remote_file_name.endswith(".parquet"):
-            df.to_parquet(self.local_base_path + filename, **kwargs)
-        elif remote_file_name.endswith(".json"):
-            df.to_json(self.local_base_path + filename, **kwargs)
-        elif remote_file_name.endswith(".xls") | filename.endswith(".xlsx"):
-            df.to_excel(self.local_base_path + filename, **kwargs)
-        else:
-            print(
+        if not remote_file_name.endswith(PANDAS_WRITE_EXTENSIONS):
+            logger.warning(
                 "Extension not recognized - only ['csv','txt','parquet','json','xls','xlsx'] are supported."
             )
-        if os.path.exists(self.local_base_path + filename):
-            await self.upload_file(
-                container_name,
-                local_file_name=self.local_base_path + filename,
-                remote_file_name=remote_file_name,
-                overwrite=overwrite,
-            )
+            return
+        loop = asyncio.get_running_loop()
+        async with await self.open_blob(
+            container_name,
+            remote_file_name,
+            mode="wb",
+            overwrite=overwrite,
+            content_encoding=content_encoding,
+        ) as writer:
+
+            def _write(data: bytes):
+                asyncio.run_coroutine_threadsafe(writer.write(data), loop).result()
+
+            def _serialize():
+                # Buffered so that the serializer's small writes don't each cross to the event loop
+                with io.BufferedWriter(
+                    CallbackWriter(_write), buffer_size=DEFAULT_BLOCK_SIZE
+                ) as f:
+                    write_pandas_df(df, f, remote_file_name, **kwargs)
+
+            with ThreadPoolExecutor(max_workers=1) as executor:
+                await loop.run_in_executor(executor, bind_context(_serialize))
@@ -0,0 +1,344 @@
+import abc
+import asyncio
+import contextlib
+import contextvars
+import email.utils
+import threading
+import time
+from typing import AsyncIterator, ContextManager, Iterator, Optional
+
+# Status codes of the responses returned by the service when an account is over its limits
+# (503 ServerBusy, 500 OperationTimedOut, 429 TooManyRequests)
+THROTTLING_STATUS_CODES = (429, 500, 503)
+
+# Governors whose slot is held by the current context, inherited by the threads (bind_context) & tasks it starts
+_held_slots = contextvars.ContextVar("azure_blobstorage_utils_held_slots", default=())
+
+
+def get_retry_after(headers) -> Optional[float]:
+    """
+    Get the delay asked by a response before sending new requests
+
+    Args:
+        headers: headers of the response
+
+    Returns: seconds to wait, None if the response does not ask for a delay
+
+    """
+    for header, scale in [
+        ("retry-after-ms", 1000),
+        ("x-ms-retry-after-ms", 1000),
+        ("Retry-After", 1),
+    ]:
+        value = headers.get(header)
+        if value is None:
+            continue
+        try:
+            return max(float(value) / scale, 0.0)
+        except ValueError:
+            pass
+        try:
+            # Retry-After can also be an HTTP date
+            return max(
+                email.utils.parsedate_to_datetime(value).timestamp() - time.time(), 0.0
+            )
+        except (TypeError, ValueError):
+            pass
+    return None
+
+
+class _AimdLimit(abc.ABC):
+    def __init__(
+        self,
+        initial: int,
+        minimum: int,
+        maximum: int,
+        backoff: float,
+        latency_target: Optional[float],
+        cooldown: float,
+    ):
+        """
+        Concurrency limit with additive increase & multiplicative decrease, shared by the sync & async governors
+
+        Args:
+            initial: initial number of operations allowed at the same time
+            minimum: lowest limit reached when backing off
+            maximum: highest limit reached when ramping up
+            backoff: factor applied to the limit on throttling
+            latency_target: if set, operations slower than this many seconds don't raise the limit
+            cooldown: minimum seconds between two decreases, so that a burst of throttled responses
+                to the same window of requests only backs off once
+        """
+        if not 1 <= minimum <= initial <= maximum:
+            raise ValueError(
+                "Expected 1 <= minimum <= initial <= maximum, got {}, {}, {}.".format(
+                    minimum, initial, maximum
+                )
+            )
+        self.minimum = minimum
+        self.maximum = maximum
+        self.backoff = backoff
+        self.latency_target = latency_target
+        self.cooldown = cooldown
+        self._limit = float(initial)
+        self._in_flight = 0
+        self._paused_until = 0.0
+        self._last_decrease = 0.0
+
+    @property
+    def limit(self) -> int:
+        """
+        Current number of operations allowed at the same time
+
+        Returns:
+
+        """
+        return int(self._limit)
+
+    def _can_acquire(self) -> bool:
+        return time.monotonic() >= self._paused_until and self._in_flight < self.limit
+
+    def _get_pause(self) -> Optional[float]:
+        """
+        Get the remaining time of a pause asked by Retry-After
+
+        Returns: seconds, None if there is no pause
+
+        """
+        pause = self._paused_until - time.monotonic()
+        return pause if pause > 0 else None
+
+    def _on_success(self, duration: float):
+        """
+        Raise the limit by about one per window of limit successful operations
+
+        Args:
+            duration: seconds taken by the operation
+
+        Returns:
+
+        """
+        if self.latency_target is None or duration <= self.latency_target:
+            self._limit = min(self._limit + 1 / self._limit, float(self.maximum))
+
+    def _on_throttled(self, retry_after: Optional[float]):
+        """
+        Cut the limit and pause new operations for retry_after seconds
+
+        Args:
+            retry_after: seconds asked by the service before new requests, or None
+
+        Returns:
+
+        """
+        now = time.monotonic()
+        if now - self._last_decrease >= self.cooldown:
+            self._limit = max(self._limit * self.backoff, float(self.minimum))
+            self._last_decrease = now
+        if retry_after is not None:
+            self._paused_until = max(self._paused_until, now + retry_after)
+
+    def on_response(self, response):
+        """
+        Observe a response of the service, to use as raw_response_hook of a client
+
+        Every attempt of the SDK retry policy is observed, so throttling is seen even when a retry succeeds.
+
+        Args:
+            response: azure.core PipelineResponse
+
+        Returns:
+
+        """
+        http_response = response.http_response
+        if http_response.status_code in THROTTLING_STATUS_CODES:
+            with self._locked():
+                self._on_throttled(get_retry_after(http_response.headers))
+
+    @abc.abstractmethod
+    def _locked(self) -> ContextManager:
+        """
+        Get a context manager guarding the state of the limit while a response is observed
+
+        Returns:
+
+        """
+
+
+class ConcurrencyGovernor(_AimdLimit):
+    def __init__(
+        self,
+        initial: Optional[int] = 4,
+        minimum: Optional[int] = 1,
+        maximum: Optional[int] = 64,
+        backoff: Optional[float] = 0.5,
+        latency_target: Optional[float] = None,
+        cooldown: Optional[float] = 1.0,
+    ):
+        """
+        Adaptive limit of the operations run at the same time by bulk operations, for threads
+
+        The limit grows by one per window of successful operations and is halved (by backoff) when the service
+        throttles, while new operations wait for the delay of Retry-After. max_workers / max_concurrency of
+        the bulk operations remain upper bounds. Give the same governor to several instances to share the limit.
+
+        Args:
+            initial: initial number of operations allowed at the same time
+            minimum: lowest limit reached when backing off
+            maximum: highest limit reached when ramping up
+            backoff: factor applied to the limit on throttling
+            latency_target: if set, operations slower than this many seconds don't raise the limit
+            cooldown: minimum seconds between two decreases
+        """
+        super().__init__(initial, minimum, maximum, backoff, latency_target, cooldown)
+        self._condition = threading.Condition()
+
+    def acquire(self):
+        """
+        Wait until an operation is allowed to start
+
+        Returns:
+
+        """
+        with self._condition:
+            while not self._can_acquire():
+                self._condition.wait(self._get_pause())
+            self._in_flight += 1
+
+    def release(self, duration: Optional[float] = None):
+        """
+        Mark an operation as finished
+
+        Args:
+            duration: seconds taken by a successful operation, None if it failed
+
+        Returns:
+
+        """
+        with self._condition:
+            self._in_flight -= 1
+            if duration is not None:
+                self._on_success(duration)
+            self._condition.notify_all()
+
+    @contextlib.contextmanager
+    def slot(self) -> Iterator[None]:
+        """
+        Context manager running an operation within the limit
+
+        Reentrant: the sub-operations of an operation holding a slot (eg. the blocks of a file of a directory
+        transfer) run within that slot, instead of waiting for slots held by their parents.
+
+        Returns:
+
+        """
+        held = _held_slots.get()
+        if self in held:
+            yield
+            return
+        self.acquire()
+        token = _held_slots.set(held + (self,))
+        start = time.monotonic()
+        duration = None
+        try:
+            yield
+            duration = time.monotonic() - start
+        finally:
+            _held_slots.reset(token)
+            self.release(duration)
+
+    def _locked(self) -> ContextManager:
+        return self._condition
+
+
+class AsyncConcurrencyGovernor(_AimdLimit):
+    def __init__(
+        self,
+        initial: Optional[int] = 4,
+        minimum: Optional[int] = 1,
+        maximum: Optional[int] = 64,
+        backoff: Optional[float] = 0.5,
+        latency_target: Optional[float] = None,
+        cooldown: Optional[float] = 1.0,
+    ):
+        """
+        Adaptive limit of the operations run at the same time by bulk operations, for asyncio tasks
+
+        The limit grows by one per window of successful operations and is halved (by backoff) when the service
+        throttles, while new operations wait for the delay of Retry-After. concurrency / max_concurrency of
+        the bulk operations remain upper bounds. Give the same governor to several instances to share the limit.
+
+        Args:
+            initial: initial number of operations allowed at the same time
+            minimum: lowest limit reached when backing off
+            maximum: highest limit reached when ramping up
+            backoff: factor applied to the limit on throttling
+            latency_target: if set, operations slower than this many seconds don't raise the limit
+            cooldown: minimum seconds between two decreases
+        """
+        super().__init__(initial, minimum, maximum, backoff, latency_target, cooldown)
+        # Created in the running loop on first use
+        self._condition = None
+
+    async def acquire(self):
+        """
+        Wait until an operation is allowed to start
+
+        Returns:
+
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while not self._can_acquire():
+                try:
+                    await asyncio.wait_for(self._condition.wait(), self._get_pause())
+                except asyncio.TimeoutError:
+                    pass
+            self._in_flight += 1
+
+    async def release(self, duration: Optional[float] = None):
+        """
+        Mark an operation as finished
+
+        Args:
+            duration: seconds taken by a successful operation, None if it failed
+
+        Returns:
+
+        """
+        async with self._condition:
+            self._in_flight -= 1
+            if duration is not None:
+                self._on_success(duration)
+            self._condition.notify_all()
+
+    @contextlib.asynccontextmanager
+    async def slot(self) -> AsyncIterator[None]:
+        """
+        Async context manager running an operation within the limit
+
+        Reentrant: the sub-operations of an operation holding a slot (eg. the blocks of a file of a directory
+        transfer) run within that slot, instead of waiting for slots held by their parents.
+
+        Returns:
+
+        """
+        held = _held_slots.get()
+        if self in held:
+            yield
+            return
+        await self.acquire()
+        token = _held_slots.set(held + (self,))
+        start = time.monotonic()
+        duration = None
+        try:
+            yield
+            duration = time.monotonic() - start
+        finally:
+            _held_slots.reset(token)
+            await self.release(duration)
+
+    def _locked(self) -> ContextManager:
+        # Responses are observed from the event loop: the state can't change under us
+        return contextlib.nullcontext()
@@ -0,0 +1,99 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple, Union
+
+import numpy as np
+from simplejpeg import decode_jpeg, decode_jpeg_header
+
+# decode_jpeg options that change the size of the decoded image
+_HEADER_KWARGS = ("min_height", "min_width", "min_factor", "strict")
+
+
+def get_decoded_jpeg_shape(data: bytes, **kwargs: Optional[Dict]) -> Tuple[int, ...]:
+    """
+    Get the shape of the array decode_jpeg returns, from the header of the image only
+
+    Args:
+        data: JPEG data
+        **kwargs: add any kwarg that you would put in simplejpeg.decode_jpeg
+
+    Returns: height, width, channels
+
+    """
+    header_kwargs = {k: v for k, v in kwargs.items() if k in _HEADER_KWARGS}
+    height, width, _, _ = decode_jpeg_header(data, **header_kwargs)
+    colorspace = kwargs.get("colorspace", "RGB")
+    channels = 1 if colorspace.upper() == "GRAY" else len(colorspace)
+    return height, width, channels
+
+
+class JpegBatchDecoder:
+    def __init__(
+        self, size: int, max_workers: Optional[int] = None, **kwargs: Optional[Dict]
+    ):
+        """
+        Decode the JPEG images of a batch on a thread pool as soon as their data arrive (decode_jpeg releases
+        the GIL), eg. while the other images are still downloading
+
+        The first image submitted gives the shape of the batch: images decoding to this shape are written in place
+        into one preallocated array, the others are decoded on their own.
+
+        Args:
+            size: number of images of the batch
+            max_workers: number of decoding threads, defaults to the number of CPUs
+            **kwargs: add any kwarg that you would put in simplejpeg.decode_jpeg
+        """
+        self.size = size
+        self.kwargs = kwargs
+        self._executor = ThreadPoolExecutor(max_workers=max_workers or os.cpu_count())
+        self._lock = threading.Lock()
+        self._batch = None
+        self._same_shape = True
+        self._futures = [None] * size
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        # Decoding stops being awaited on failure
+        self._executor.shutdown(
+            wait=exc_type is None, cancel_futures=exc_type is not None
+        )
+
+    def submit(self, index: int, data: bytes):
+        """
+        Start decoding an image, can be called from any thread
+
+        Args:
+            index: index of the image in the batch
+            data: JPEG data
+
+        Returns:
+
+        """
+        shape = get_decoded_jpeg_shape(data, **self.kwargs)
+        with self._lock:
+            if self._batch is None:
+                self._batch = np.empty((self.size,) + shape, dtype=np.uint8)
+            if shape != self._batch.shape[1:]:
+                self._same_shape = False
+                self._futures[index] = self._executor.submit(
+                    decode_jpeg, data, **self.kwargs
+                )
+                return
+        self._futures[index] = self._executor.submit(
+            decode_jpeg, data, buffer=self._batch[index], **self.kwargs
+        )
+
+    def result(self) -> Union[np.ndarray, List[np.ndarray]]:
+        """
+        Wait until all images of the batch are decoded
+
+        Returns: a (N, H, W, C) numpy array if all shapes match, else a list of (H, W, C) numpy arrays
+
+        """
+        images = [future.result() for future in self._futures]
+        if self._batch is None:
+            return []
+        return self._batch if self._same_shape else images
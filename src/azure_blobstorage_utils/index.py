@@ -0,0 +1,356 @@
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Dict, Iterable, List, Optional, Tuple, Union
+
+from azure.storage.blob import BlobProperties
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS blobs (
+    container TEXT NOT NULL,
+    name TEXT NOT NULL,
+    size INTEGER,
+    etag TEXT,
+    last_modified TEXT,
+    content_md5 BLOB,
+    PRIMARY KEY (container, name)
+);
+CREATE INDEX IF NOT EXISTS blobs_size ON blobs (container, size);
+CREATE TABLE IF NOT EXISTS prefixes (
+    container TEXT NOT NULL,
+    prefix TEXT NOT NULL,
+    refreshed_at REAL NOT NULL,
+    PRIMARY KEY (container, prefix)
+);
+"""
+
+# A prefix covers a name if it is the start of the name
+_COVERS = "container = ? AND substr(?, 1, length(prefix)) = prefix"
+
+
+class BlobIndex:
+    def __init__(
+        self, database: Optional[str] = ":memory:", ttl: Optional[float] = None
+    ):
+        """
+        Local SQLite index of container listings, shared by the sync & async classes
+
+        Each listed prefix is recorded with its refresh time: a query on a prefix covered by an indexed one is
+        answered locally in milliseconds, other prefixes are listed from the service and added to the index.
+        Blobs deleted through BlobStorageBase / BlobStorageBaseAsync are removed from the index, and blobs
+        written through them are indexed with their new properties. Changes made by other clients are only seen
+        after a refresh.
+
+        Args:
+            database: path of the SQLite database file, ":memory:" for an index that is not persisted
+            ttl: seconds after which an indexed prefix is listed again. If None, prefixes are only listed again
+                when refresh_index is called
+        """
+        self.database = database
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._connection = sqlite3.connect(database, check_same_thread=False)
+        with self._lock, self._connection:
+            self._connection.executescript(_SCHEMA)
+
+    @staticmethod
+    def _get_prefix_range(prefix: str) -> Tuple[str, Optional[str]]:
+        """
+        Get the range of names starting with prefix, so that the primary key index is used
+
+        Args:
+            prefix: prefix of blob names
+
+        Returns: lower bound (included), upper bound (excluded) or None if there is none
+
+        """
+        for i in range(len(prefix) - 1, -1, -1):
+            if ord(prefix[i]) < 0x10FFFF:
+                return prefix, prefix[:i] + chr(ord(prefix[i]) + 1)
+        return prefix, None
+
+    def _get_prefix_condition(self, prefix: str) -> Tuple[str, List[str]]:
+        """
+        Get the SQL condition & parameters selecting the names starting with prefix
+
+        Args:
+            prefix: prefix of blob names
+
+        Returns:
+
+        """
+        lower, upper = self._get_prefix_range(prefix)
+        if upper is None:
+            return "name >= ?", [lower]
+        return "name >= ? AND name < ?", [lower, upper]
+
+    def is_fresh(self, container_name: str, prefix: Optional[str] = None) -> bool:
+        """
+        Check if the blobs starting with prefix are indexed and can be queried without listing them
+
+        Args:
+            container_name: Name of the container
+            prefix: prefix of blob names
+
+        Returns:
+
+        """
+        with self._lock:
+            row = self._connection.execute(
+                "SELECT max(refreshed_at) FROM prefixes WHERE " + _COVERS,
+                (container_name, prefix or ""),
+            ).fetchone()
+        refreshed_at = row[0]
+        if refreshed_at is None:
+            return False
+        return self.ttl is None or time.time() - refreshed_at < self.ttl
+
+    @staticmethod
+    def _get_row(container_name: str, blob: BlobProperties) -> Tuple:
+        """
+        Get the row of the blobs table of a blob
+
+        Args:
+            container_name: Name of the container
+            blob: BlobProperties of the blob
+
+        Returns:
+
+        """
+        return (
+            container_name,
+            blob.name,
+            blob.size,
+            blob.etag,
+            blob.last_modified.isoformat() if blob.last_modified else None,
+            (
+                bytes(blob.content_settings.content_md5)
+                if blob.content_settings.content_md5
+                else None
+            ),
+        )
+
+    def refresh(
+        self,
+        container_name: str,
+        prefix: Optional[str],
+        blobs: Iterable[BlobProperties],
+    ):
+        """
+        Replace the indexed blobs starting with prefix by a new listing
+
+        Args:
+            container_name: Name of the container
+            prefix: prefix of the listing
+            blobs: BlobProperties of every blob starting with prefix
+
+        Returns:
+
+        """
+        prefix = prefix or ""
+        condition, parameters = self._get_prefix_condition(prefix)
+        refreshed_at = time.time()
+        # The listing is paged from the service: it is done before locking the index
+        rows = [self._get_row(container_name, blob) for blob in blobs]
+        with self._lock, self._connection:
+            self._connection.execute(
+                "DELETE FROM blobs WHERE container = ? AND " + condition,
+                [container_name] + parameters,
+            )
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+            # Sub-prefixes are covered by the new listing
+            self._connection.execute(
+                "DELETE FROM prefixes WHERE container = ? AND substr(prefix, 1, ?) = ?",
+                (container_name, len(prefix), prefix),
+            )
+            self._connection.execute(
+                "INSERT INTO prefixes VALUES (?, ?, ?)",
+                (container_name, prefix, refreshed_at),
+            )
+
+    def query(
+        self,
+        container_name: str,
+        prefix: Optional[str] = None,
+        pattern: Optional[str] = None,
+        min_size: Optional[int] = None,
+        max_size: Optional[int] = None,
+        include_properties: Optional[bool] = False,
+    ) -> Union[List[str], List[BlobProperties]]:
+        """
+        Query the indexed blobs, in name order
+
+        Args:
+            container_name: Name of the container
+            prefix: filter blobs with prefix
+            pattern: filter blobs with a glob pattern on the whole name (eg. "images/*/*.jpg"), case-sensitive
+            min_size: filter blobs of at least min_size bytes
+            max_size: filter blobs of at most max_size bytes
+            include_properties: if True, returns BlobProperties (name, size, etag, last_modified,
+                content_settings.content_md5) instead of names
+
+        Returns:
+
+        """
+        conditions = ["container = ?"]
+        parameters = [container_name]
+        if prefix:
+            condition, prefix_parameters = self._get_prefix_condition(prefix)
+            conditions.append(condition)
+            parameters += prefix_parameters
+        if pattern is not None:
+            conditions.append("name GLOB ?")
+            parameters.append(pattern)
+        if min_size is not None:
+            conditions.append("size >= ?")
+            parameters.append(min_size)
+        if max_size is not None:
+            conditions.append("size <= ?")
+            parameters.append(max_size)
+        columns = "name, size, etag, last_modified, content_md5"
+        if not include_properties:
+            columns = "name"
+        with self._lock:
+            rows = self._connection.execute(
+                "SELECT {} FROM blobs WHERE {} ORDER BY name".format(
+                    columns, " AND ".join(conditions)
+                ),
+                parameters,
+            ).fetchall()
+        if not include_properties:
+            return [row[0] for row in rows]
+        return [self._get_blob_properties(*row) for row in rows]
+
+    @staticmethod
+    def _get_blob_properties(
+        name: str,
+        size: int,
+        etag: str,
+        last_modified: Optional[str],
+        content_md5: Optional[bytes],
+    ) -> BlobProperties:
+        """
+        Build the BlobProperties of an indexed blob
+
+        Args:
+            name: Name of the blob
+            size: size of the blob
+            etag: ETag of the blob
+            last_modified: ISO formatted last modification time
+            content_md5: MD5 of the blob content
+
+        Returns:
+
+        """
+        blob = BlobProperties()
+        blob.name = name
+        blob.size = size
+        blob.etag = etag
+        blob.last_modified = (
+            datetime.fromisoformat(last_modified) if last_modified else None
+        )
+        blob.content_settings.content_md5 = (
+            bytearray(content_md5) if content_md5 is not None else None
+        )
+        return blob
+
+    def update(self, container_name: str, blobs: Iterable[BlobProperties]):
+        """
+        Add written blobs to the index, or update their properties
+
+        Args:
+            container_name: Name of the container
+            blobs: BlobProperties of the written blobs
+
+        Returns:
+
+        """
+        rows = [self._get_row(container_name, blob) for blob in blobs]
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", rows
+            )
+
+    def update_written(
+        self, container_name: str, blob_name: str, size: int, response: Dict
+    ):
+        """
+        Add a written blob to the index, or update its properties, from the response of its upload
+
+        No request is needed. The Content-MD5 of the blob is left unknown, as in listings of blobs committed
+        as blocks.
+
+        Args:
+            container_name: Name of the container
+            blob_name: Name of the blob
+            size: size of the written blob
+            response: response of the upload or of the block list commit, with etag & last_modified
+
+        Returns:
+
+        """
+        row = (
+            container_name,
+            blob_name,
+            size,
+            # Listings return ETags without the quotes of the ETag header
+            response["etag"].strip('"'),
+            response["last_modified"].isoformat(),
+            None,
+        )
+        with self._lock, self._connection:
+            self._connection.execute(
+                "INSERT OR REPLACE INTO blobs VALUES (?, ?, ?, ?, ?, ?)", row
+            )
+
+    def remove(self, container_name: str, blob_names: Iterable[str]):
+        """
+        Remove deleted blobs from the index
+
+        Args:
+            container_name: Name of the container
+            blob_names: Names of the deleted blobs
+
+        Returns:
+
+        """
+        with self._lock, self._connection:
+            self._connection.executemany(
+                "DELETE FROM blobs WHERE container = ? AND name = ?",
+                ((container_name, blob_name) for blob_name in blob_names),
+            )
+
+    def clear(self, container_name: Optional[str] = None):
+        """
+        Remove a container from the index
+
+        Args:
+            container_name: Name of the container. If None, the whole index is cleared
+
+        Returns:
+
+        """
+        with self._lock, self._connection:
+            if container_name is None:
+                self._connection.execute("DELETE FROM blobs")
+                self._connection.execute("DELETE FROM prefixes")
+            else:
+                self._connection.execute(
+                    "DELETE FROM blobs WHERE container = ?", (container_name,)
+                )
+                self._connection.execute(
+                    "DELETE FROM prefixes WHERE container = ?", (container_name,)
+                )
+
+    def close(self):
+        """
+        Close the database
+
+        Returns:
+
+        """
+        with self._lock:
+            self._connection.close()
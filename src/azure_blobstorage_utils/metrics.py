@@ -0,0 +1,474 @@
+import asyncio
+import bisect
+import contextlib
+import contextvars
+import functools
+import inspect
+import logging
+import threading
+import time
+import weakref
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple, Union
+
+logger = logging.getLogger(__name__)
+
+# Upper bounds in seconds of the latency histogram buckets, the last one catches everything
+LATENCY_BUCKETS = (
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+    60.0,
+    float("inf"),
+)
+
+# Operation measured in the current thread or task, fed by the responses of its requests
+_current_operation = contextvars.ContextVar(
+    "azure_blobstorage_utils_operation", default=None
+)
+
+
+class OperationRecord:
+    def __init__(
+        self, operation: str, container_name: Optional[str], blob_name: Optional[str]
+    ):
+        """
+        Measures of one operation (eg. a download_file call), given to the observers when it ends
+
+        Attributes:
+            operation: name of the operation ("download", "upload" or "delete")
+            container_name: Name of the container
+            blob_name: Name of the blob, None for operations on several blobs
+            bytes_sent: bytes of the request bodies
+            bytes_received: bytes of the response bodies
+            requests: number of requests sent, retries included
+            retries: number of requests sent again by the retry policy of the SDK, after their first attempt
+            status_code: HTTP status of the last response, None if no request was sent (eg. read from cache)
+            latency: seconds taken by the operation
+            error: exception raised by the operation, None if it succeeded
+
+        Args:
+            operation: name of the operation
+            container_name: Name of the container
+            blob_name: Name of the blob
+        """
+        self.operation = operation
+        self.container_name = container_name
+        self.blob_name = blob_name
+        self.bytes_sent = 0
+        self.bytes_received = 0
+        self.requests = 0
+        self.retries = 0
+        self.status_code = None
+        self.latency = None
+        self.error = None
+        self._lock = threading.Lock()
+        # The attempts of a request retried by the SDK share the same HttpRequest
+        self._attempted = weakref.WeakSet()
+
+    @property
+    def bytes(self) -> int:
+        """
+        Bytes transferred in both directions
+
+        Returns:
+
+        """
+        return self.bytes_sent + self.bytes_received
+
+    def on_response(self, response):
+        """
+        Add a response of the service to the operation
+
+        Args:
+            response: azure.core PipelineResponse
+
+        Returns:
+
+        """
+        http_request = response.http_request
+        http_response = response.http_response
+        sent = int(http_request.headers.get("Content-Length") or 0)
+        received = 0
+        if http_request.method != "HEAD":
+            # A HEAD response has the Content-Length of the blob, without its body
+            received = int(http_response.headers.get("Content-Length") or 0)
+        with self._lock:
+            self.requests += 1
+            if http_request in self._attempted:
+                self.retries += 1
+            else:
+                self._attempted.add(http_request)
+            self.status_code = http_response.status_code
+            self.bytes_sent += sent
+            self.bytes_received += received
+
+
+class BlobObserver:
+    """
+    Base class of the observers given to the sync & async classes, override on_operation to receive measures
+    """
+
+    def on_operation(self, record: OperationRecord):
+        """
+        Called when an operation ends, in the thread or task that ran it
+
+        Args:
+            record: measures of the operation
+
+        Returns:
+
+        """
+
+
+class CallbackObserver(BlobObserver):
+    def __init__(self, callback: Callable[[OperationRecord], None]):
+        """
+        Observer calling a function with the record of each operation
+
+        Args:
+            callback: function called with each OperationRecord
+        """
+        self.callback = callback
+
+    def on_operation(self, record: OperationRecord):
+        self.callback(record)
+
+
+class MetricsCollector(BlobObserver):
+    def __init__(self, buckets: Optional[Tuple[float, ...]] = LATENCY_BUCKETS):
+        """
+        Observer aggregating counters & latency histograms per operation, in memory
+
+        Args:
+            buckets: increasing upper bounds in seconds of the latency histogram buckets, ending with inf
+        """
+        self.buckets = tuple(buckets)
+        self._lock = threading.Lock()
+        self._counters = {}
+        self._histograms = {}
+
+    def on_operation(self, record: OperationRecord):
+        bucket = bisect.bisect_left(self.buckets, record.latency)
+        with self._lock:
+            counters = self._counters.setdefault(
+                record.operation,
+                {
+                    "operations": 0,
+                    "errors": 0,
+                    "requests": 0,
+                    "retries": 0,
+                    "bytes_sent": 0,
+                    "bytes_received": 0,
+                },
+            )
+            counters["operations"] += 1
+            counters["errors"] += record.error is not None
+            counters["requests"] += record.requests
+            counters["retries"] += record.retries
+            counters["bytes_sent"] += record.bytes_sent
+            counters["bytes_received"] += record.bytes_received
+            histogram = self._histograms.setdefault(
+                record.operation, [0] * len(self.buckets)
+            )
+            histogram[min(bucket, len(self.buckets) - 1)] += 1
+
+    def get_counters(self) -> Dict[str, Dict[str, int]]:
+        """
+        Get the counters of each operation
+
+        Returns: a dict {operation: {"operations", "errors", "requests", "retries", "bytes_sent",
+            "bytes_received"}}
+
+        """
+        with self._lock:
+            return {
+                operation: dict(counters)
+                for operation, counters in self._counters.items()
+            }
+
+    def get_histogram(self, operation: str) -> List[Tuple[float, int]]:
+        """
+        Get the latency histogram of an operation
+
+        Args:
+            operation: name of the operation
+
+        Returns: a list of (upper bound in seconds, number of operations in the bucket)
+
+        """
+        with self._lock:
+            counts = list(self._histograms.get(operation, [0] * len(self.buckets)))
+        return list(zip(self.buckets, counts))
+
+    def get_latency_quantile(self, operation: str, quantile: float) -> Optional[float]:
+        """
+        Estimate a latency quantile of an operation from its histogram, interpolating within buckets
+
+        Args:
+            operation: name of the operation
+            quantile: quantile between 0 and 1 (eg. 0.99)
+
+        Returns: latency in seconds, None if the operation was not observed
+
+        """
+        histogram = self.get_histogram(operation)
+        total = sum(count for _, count in histogram)
+        if total == 0:
+            return None
+        rank = quantile * total
+        lower, seen = 0.0, 0
+        for upper, count in histogram:
+            if count and seen + count >= rank:
+                if upper == float("inf"):
+                    # Nothing is known above the last finite bound
+                    return lower
+                return lower + (upper - lower) * (rank - seen) / count
+            lower, seen = upper, seen + count
+        return lower
+
+    def reset(self):
+        """
+        Reset all counters & histograms
+
+        Returns:
+
+        """
+        with self._lock:
+            self._counters = {}
+            self._histograms = {}
+
+
+class PrometheusObserver(BlobObserver):
+    def __init__(
+        self,
+        registry=None,
+        namespace: Optional[str] = "azure_blobstorage",
+        buckets: Optional[Tuple[float, ...]] = LATENCY_BUCKETS,
+    ):
+        """
+        Observer exporting operations to prometheus_client metrics, labelled by operation, container & status
+
+        Blob names are not used as labels, to keep the number of series bounded.
+
+        Args:
+            registry: prometheus_client CollectorRegistry, defaults to the global registry
+            namespace: prefix of the metric names
+            buckets: upper bounds in seconds of the latency histogram buckets
+        """
+        try:
+            import prometheus_client
+        except ImportError as e:
+            raise ImportError(
+                "PrometheusObserver requires prometheus_client: pip install prometheus-client"
+            ) from e
+        kwargs = {"namespace": namespace}
+        if registry is not None:
+            kwargs["registry"] = registry
+        labels = ("operation", "container", "status")
+        self.operations = prometheus_client.Counter(
+            "operations_total", "Number of operations", labels, **kwargs
+        )
+        self.retries = prometheus_client.Counter(
+            "retries_total", "Number of requests retried", labels, **kwargs
+        )
+        self.bytes = prometheus_client.Counter(
+            "bytes_total",
+            "Bytes transferred",
+            labels + ("direction",),
+            **kwargs,
+        )
+        self.latency = prometheus_client.Histogram(
+            "operation_latency_seconds",
+            "Latency of operations",
+            labels,
+            buckets=buckets,
+            **kwargs,
+        )
+
+    def on_operation(self, record: OperationRecord):
+        labels = (
+            record.operation,
+            record.container_name or "",
+            "error" if record.error is not None else str(record.status_code or ""),
+        )
+        self.operations.labels(*labels).inc()
+        self.retries.labels(*labels).inc(record.retries)
+        self.bytes.labels(*labels, "sent").inc(record.bytes_sent)
+        self.bytes.labels(*labels, "received").inc(record.bytes_received)
+        self.latency.labels(*labels).observe(record.latency)
+
+
+class OpenTelemetryObserver(BlobObserver):
+    def __init__(self, meter=None):
+        """
+        Observer exporting operations to OpenTelemetry metrics, with operation, container & status attributes
+
+        Args:
+            meter: opentelemetry Meter, defaults to a meter of the global MeterProvider
+        """
+        try:
+            from opentelemetry import metrics
+        except ImportError as e:
+            raise ImportError(
+                "OpenTelemetryObserver requires opentelemetry-api: pip install opentelemetry-api"
+            ) from e
+        meter = meter or metrics.get_meter(__name__)
+        self.operations = meter.create_counter(
+            "azure_blobstorage.operations", description="Number of operations"
+        )
+        self.retries = meter.create_counter(
+            "azure_blobstorage.retries", description="Number of requests retried"
+        )
+        self.bytes = meter.create_counter(
+            "azure_blobstorage.bytes", unit="By", description="Bytes transferred"
+        )
+        self.latency = meter.create_histogram(
+            "azure_blobstorage.operation.duration",
+            unit="s",
+            description="Latency of operations",
+        )
+
+    def on_operation(self, record: OperationRecord):
+        attributes = {
+            "operation": record.operation,
+            "container": record.container_name or "",
+            "status": (
+                "error" if record.error is not None else str(record.status_code or "")
+            ),
+        }
+        self.operations.add(1, attributes)
+        self.retries.add(record.retries, attributes)
+        self.bytes.add(record.bytes_sent, dict(attributes, direction="sent"))
+        self.bytes.add(record.bytes_received, dict(attributes, direction="received"))
+        self.latency.record(record.latency, attributes)
+
+
+def observe_response(response):
+    """
+    Add a response to the operation measured in the current thread or task, if any
+
+    Args:
+        response: azure.core PipelineResponse
+
+    Returns:
+
+    """
+    record = _current_operation.get()
+    if record is not None:
+        record.on_response(response)
+
+
+def bind_context(func: Callable) -> Callable:
+    """
+    Bind func to the context of the caller, so that requests sent from a thread pool are measured with the
+    operation that submitted them
+
+    Args:
+        func: function run on a thread pool
+
+    Returns:
+
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        # A context can only be entered by one thread at a time
+        return context.copy().run(func, *args, **kwargs)
+
+    return wrapper
+
+
+@contextlib.contextmanager
+def _measure(
+    record: OperationRecord, observers: List[BlobObserver]
+) -> Iterator[OperationRecord]:
+    """
+    Measure an operation run in the block, then give its record to the observers
+
+    Args:
+        record: record of the operation
+        observers: observers receiving the record
+
+    Returns:
+
+    """
+    token = _current_operation.set(record)
+    start = time.perf_counter()
+    try:
+        yield record
+    except Exception as e:
+        record.error = e
+        raise
+    finally:
+        record.latency = time.perf_counter() - start
+        _current_operation.reset(token)
+        for observer in observers:
+            try:
+                observer.on_operation(record)
+            except Exception:
+                logger.exception("Observer %r failed", observer)
+
+
+def instrumented(
+    operation: str,
+    blob_arguments: Optional[Union[str, Iterable[str]]] = "remote_file_name",
+) -> Callable:
+    """
+    Decorator measuring calls of a sync or async method of a class having an observers attribute
+
+    Args:
+        operation: name of the operation
+        blob_arguments: name of the argument holding the blob name, or names tried in order. None for
+            operations on several blobs
+
+    Returns:
+
+    """
+    if isinstance(blob_arguments, str):
+        blob_arguments = (blob_arguments,)
+    blob_arguments = tuple(blob_arguments or ())
+
+    def decorator(method: Callable) -> Callable:
+        signature = inspect.signature(method)
+
+        def _get_record(args, kwargs) -> OperationRecord:
+            arguments = signature.bind_partial(*args, **kwargs).arguments
+            blob_name = next(
+                (arguments[name] for name in blob_arguments if arguments.get(name)),
+                None,
+            )
+            return OperationRecord(
+                operation, arguments.get("container_name"), blob_name
+            )
+
+        if asyncio.iscoroutinefunction(method):
+
+            @functools.wraps(method)
+            async def async_wrapper(self, *args, **kwargs):
+                if not self.observers:
+                    return await method(self, *args, **kwargs)
+                with _measure(_get_record((self,) + args, kwargs), self.observers):
+                    return await method(self, *args, **kwargs)
+
+            return async_wrapper
+
+        @functools.wraps(method)
+        def wrapper(self, *args, **kwargs):
+            if not self.observers:
+                return method(self, *args, **kwargs)
+            with _measure(_get_record((self,) + args, kwargs), self.observers):
+                return method(self, *args, **kwargs)
+
+        return wrapper
+
+    return decorator
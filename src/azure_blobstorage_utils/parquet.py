@@ -0,0 +1,223 @@
+import io
+from typing import Any, Dict, List, Optional, Tuple
+
+import pandas as pd
+import pyarrow.parquet as pq
+
+# Reading the end of the file usually gets the whole footer in one request
+PARQUET_FOOTER_READ_SIZE = 64 * 1024
+# Column chunks separated by less than this are fetched in one request
+PARQUET_RANGE_COALESCE_GAP = 64 * 1024
+
+
+def is_parquet_projection(kwargs: Dict) -> bool:
+    """
+    Check if pd.read_parquet kwargs only ask for columns and a conjunction of filters, which
+    can be applied to the row groups of a parquet file without downloading the whole file
+
+    Args:
+        kwargs: kwargs given to pd.read_parquet
+
+    Returns:
+
+    """
+    filters = kwargs.get("filters")
+    return (
+        len(kwargs) > 0
+        and set(kwargs) <= {"columns", "filters"}
+        and (
+            filters is None
+            or all(isinstance(f, tuple) and len(f) == 3 for f in filters)
+        )
+    )
+
+
+def get_columns_to_read(
+    columns: Optional[List[str]], filters: Optional[List[Tuple[str, str, Any]]]
+) -> Optional[List[str]]:
+    """
+    Get the columns needed to apply filters and return columns
+
+    Args:
+        columns: columns to return, None for all columns
+        filters: list of (column, operator, value) predicates
+
+    Returns: None for all columns
+
+    """
+    if columns is None:
+        return None
+    columns_to_read = list(columns)
+    for column, _, _ in filters or []:
+        if column not in columns_to_read:
+            columns_to_read.append(column)
+    return columns_to_read
+
+
+def _row_group_may_match(
+    row_group: pq.RowGroupMetaData, filters: List[Tuple[str, str, Any]]
+) -> bool:
+    """
+    Check with its statistics if a row group may contain rows matching all filters
+
+    Args:
+        row_group: metadata of the row group
+        filters: list of (column, operator, value) predicates
+
+    Returns: False only if the statistics prove that no row matches
+
+    """
+    statistics = {}
+    for i in range(row_group.num_columns):
+        column = row_group.column(i)
+        if column.is_stats_set and column.statistics.has_min_max:
+            statistics[column.path_in_schema] = (
+                column.statistics.min,
+                column.statistics.max,
+            )
+    for column, op, value in filters:
+        if column not in statistics:
+            continue
+        low, high = statistics[column]
+        try:
+            if op in ("=", "=="):
+                match = low <= value <= high
+            elif op == "!=":
+                match = not (low == high == value)
+            elif op == "<":
+                match = low < value
+            elif op == "<=":
+                match = low <= value
+            elif op == ">":
+                match = high > value
+            elif op == ">=":
+                match = high >= value
+            elif op == "in":
+                match = any(low <= v <= high for v in value)
+            else:
+                # eg. "not in": the statistics can't exclude the row group
+                match = True
+        except TypeError:
+            # Statistics of a type not comparable with value
+            match = True
+        if not match:
+            return False
+    return True
+
+
+def plan_parquet_read(
+    metadata: pq.FileMetaData,
+    columns: Optional[List[str]],
+    filters: Optional[List[Tuple[str, str, Any]]],
+) -> Tuple[List[int], List[Tuple[int, int]]]:
+    """
+    Select row groups with their statistics & compute the byte ranges of the needed column chunks
+
+    Args:
+        metadata: metadata of the parquet file
+        columns: columns to read, None for all columns
+        filters: list of (column, operator, value) predicates
+
+    Returns: indices of the selected row groups, coalesced (offset, length) ranges to fetch
+
+    """
+    if filters:
+        # Invalid filters fail before any column chunk is fetched
+        pq.filters_to_expression(filters)
+    row_groups = []
+    ranges = []
+    for i in range(metadata.num_row_groups):
+        row_group = metadata.row_group(i)
+        if filters and not _row_group_may_match(row_group, filters):
+            continue
+        row_groups.append(i)
+        for j in range(row_group.num_columns):
+            column = row_group.column(j)
+            path = column.path_in_schema
+            if columns is not None and not any(
+                path == c or path.startswith(c + ".") for c in columns
+            ):
+                continue
+            if column.has_dictionary_page and column.dictionary_page_offset:
+                offset = column.dictionary_page_offset
+            else:
+                offset = column.data_page_offset
+            ranges.append((offset, column.total_compressed_size))
+
+    coalesced = []
+    for offset, length in sorted(ranges):
+        if coalesced:
+            last_offset, last_length = coalesced[-1]
+            if offset <= last_offset + last_length + PARQUET_RANGE_COALESCE_GAP:
+                end = max(last_offset + last_length, offset + length)
+                coalesced[-1] = (last_offset, end - last_offset)
+                continue
+        coalesced.append((offset, length))
+    return row_groups, coalesced
+
+
+def read_parquet_row_groups(
+    parquet_file,
+    metadata: pq.FileMetaData,
+    row_groups: List[int],
+    columns: Optional[List[str]],
+    filters: Optional[List[Tuple[str, str, Any]]],
+    **kwargs
+) -> pd.DataFrame:
+    """
+    Read row groups of a parquet file as a pandas DataFrame & apply filters to its rows
+
+    Filters & the index stored in the pandas metadata are applied as pd.read_parquet does.
+
+    Args:
+        parquet_file: file-like object over the parquet file
+        metadata: metadata of the parquet file
+        row_groups: indices of the row groups to read
+        columns: columns to return, None for all columns
+        filters: list of (column, operator, value) predicates
+        **kwargs: add any kwarg that you would put in pyarrow.Table.to_pandas.
+
+    Returns:
+
+    """
+    table = pq.ParquetFile(
+        parquet_file, metadata=metadata, pre_buffer=False
+    ).read_row_groups(
+        row_groups,
+        columns=get_columns_to_read(columns, filters),
+        use_pandas_metadata=True,
+    )
+    if filters:
+        table = table.filter(pq.filters_to_expression(filters))
+    df = table.to_pandas(**kwargs)
+    if columns is not None:
+        df = df[columns]
+    return df
+
+
+def read_parquet_bytes(
+    data: bytes,
+    columns: Optional[List[str]],
+    filters: Optional[List[Tuple[str, str, Any]]],
+    **kwargs
+) -> pd.DataFrame:
+    """
+    Read a parquet file held in memory as a pandas DataFrame, skipping the row groups excluded by filters
+
+    Args:
+        data: content of the parquet file
+        columns: columns to return, None for all columns
+        filters: list of (column, operator, value) predicates
+        **kwargs: add any kwarg that you would put in pyarrow.Table.to_pandas.
+
+    Returns:
+
+    """
+    parquet_file = io.BytesIO(data)
+    metadata = pq.read_metadata(parquet_file)
+    row_groups, _ = plan_parquet_read(
+        metadata, get_columns_to_read(columns, filters), filters
+    )
+    return read_parquet_row_groups(
+        parquet_file, metadata, row_groups, columns, filters, **kwargs
+    )
@@ -0,0 +1,821 @@
+import asyncio
+import base64
+import bisect
+import contextlib
+import io
+import uuid
+from collections import OrderedDict, deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import (
+    AsyncContextManager,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    ContextManager,
+    Dict,
+    Optional,
+    Tuple,
+)
+
+from azure.core import MatchConditions
+from azure.storage.blob import BlobBlock
+
+from .compression import get_compressor, get_content_settings
+from .metrics import bind_context
+
+MAX_BLOCK_COUNT = 50000
+
+
+class ChunkIteratorReader(io.RawIOBase):
+    def __init__(self, next_chunk: Callable[[], bytes]):
+        """
+        Read-only, non seekable file-like object over a sequence of chunks
+
+        Only the current chunk is held in memory, so parsers reading from it (eg. pandas in chunked mode)
+        consume a blob as it is downloaded.
+
+        Args:
+            next_chunk: returns the next chunk of data, or b"" once the data is exhausted
+        """
+        self._next_chunk = next_chunk
+        self._chunk = memoryview(b"")
+        self._exhausted = False
+
+    def readable(self) -> bool:
+        return True
+
+    def readinto(self, buffer) -> int:
+        """
+        Read bytes into a pre-allocated buffer
+
+        Args:
+            buffer: writable bytes-like object
+
+        Returns: number of bytes read, 0 at the end of the data
+
+        """
+        while not self._chunk and not self._exhausted:
+            chunk = self._next_chunk()
+            if chunk:
+                self._chunk = memoryview(chunk)
+            else:
+                self._exhausted = True
+        size = min(len(buffer), len(self._chunk))
+        buffer[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+
+class AsyncChunkIteratorReader:
+    def __init__(self, chunks: AsyncIterator[bytes]):
+        """
+        Read-only, non seekable async file-like object over an async iterator of chunks
+
+        Args:
+            chunks: async iterator of the chunks of data
+        """
+        self._chunks = chunks
+        self._buffer = bytearray()
+        self._exhausted = False
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        if not self.closed:
+            self.closed = True
+            await self._chunks.aclose()
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return False
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Read up to size bytes, fetching chunks as needed
+
+        Args:
+            size: number of bytes to read, -1 for all the remaining data
+
+        Returns: the data read, b"" at the end of the data
+
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed blob.")
+        while not self._exhausted and (size < 0 or len(self._buffer) < size):
+            try:
+                self._buffer += await self._chunks.__anext__()
+            except StopAsyncIteration:
+                self._exhausted = True
+        size = len(self._buffer) if size < 0 else size
+        data = bytes(self._buffer[:size])
+        del self._buffer[:size]
+        return data
+
+
+class CallbackWriter(io.RawIOBase):
+    def __init__(self, write: Callable[[bytes], None]):
+        """
+        Write-only, non seekable file-like object handing each write to a callback
+
+        Args:
+            write: called with the written data
+        """
+        self._write = write
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        data = bytes(data)
+        self._write(data)
+        return len(data)
+
+
+class _BlobBlocks:
+    def __init__(self, size: int, block_size: int, read_ahead: int, cache_blocks: int):
+        """
+        Small LRU cache of the fixed-size blocks of a blob, shared by the sync & async readers
+
+        Args:
+            size: size of the blob
+            block_size: size in bytes of a block
+            read_ahead: number of blocks fetched ahead of the current one during sequential reads
+            cache_blocks: number of blocks kept in memory
+        """
+        self.size = size
+        self.block_size = block_size
+        self.read_ahead = read_ahead
+        self.cache_blocks = max(cache_blocks, read_ahead + 1)
+        self._blocks = OrderedDict()
+        self._last_index = None
+        self._sequential = False
+
+    def get(self, index: int) -> Optional[bytes]:
+        """
+        Get a cached block
+
+        Args:
+            index: index of the block
+
+        Returns: the block, None if it must be fetched
+
+        """
+        if self._last_index is None:
+            self._sequential = index == 0
+        else:
+            self._sequential = index == self._last_index + 1
+        self._last_index = index
+        block = self._blocks.get(index)
+        if block is not None:
+            self._blocks.move_to_end(index)
+        return block
+
+    def get_range(self, index: int) -> Tuple[int, int]:
+        """
+        Get the byte range to fetch for a missing block, including read-ahead blocks on sequential reads
+
+        Args:
+            index: index of the missing block
+
+        Returns: offset, length
+
+        """
+        count = 1 + self.read_ahead if self._sequential else 1
+        offset = index * self.block_size
+        return offset, min(self.size, offset + count * self.block_size) - offset
+
+    def add(self, offset: int, data: bytes):
+        """
+        Split fetched data into blocks and cache them
+
+        Args:
+            offset: offset of data in the blob, aligned on block_size
+            data: fetched data
+
+        Returns:
+
+        """
+        for start in range(0, len(data), self.block_size):
+            index = (offset + start) // self.block_size
+            self._blocks[index] = data[start : start + self.block_size]
+            self._blocks.move_to_end(index)
+        while len(self._blocks) > self.cache_blocks:
+            self._blocks.popitem(last=False)
+
+    def get_position(self, position: int, offset: int, whence: int) -> int:
+        """
+        Compute the new position of a seek
+
+        Args:
+            position: current position
+            offset: seek offset
+            whence: io.SEEK_SET, io.SEEK_CUR or io.SEEK_END
+
+        Returns:
+
+        """
+        if whence == io.SEEK_SET:
+            new_position = offset
+        elif whence == io.SEEK_CUR:
+            new_position = position + offset
+        elif whence == io.SEEK_END:
+            new_position = self.size + offset
+        else:
+            raise ValueError("Invalid whence ({}).".format(whence))
+        if new_position < 0:
+            raise ValueError("Negative seek position {}.".format(new_position))
+        return new_position
+
+
+class BlobReader(io.RawIOBase):
+    def __init__(
+        self,
+        blob_client,
+        size: int,
+        etag: str,
+        block_size: int,
+        read_ahead: int,
+        cache_blocks: int,
+    ):
+        """
+        Seekable read-only file-like object over a blob, served by HTTP range requests
+
+        Use BlobStorageBase.open_blob to get one.
+
+        Args:
+            blob_client: client of the blob
+            size: size of the blob
+            etag: ETag of the blob, all ranges are read from this version
+            block_size: size in bytes of each range request
+            read_ahead: number of blocks fetched ahead of the current one during sequential reads
+            cache_blocks: number of blocks kept in memory
+        """
+        self._blob_client = blob_client
+        self._conditions = {
+            "etag": etag,
+            "match_condition": MatchConditions.IfNotModified,
+        }
+        self._blocks = _BlobBlocks(size, block_size, read_ahead, cache_blocks)
+        self._position = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._position = self._blocks.get_position(self._position, offset, whence)
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        """
+        Read bytes into a pre-allocated buffer, from the block at the current position
+
+        Args:
+            buffer: writable bytes-like object
+
+        Returns: number of bytes read, 0 at the end of the blob
+
+        """
+        if self._position >= self._blocks.size:
+            return 0
+        index = self._position // self._blocks.block_size
+        block = self._blocks.get(index)
+        if block is None:
+            offset, length = self._blocks.get_range(index)
+            data = self._blob_client.download_blob(
+                offset=offset, length=length, **self._conditions
+            ).readall()
+            self._blocks.add(offset, data)
+            block = data[: self._blocks.block_size]
+        start = self._position - index * self._blocks.block_size
+        size = min(len(buffer), len(block) - start)
+        buffer[:size] = block[start : start + size]
+        self._position += size
+        return size
+
+
+class AsyncBlobReader:
+    def __init__(
+        self,
+        blob_client,
+        size: int,
+        etag: str,
+        block_size: int,
+        read_ahead: int,
+        cache_blocks: int,
+    ):
+        """
+        Seekable read-only async file-like object over a blob, served by HTTP range requests
+
+        Use BlobStorageBaseAsync.open_blob to get one.
+
+        Args:
+            blob_client: async client of the blob
+            size: size of the blob
+            etag: ETag of the blob, all ranges are read from this version
+            block_size: size in bytes of each range request
+            read_ahead: number of blocks fetched ahead of the current one during sequential reads
+            cache_blocks: number of blocks kept in memory
+        """
+        self._blob_client = blob_client
+        self._conditions = {
+            "etag": etag,
+            "match_condition": MatchConditions.IfNotModified,
+        }
+        self._blocks = _BlobBlocks(size, block_size, read_ahead, cache_blocks)
+        self._position = 0
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *args):
+        await self.close()
+
+    async def close(self):
+        self.closed = True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        self._position = self._blocks.get_position(self._position, offset, whence)
+        return self._position
+
+    async def read(self, size: int = -1) -> bytes:
+        """
+        Read up to size bytes from the current position
+
+        Args:
+            size: number of bytes to read, -1 reads until the end of the blob
+
+        Returns:
+
+        """
+        if size is None or size < 0:
+            size = self._blocks.size - self._position
+        chunks = []
+        while size > 0 and self._position < self._blocks.size:
+            index = self._position // self._blocks.block_size
+            block = self._blocks.get(index)
+            if block is None:
+                offset, length = self._blocks.get_range(index)
+                stream = await self._blob_client.download_blob(
+                    offset=offset, length=length, **self._conditions
+                )
+                data = await stream.readall()
+                self._blocks.add(offset, data)
+                block = data[: self._blocks.block_size]
+            start = self._position - index * self._blocks.block_size
+            chunk = block[start : start + size]
+            chunks.append(chunk)
+            self._position += len(chunk)
+            size -= len(chunk)
+        return b"".join(chunks)
+
+
+class SparseBlobFile(io.RawIOBase):
+    def __init__(self, size: int, fetch: Callable[[int, int], bytes]):
+        """
+        Seekable read-only file-like object over a blob of which some ranges were fetched beforehand
+
+        Reads inside prefetched ranges are served from memory, other reads call fetch.
+
+        Args:
+            size: size of the blob
+            fetch: returns length bytes of the blob starting at offset, called as fetch(offset, length)
+        """
+        self.size = size
+        self._fetch = fetch
+        self._starts = []
+        self._ranges = {}
+        self._position = 0
+
+    def add(self, offset: int, data: bytes):
+        """
+        Add a prefetched range
+
+        Args:
+            offset: offset of data in the blob
+            data: content of the range
+
+        Returns:
+
+        """
+        if offset not in self._ranges:
+            bisect.insort(self._starts, offset)
+        self._ranges[offset] = data
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._position
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_SET:
+            self._position = offset
+        elif whence == io.SEEK_CUR:
+            self._position += offset
+        elif whence == io.SEEK_END:
+            self._position = self.size + offset
+        else:
+            raise ValueError("Invalid whence ({}).".format(whence))
+        return self._position
+
+    def readinto(self, buffer) -> int:
+        """
+        Read bytes into a pre-allocated buffer, filling it unless the end of the blob is reached
+
+        Args:
+            buffer: writable bytes-like object
+
+        Returns: number of bytes read, 0 at the end of the blob
+
+        """
+        buffer = memoryview(buffer).cast("B")
+        read = 0
+        while read < len(buffer) and self._position < self.size:
+            wanted = min(len(buffer) - read, self.size - self._position)
+            i = bisect.bisect_right(self._starts, self._position) - 1
+            start = self._starts[i] if i >= 0 else None
+            if start is not None and self._position < start + len(self._ranges[start]):
+                data = self._ranges[start]
+                chunk = data[self._position - start : self._position - start + wanted]
+            else:
+                # Fetch up to the next prefetched range
+                if i + 1 < len(self._starts):
+                    wanted = min(wanted, self._starts[i + 1] - self._position)
+                chunk = self._fetch(self._position, wanted)
+                if not chunk:
+                    break
+            buffer[read : read + len(chunk)] = chunk
+            read += len(chunk)
+            self._position += len(chunk)
+        return read
+
+
+class _StagedBlocks:
+    def __init__(
+        self, overwrite: bool, block_size: int, content_encoding: Optional[str] = None
+    ):
+        """
+        Buffer and block list of a blob being written, shared by the sync & async writers
+
+        Args:
+            overwrite: if False, the commit fails when the blob already exists
+            block_size: size in bytes of each staged block
+            content_encoding: if set ("gzip" or "zstd"), written data is compressed before being buffered
+        """
+        if block_size <= 0:
+            raise ValueError("block_size must be positive, got {}.".format(block_size))
+        self.block_size = block_size
+        self.conditions = (
+            {} if overwrite else {"match_condition": MatchConditions.IfMissing}
+        )
+        self.content_settings = get_content_settings(content_encoding)
+        self._compressor = (
+            None if content_encoding is None else get_compressor(content_encoding)
+        )
+        # Block ids are unique to this writer so that concurrent writers of a blob don't mix their blocks
+        self._prefix = uuid.uuid4().hex
+        self._buffer = bytearray()
+        self.block_ids = []
+        # Size of the blob once committed
+        self.size = 0
+
+    def add(self, data) -> int:
+        """
+        Append written data to the buffer
+
+        Args:
+            data: bytes-like object
+
+        Returns: number of bytes added
+
+        """
+        if self._compressor is None:
+            self._buffer += data
+        else:
+            self._buffer += self._compressor.compress(data)
+        return len(data)
+
+    def pop(self, final: bool = False) -> Optional[Tuple[str, bytes]]:
+        """
+        Take the next block to stage out of the buffer
+
+        Args:
+            final: if True, a partial block is returned as well
+
+        Returns: block id, data or None if there is no block to stage
+
+        """
+        if final and self._compressor is not None:
+            self._buffer += self._compressor.flush()
+            self._compressor = None
+        if len(self._buffer) < self.block_size and not (final and self._buffer):
+            return None
+        if len(self.block_ids) >= MAX_BLOCK_COUNT:
+            raise ValueError(
+                "block_size {} is too small: a blob has at most {} blocks.".format(
+                    self.block_size, MAX_BLOCK_COUNT
+                )
+            )
+        data = bytes(self._buffer[: self.block_size])
+        del self._buffer[: self.block_size]
+        self.size += len(data)
+        block_id = base64.b64encode(
+            "{}-{:08d}".format(self._prefix, len(self.block_ids)).encode()
+        ).decode()
+        self.block_ids.append(block_id)
+        return block_id, data
+
+    def get_block_list(self):
+        return [BlobBlock(block_id=block_id) for block_id in self.block_ids]
+
+
+class BlobWriter(io.RawIOBase):
+    def __init__(
+        self,
+        blob_client,
+        overwrite: bool,
+        block_size: int,
+        max_concurrency: int,
+        on_commit: Optional[Callable[[Dict, int], None]] = None,
+        content_encoding: Optional[str] = None,
+        slot: Optional[Callable[[], ContextManager]] = None,
+    ):
+        """
+        Write-only, non seekable file-like object to a blob
+
+        Written data is staged as blocks of block_size bytes once the buffer fills, and the block list is
+        committed on close, so memory is bounded by block_size * (max_concurrency + 1). Nothing is committed
+        if the writer is left by an exception in a with block, or garbage collected without being closed.
+        Use BlobStorageBase.open_blob to get one.
+
+        Args:
+            blob_client: client of the blob
+            overwrite: if False, the commit fails when the blob already exists
+            block_size: size in bytes of each staged block
+            max_concurrency: number of blocks staged at the same time
+            on_commit: called with the response of the commit & the size of the blob once the block list is
+                committed
+            content_encoding: if set ("gzip" or "zstd"), data is compressed as it is written and the blob is
+                committed with this Content-Encoding
+            slot: if set, each block is staged within the context manager it returns (eg. a governor slot)
+        """
+        self._blob_client = blob_client
+        self._blocks = _StagedBlocks(overwrite, block_size, content_encoding)
+        self._max_concurrency = max(max_concurrency, 1)
+        self._on_commit = on_commit
+        self._slot = slot or contextlib.nullcontext
+        self._executor = (
+            ThreadPoolExecutor(max_workers=self._max_concurrency)
+            if self._max_concurrency > 1
+            else None
+        )
+        self._pending = deque()
+        self._aborted = False
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, data) -> int:
+        """
+        Write data, staging the blocks that are full
+
+        Args:
+            data: bytes-like object
+
+        Returns: number of bytes written
+
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed blob.")
+        size = self._blocks.add(data)
+        self._stage_blocks()
+        return size
+
+    def _stage_blocks(self, final: bool = False):
+        """
+        Stage the blocks that are ready, waiting for the oldest ones to keep max_concurrency in flight
+
+        Args:
+            final: if True, the remaining partial block is staged as well and all blocks are awaited
+
+        Returns:
+
+        """
+        block = self._blocks.pop(final)
+        while block is not None:
+            if self._executor is None:
+                self._stage_block(*block)
+            else:
+                while len(self._pending) >= self._max_concurrency:
+                    self._pending.popleft().result()
+                self._pending.append(
+                    self._executor.submit(bind_context(self._stage_block), *block)
+                )
+            block = self._blocks.pop(final)
+        if final:
+            while self._pending:
+                self._pending.popleft().result()
+
+    def _stage_block(self, block_id: str, data: bytes):
+        with self._slot():
+            self._blob_client.stage_block(block_id, data)
+
+    def abort(self):
+        """
+        Close the writer without committing, the blob is left unchanged
+
+        Returns:
+
+        """
+        self._aborted = True
+        self.close()
+
+    def close(self):
+        """
+        Stage the remaining data and commit the block list
+
+        Returns:
+
+        """
+        if self.closed:
+            return
+        try:
+            if not self._aborted:
+                self._stage_blocks(final=True)
+                response = self._blob_client.commit_block_list(
+                    self._blocks.get_block_list(),
+                    content_settings=self._blocks.content_settings,
+                    **self._blocks.conditions
+                )
+                if self._on_commit is not None:
+                    self._on_commit(response, self._blocks.size)
+        finally:
+            if self._executor is not None:
+                self._executor.shutdown(wait=True)
+            super().close()
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
+
+    def __del__(self):
+        if not self.closed:
+            self.abort()
+
+
+class AsyncBlobWriter:
+    def __init__(
+        self,
+        blob_client,
+        overwrite: bool,
+        block_size: int,
+        max_concurrency: int,
+        on_commit: Optional[Callable[[Dict, int], Awaitable[None]]] = None,
+        content_encoding: Optional[str] = None,
+        slot: Optional[Callable[[], AsyncContextManager]] = None,
+    ):
+        """
+        Write-only, non seekable async file-like object to a blob
+
+        Written data is staged as blocks of block_size bytes once the buffer fills, and the block list is
+        committed on close, so memory is bounded by block_size * (max_concurrency + 1). Nothing is committed
+        if the writer is left by an exception in an async with block. Use BlobStorageBaseAsync.open_blob to
+        get one.
+
+        Args:
+            blob_client: async client of the blob
+            overwrite: if False, the commit fails when the blob already exists
+            block_size: size in bytes of each staged block
+            max_concurrency: number of blocks staged at the same time
+            on_commit: coroutine function awaited with the response of the commit & the size of the blob once
+                the block list is committed
+            content_encoding: if set ("gzip" or "zstd"), data is compressed as it is written and the blob is
+                committed with this Content-Encoding
+            slot: if set, each block is staged within the async context manager it returns (eg. a governor
+                slot)
+        """
+        self._blob_client = blob_client
+        self._blocks = _StagedBlocks(overwrite, block_size, content_encoding)
+        self._max_concurrency = max(max_concurrency, 1)
+        self._on_commit = on_commit
+        self._slot = slot
+        self._pending = deque()
+        self.closed = False
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            await self.abort()
+        else:
+            await self.close()
+
+    def writable(self) -> bool:
+        return True
+
+    async def write(self, data) -> int:
+        """
+        Write data, staging the blocks that are full
+
+        Args:
+            data: bytes-like object
+
+        Returns: number of bytes written
+
+        """
+        if self.closed:
+            raise ValueError("I/O operation on closed blob.")
+        size = self._blocks.add(data)
+        await self._stage_blocks()
+        return size
+
+    async def _stage_blocks(self, final: bool = False):
+        """
+        Stage the blocks that are ready, waiting for the oldest ones to keep max_concurrency in flight
+
+        Args:
+            final: if True, the remaining partial block is staged as well and all blocks are awaited
+
+        Returns:
+
+        """
+        block = self._blocks.pop(final)
+        while block is not None:
+            while len(self._pending) >= self._max_concurrency:
+                await self._pending.popleft()
+            self._pending.append(asyncio.ensure_future(self._stage_block(*block)))
+            block = self._blocks.pop(final)
+        if final:
+            while self._pending:
+                await self._pending.popleft()
+
+    async def _stage_block(self, block_id: str, data: bytes):
+        if self._slot is None:
+            await self._blob_client.stage_block(block_id, data)
+        else:
+            async with self._slot():
+                await self._blob_client.stage_block(block_id, data)
+
+    async def abort(self):
+        """
+        Close the writer without committing, the blob is left unchanged
+
+        Returns:
+
+        """
+        if self.closed:
+            return
+        self.closed = True
+        for task in self._pending:
+            task.cancel()
+        await asyncio.gather(*self._pending, return_exceptions=True)
+        self._pending.clear()
+
+    async def close(self):
+        """
+        Stage the remaining data and commit the block list
+
+        Returns:
+
+        """
+        if self.closed:
+            return
+        try:
+            await self._stage_blocks(final=True)
+            response = await self._blob_client.commit_block_list(
+                self._blocks.get_block_list(),
+                content_settings=self._blocks.content_settings,
+                **self._blocks.conditions
+            )
+        except BaseException:
+            await self.abort()
+            raise
+        self.closed = True
+        if self._on_commit is not None:
+            await self._on_commit(response, self._blocks.size)
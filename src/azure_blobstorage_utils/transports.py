@@ -0,0 +1,121 @@
+from typing import Optional
+
+import aiohttp
+import requests
+from azure.core.pipeline.transport import AioHttpTransport, RequestsTransport
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+
+class _LargeBlockHTTPAdapter(HTTPAdapter):
+    """
+    HTTPAdapter whose connections send bodies by blocks of 32 KiB, like the adapter of azure-core
+    """
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs["blocksize"] = 32768
+        super().init_poolmanager(*args, **kwargs)
+
+
+class PooledRequestsTransport(RequestsTransport):
+    def __init__(
+        self,
+        pool_size: Optional[int] = 10,
+        keep_alive: Optional[bool] = True,
+        use_env_settings: Optional[bool] = True,
+        **kwargs
+    ):
+        """
+        Sync HTTP transport with a connection pool of pool_size connections per host
+
+        The default pool of requests keeps 10 connections: beyond 10 threads, connections are opened and
+        discarded for each request. The session is created here and closed with the transport, a closed
+        transport can't be opened again.
+
+        Args:
+            pool_size: maximum number of connections kept open per host
+            keep_alive: if False, connections are closed after each request
+            use_env_settings: if True, proxy settings are read from the environment
+            **kwargs: add any kwarg that you would put in azure.core.pipeline.transport.RequestsTransport
+        """
+        session = requests.Session()
+        session.trust_env = use_env_settings
+        # Retries are done by the retry policy of the pipeline
+        adapter = _LargeBlockHTTPAdapter(
+            pool_connections=pool_size,
+            pool_maxsize=pool_size,
+            max_retries=Retry(total=False, redirect=False, raise_on_status=False),
+        )
+        session.mount("http://", adapter)
+        session.mount("https://", adapter)
+        if not keep_alive:
+            session.headers["Connection"] = "close"
+        super().__init__(
+            session=session,
+            session_owner=False,
+            use_env_settings=use_env_settings,
+            **kwargs
+        )
+        self.pool_size = pool_size
+        self.keep_alive = keep_alive
+
+    def close(self):
+        if self.session is not None:
+            self.session.close()
+            # Without a session, opening the transport again raises
+            self.session = None
+
+
+class PooledAioHttpTransport(AioHttpTransport):
+    def __init__(
+        self,
+        pool_size: Optional[int] = 100,
+        keep_alive_timeout: Optional[float] = 15.0,
+        dns_cache_ttl: Optional[int] = 10,
+        use_env_settings: Optional[bool] = True,
+        **kwargs
+    ):
+        """
+        Async HTTP transport whose aiohttp session is created with a configured connection pool
+
+        An aiohttp session needs a running event loop: it is created when the transport is first opened, and
+        closed with the client. Like AioHttpTransport, a closed transport can't be opened again.
+
+        Args:
+            pool_size: maximum number of simultaneous connections, 0 for no limit
+            keep_alive_timeout: seconds during which an idle connection is kept open
+            dns_cache_ttl: seconds during which DNS resolutions are cached, None to cache forever
+            use_env_settings: if True, proxy settings are read from the environment
+            **kwargs: add any kwarg that you would put in azure.core.pipeline.transport.AioHttpTransport
+        """
+        super().__init__(use_env_settings=use_env_settings, **kwargs)
+        self.pool_size = pool_size
+        self.keep_alive_timeout = keep_alive_timeout
+        self.dns_cache_ttl = dns_cache_ttl
+        self.use_env_settings = use_env_settings
+        self._opened = False
+
+    async def open(self):
+        if self.session is None:
+            if self._opened:
+                raise ValueError(
+                    "HTTP transport has already been closed. "
+                    "Check that the client is used inside its async with block and was not closed already."
+                )
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(
+                    limit=self.pool_size,
+                    keepalive_timeout=self.keep_alive_timeout,
+                    ttl_dns_cache=self.dns_cache_ttl,
+                ),
+                trust_env=self.use_env_settings,
+                cookie_jar=aiohttp.DummyCookieJar(),
+                auto_decompress=False,
+            )
+        self._opened = True
+        await super().open()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
@@ -0,0 +1,64 @@
+import asyncio
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "src"))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "benchmarks"))
+
+from fake_blob_server import FakeBlobServer  # noqa: E402
+
+from azure_blobstorage_utils import BlobStorageBase, BlobStorageBaseAsync  # noqa: E402
+
+CONTAINER = "tests"
+
+
+@pytest.fixture
+def server():
+    with FakeBlobServer() as fake_server:
+        yield fake_server
+
+
+@pytest.fixture
+def storage(server, tmp_path):
+    with BlobStorageBase(
+        server.connection_string, local_base_path=str(tmp_path) + "/"
+    ) as client:
+        yield client
+
+
+def make_data(size: int = 200 * 1024) -> bytes:
+    """
+    Compressible data, but not so much that it fits in one block once compressed
+    """
+    return b"".join(os.urandom(64) + b"x" * 192 for _ in range(size // 256)) + (
+        os.urandom(size % 256)
+    )
+
+
+@pytest.fixture
+def local_file(tmp_path):
+    data = make_data()
+    file_name = str(tmp_path / "data.bin")
+    with open(file_name, "wb") as f:
+        f.write(data)
+    return file_name, data
+
+
+@pytest.fixture
+def run_async(server, tmp_path):
+    """
+    Run a coroutine function with an async client of the fake server, of client_class
+    """
+
+    def _run(func, client_class=BlobStorageBaseAsync, **kwargs):
+        async def _main():
+            async with client_class(
+                server.connection_string, local_base_path=str(tmp_path) + "/", **kwargs
+            ) as client:
+                return await func(client)
+
+        return asyncio.run(_main())
+
+    return _run
@@ -0,0 +1,114 @@
+import os
+import time
+
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import BlobCache
+
+
+def test_invalidate_container_keeps_other_containers(tmp_path):
+    cache = BlobCache(directory=str(tmp_path))
+    cache.put("first", "a", b"a", "etag-a")
+    cache.put("first", "b", b"b", "etag-b")
+    cache.put("second", "a", b"c", "etag-c")
+
+    cache.invalidate("first")
+
+    assert cache.get("first", "a") is None
+    assert cache.get("first", "b") is None
+    assert cache.get("second", "a").data == b"c"
+    assert BlobCache(directory=str(tmp_path)).get("second", "a").data == b"c"
+
+
+def test_invalidate_blob_and_clear(tmp_path):
+    cache = BlobCache(directory=str(tmp_path))
+    cache.put("first", "a", b"a", "etag-a")
+    cache.put("first", "b", b"b", "etag-b")
+    cache.put("second", "a", b"c", "etag-c")
+
+    cache.invalidate("first", "a")
+    assert cache.get("first", "a") is None
+    assert cache.get("first", "b").data == b"b"
+
+    cache.clear()
+    assert cache.get("first", "b") is None
+    assert cache.get("second", "a") is None
+    assert BlobCache(directory=str(tmp_path)).get("second", "a") is None
+
+
+def test_delete_container_invalidates_its_blobs(storage):
+    storage.cache = BlobCache()
+    storage.upload_bytes(b"kept", "other", "blob")
+    storage.upload_bytes(b"deleted", CONTAINER, "blob")
+    assert storage.get_file_as_bytes("other", "blob") == b"kept"
+    assert storage.get_file_as_bytes(CONTAINER, "blob") == b"deleted"
+
+    storage.delete_container(CONTAINER)
+
+    assert storage.cache.get(CONTAINER, "blob") is None
+    assert storage.cache.get("other", "blob").data == b"kept"
+
+
+def test_disk_entry_is_one_file_with_its_etag(tmp_path):
+    cache = BlobCache(directory=str(tmp_path), ttl=60)
+    cache.put("first", "a", b"data", '"etag-a"')
+
+    (file_name,) = os.listdir(tmp_path)
+    assert file_name.endswith(".blob")
+    with open(tmp_path / file_name, "rb") as f:
+        assert f.read() == b'"etag-a"\ndata'
+
+    entry = BlobCache(directory=str(tmp_path), ttl=60).get("first", "a")
+    assert entry.data == b"data"
+    assert entry.etag == '"etag-a"'
+    assert BlobCache(directory=str(tmp_path), ttl=60).is_fresh(entry)
+
+
+def test_touch_is_kept_on_disk(tmp_path):
+    cache = BlobCache(directory=str(tmp_path), ttl=60)
+    cache.put("first", "a", b"data", "etag-a")
+    (file_name,) = os.listdir(tmp_path)
+    os.utime(tmp_path / file_name, (time.time() - 120, time.time() - 120))
+    reopened = BlobCache(directory=str(tmp_path), ttl=60)
+    assert not reopened.is_fresh(reopened.get("first", "a"))
+
+    reopened.touch("first", "a")
+
+    assert BlobCache(directory=str(tmp_path), ttl=60).get("first", "a").fetched_at > (
+        time.time() - 60
+    )
+
+
+def test_partial_files_are_removed_when_opened(tmp_path):
+    cache = BlobCache(directory=str(tmp_path))
+    cache.put("first", "a", b"data", "etag-a")
+    (file_name,) = os.listdir(tmp_path)
+    partial_file_name = tmp_path / "{}.0123.part".format(file_name)
+    partial_file_name.write_bytes(b"etag-b\nda")
+
+    reopened = BlobCache(directory=str(tmp_path))
+
+    assert os.listdir(tmp_path) == [file_name]
+    assert reopened.get("first", "a").data == b"data"
+
+
+def test_disk_eviction_order_is_kept(tmp_path):
+    # Entries are 17 bytes on disk with their ETag: 3 fit
+    cache = BlobCache(max_memory_size=0, directory=str(tmp_path), max_disk_size=60)
+    cache.put("first", "a", b"a" * 10, "etag-a")
+    cache.put("first", "b", b"b" * 10, "etag-b")
+    cache.put("first", "c", b"c" * 10, "etag-c")
+    for age, name in [(30, "a"), (20, "b"), (10, "c")]:
+        file_name = cache._get_file_name(cache._get_key("first", name))
+        os.utime(file_name, (time.time() - age, time.time() - age))
+    reopened = BlobCache(max_memory_size=0, directory=str(tmp_path), max_disk_size=60)
+    assert reopened.get("first", "a").data == b"a" * 10
+
+    reopened.put("first", "d", b"d" * 10, "etag-d")
+
+    assert reopened.get("first", "b") is None
+    assert [reopened.get("first", name).data for name in "acd"] == [
+        b"a" * 10,
+        b"c" * 10,
+        b"d" * 10,
+    ]
@@ -0,0 +1,164 @@
+import importlib.util
+
+import azure.storage.blob
+import azure.storage.blob.aio
+import pytest
+from azure.core.exceptions import ResourceExistsError
+from conftest import CONTAINER, make_data
+
+from azure_blobstorage_utils import AsyncConcurrencyGovernor, ConcurrencyGovernor
+from azure_blobstorage_utils.compression import decompress_bytes
+
+CONTENT_ENCODINGS = [
+    "gzip",
+    pytest.param(
+        "zstd",
+        marks=pytest.mark.skipif(
+            importlib.util.find_spec("zstandard") is None,
+            reason="zstandard is not installed",
+        ),
+    ),
+]
+
+
+@pytest.mark.parametrize("content_encoding", CONTENT_ENCODINGS)
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_upload_file_compressed_round_trip(
+    storage, local_file, content_encoding, max_concurrency
+):
+    file_name, data = local_file
+
+    storage.upload_file(
+        CONTAINER,
+        file_name,
+        "data.bin",
+        block_size=16 * 1024,
+        max_concurrency=max_concurrency,
+        content_encoding=content_encoding,
+    )
+
+    blob_client = storage.get_blob_client(CONTAINER, "data.bin")
+    properties = blob_client.get_blob_properties()
+    assert properties.content_settings.content_encoding == content_encoding
+    stored = blob_client.download_blob(decompress=False).readall()
+    assert len(stored) < len(data)
+    assert decompress_bytes(stored, content_encoding) == data
+    assert storage.get_file_as_bytes(CONTAINER, "data.bin") == data
+    assert b"".join(storage._iter_blob_chunks(CONTAINER, "data.bin", 4096)) == data
+
+
+@pytest.mark.parametrize("content_encoding", CONTENT_ENCODINGS)
+def test_upload_bytes_compressed_round_trip(storage, content_encoding):
+    data = make_data(10 * 1024)
+
+    storage.upload_bytes(data, CONTAINER, "data.bin", content_encoding=content_encoding)
+
+    assert storage.get_file_as_bytes(CONTAINER, "data.bin") == data
+    assert b"".join(storage._iter_blob_chunks(CONTAINER, "data.bin", 1024)) == data
+
+
+def _no_exists(*args, **kwargs):
+    raise AssertionError("The commit checks that the blob is missing")
+
+
+def test_upload_file_compressed_without_overwrite(storage, local_file, monkeypatch):
+    file_name, _ = local_file
+    storage.upload_bytes(b"kept", CONTAINER, "data.bin")
+    monkeypatch.setattr(azure.storage.blob.BlobClient, "exists", _no_exists)
+
+    with pytest.raises(ResourceExistsError):
+        storage.upload_file(CONTAINER, file_name, "data.bin", content_encoding="gzip")
+
+    assert storage.get_file_as_bytes(CONTAINER, "data.bin") == b"kept"
+
+
+def test_upload_file_compressed_is_governed(storage, local_file):
+    file_name, data = local_file
+    storage.governor = ConcurrencyGovernor(initial=2)
+    acquired = []
+    acquire = storage.governor.acquire
+    storage.governor.acquire = lambda: acquired.append(1) or acquire()
+
+    storage.upload_file(
+        CONTAINER,
+        file_name,
+        "data.bin",
+        block_size=16 * 1024,
+        max_concurrency=4,
+        content_encoding="gzip",
+    )
+
+    stored = (
+        storage.get_blob_client(CONTAINER, "data.bin")
+        .download_blob(decompress=False)
+        .readall()
+    )
+    assert len(acquired) == -(-len(stored) // (16 * 1024))
+    assert storage.get_file_as_bytes(CONTAINER, "data.bin") == data
+
+
+@pytest.mark.parametrize("content_encoding", CONTENT_ENCODINGS)
+def test_upload_file_compressed_round_trip_async(
+    run_async, local_file, content_encoding
+):
+    file_name, data = local_file
+
+    async def _main(client):
+        await client.upload_file(
+            CONTAINER,
+            file_name,
+            "data.bin",
+            block_size=16 * 1024,
+            max_concurrency=4,
+            content_encoding=content_encoding,
+        )
+        chunks = [
+            chunk
+            async for chunk in client._iter_blob_chunks(CONTAINER, "data.bin", 4096)
+        ]
+        return await client.get_file_as_bytes(CONTAINER, "data.bin"), b"".join(chunks)
+
+    assert run_async(_main) == (data, data)
+
+
+def test_upload_file_compressed_without_overwrite_async(
+    run_async, local_file, monkeypatch
+):
+    file_name, _ = local_file
+    monkeypatch.setattr(azure.storage.blob.aio.BlobClient, "exists", _no_exists)
+
+    async def _main(client):
+        await client.upload_bytes(b"kept", CONTAINER, "data.bin")
+        with pytest.raises(ResourceExistsError):
+            await client.upload_file(
+                CONTAINER, file_name, "data.bin", content_encoding="gzip"
+            )
+        return await client.get_file_as_bytes(CONTAINER, "data.bin")
+
+    assert run_async(_main) == b"kept"
+
+
+def test_upload_file_compressed_is_governed_async(run_async, local_file):
+    file_name, data = local_file
+    governor = AsyncConcurrencyGovernor(initial=2)
+    acquired = []
+    acquire = governor.acquire
+    governor.acquire = lambda: acquired.append(1) or acquire()
+
+    async def _main(client):
+        await client.upload_file(
+            CONTAINER,
+            file_name,
+            "data.bin",
+            block_size=16 * 1024,
+            max_concurrency=4,
+            content_encoding="gzip",
+        )
+        blob_client = client.get_blob_client(CONTAINER, "data.bin")
+        stored = await (await blob_client.download_blob(decompress=False)).readall()
+        return stored, await client.get_file_as_bytes(CONTAINER, "data.bin")
+
+    stored, downloaded = run_async(_main, governor=governor)
+
+    assert len(acquired) == -(-len(stored) // (16 * 1024))
+    assert downloaded == data
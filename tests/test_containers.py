@@ -0,0 +1,104 @@
+import time
+
+import azure.storage.blob
+import azure.storage.blob.aio
+import pytest
+from azure.core.exceptions import ResourceNotFoundError
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import BlobStorageBase
+
+
+@pytest.fixture
+def exists_calls(monkeypatch):
+    calls = []
+    exists = azure.storage.blob.ContainerClient.exists
+
+    def _exists(self, *args, **kwargs):
+        calls.append(self.container_name)
+        return exists(self, *args, **kwargs)
+
+    monkeypatch.setattr(azure.storage.blob.ContainerClient, "exists", _exists)
+    return calls
+
+
+def test_container_existence_is_checked_once(storage, exists_calls):
+    storage.create_container("other")
+
+    for i in range(20):
+        storage.upload_bytes(b"a", CONTAINER, "blob_{}".format(i))
+        storage.upload_bytes(b"b", "other", "blob_{}".format(i))
+
+    assert exists_calls.count(CONTAINER) == 1
+    assert "other" not in exists_calls
+
+
+def test_container_existence_expires(server, tmp_path, exists_calls):
+    with BlobStorageBase(
+        server.connection_string,
+        local_base_path=str(tmp_path) + "/",
+        container_cache_ttl=0.1,
+    ) as storage:
+        storage.upload_bytes(b"a", CONTAINER, "a")
+        storage.upload_bytes(b"b", CONTAINER, "b")
+        assert exists_calls == [CONTAINER]
+
+        time.sleep(0.11)
+        storage.upload_bytes(b"c", CONTAINER, "c")
+
+    assert exists_calls == [CONTAINER, CONTAINER]
+
+
+def test_container_cache_disabled(server, tmp_path, exists_calls):
+    with BlobStorageBase(
+        server.connection_string,
+        local_base_path=str(tmp_path) + "/",
+        container_cache_ttl=0,
+    ) as storage:
+        storage.create_container(CONTAINER)
+        storage.get_container_client(CONTAINER)
+        storage.get_container_client(CONTAINER)
+
+    assert exists_calls == [CONTAINER, CONTAINER]
+
+
+def test_deleted_container_is_forgotten(storage, exists_calls):
+    storage.create_container("other")
+    storage.get_container_client("other")
+
+    storage.delete_container("other")
+
+    with pytest.raises(ResourceNotFoundError):
+        storage.get_container_client("other")
+    assert exists_calls == ["other"]
+
+
+def test_invalidate_container_cache(storage, exists_calls):
+    storage.create_container(CONTAINER)
+    storage.get_container_client(CONTAINER)
+
+    storage.invalidate_container_cache(CONTAINER)
+    storage.get_container_client(CONTAINER)
+    storage.invalidate_container_cache()
+    storage.get_container_client(CONTAINER)
+
+    assert exists_calls == [CONTAINER, CONTAINER]
+
+
+def test_container_existence_is_checked_once_async(run_async, monkeypatch):
+    calls = []
+    exists = azure.storage.blob.aio.ContainerClient.exists
+
+    async def _exists(self, *args, **kwargs):
+        calls.append(self.container_name)
+        return await exists(self, *args, **kwargs)
+
+    monkeypatch.setattr(azure.storage.blob.aio.ContainerClient, "exists", _exists)
+
+    async def _main(client):
+        for i in range(20):
+            await client.upload_bytes(b"a", CONTAINER, "blob_{}".format(i))
+        return await client.get_list_blobs_name(CONTAINER)
+
+    assert len(run_async(_main)) == 20
+    assert calls == [CONTAINER]
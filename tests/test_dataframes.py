@@ -0,0 +1,100 @@
+import pytest
+from conftest import CONTAINER
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("simplejpeg")
+
+from azure_blobstorage_utils import (  # noqa: E402
+    BlobStorageExtended,
+    BlobStorageExtendedAsync,
+)
+
+
+@pytest.fixture
+def extended(server, tmp_path):
+    with BlobStorageExtended(
+        server.connection_string, local_base_path=str(tmp_path) + "/"
+    ) as client:
+        yield client
+
+
+@pytest.fixture
+def df():
+    return pd.DataFrame(
+        {"x": range(10), "y": ["v{}".format(i) for i in range(10)]},
+        index=pd.Index(range(100, 110), name="id"),
+    )
+
+
+@pytest.mark.parametrize("remote_file_name", ["df.csv", "df.parquet", "df.json"])
+def test_upload_pandas_df_round_trip(extended, df, remote_file_name):
+    kwargs = {"orient": "table"} if remote_file_name.endswith(".json") else {}
+    extended.upload_pandas_df(df, CONTAINER, remote_file_name, **kwargs)
+
+    if remote_file_name.endswith(".csv"):
+        kwargs = {"index_col": "id"}
+    result = extended.get_file_as_pandas_df(CONTAINER, remote_file_name, **kwargs)
+
+    pd.testing.assert_frame_equal(result, df, check_dtype=False)
+
+
+def test_upload_pandas_df_round_trip_async(run_async, df):
+    async def _main(client):
+        await client.upload_pandas_df(df, CONTAINER, "df.parquet")
+        return await client.get_file_as_pandas_df(CONTAINER, "df.parquet")
+
+    pd.testing.assert_frame_equal(
+        run_async(_main, client_class=BlobStorageExtendedAsync), df
+    )
+
+
+def test_upload_pandas_df_unknown_extension(extended, df):
+    extended.upload_bytes(b"", CONTAINER, "other")
+    extended.upload_pandas_df(df, CONTAINER, "df.bin")
+
+    assert extended.get_list_blobs_name(CONTAINER) == ["other"]
+
+
+@pytest.mark.parametrize("remote_file_name", ["df.csv", "df.jsonl"])
+def test_iter_file_as_pandas_df(extended, df, remote_file_name):
+    df = df.reset_index()
+    if remote_file_name.endswith(".csv"):
+        data = df.to_csv(index=False).encode()
+    else:
+        data = df.to_json(orient="records", lines=True).encode()
+    extended.upload_bytes(data, CONTAINER, remote_file_name)
+
+    chunks = list(
+        extended.iter_file_as_pandas_df(
+            CONTAINER, remote_file_name, chunksize=3, chunk_size=16
+        )
+    )
+
+    assert [len(chunk) for chunk in chunks] == [3, 3, 3, 1]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df)
+
+
+def test_iter_file_as_pandas_df_async(run_async, df):
+    df = df.reset_index()
+
+    async def _main(client):
+        await client.upload_bytes(df.to_csv(index=False).encode(), CONTAINER, "df.csv")
+        return [
+            chunk
+            async for chunk in client.iter_file_as_pandas_df(
+                CONTAINER, "df.csv", chunksize=4, chunk_size=16
+            )
+        ]
+
+    chunks = run_async(_main, client_class=BlobStorageExtendedAsync)
+
+    assert [len(chunk) for chunk in chunks] == [4, 4, 2]
+    pd.testing.assert_frame_equal(pd.concat(chunks, ignore_index=True), df)
+
+
+def test_iter_file_as_pandas_df_unknown_extension(extended):
+    extended.upload_bytes(b"", CONTAINER, "df.parquet")
+
+    with pytest.raises(ValueError):
+        next(extended.iter_file_as_pandas_df(CONTAINER, "df.parquet"))
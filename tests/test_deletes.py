@@ -0,0 +1,64 @@
+import azure.core.exceptions
+import azure.storage.blob
+import pytest
+from conftest import CONTAINER
+
+from azure_blobstorage_utils.base import DELETE_BATCH_SIZE
+
+NAMES = ["dir/{:04d}".format(i) for i in range(2 * DELETE_BATCH_SIZE + 88)]
+
+
+@pytest.fixture
+def remote_blobs(server):
+    server.put_blobs(
+        CONTAINER, {name: b"x" for name in NAMES + ["other/a", "dir_sibling"]}
+    )
+    return NAMES
+
+
+@pytest.fixture
+def batch_sizes(monkeypatch):
+    sizes = []
+    delete_blobs = azure.storage.blob.ContainerClient.delete_blobs
+
+    def _delete_blobs(self, *blobs, **kwargs):
+        sizes.append(len(blobs))
+        return delete_blobs(self, *blobs, **kwargs)
+
+    monkeypatch.setattr(
+        azure.storage.blob.ContainerClient, "delete_blobs", _delete_blobs
+    )
+    return sizes
+
+
+def test_fake_server_rejects_oversized_batch(storage, remote_blobs):
+    container_client = storage.get_container_client(CONTAINER)
+
+    with pytest.raises(azure.core.exceptions.HttpResponseError):
+        container_client.delete_blobs(*remote_blobs)
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_delete_blobs_in_batches(storage, remote_blobs, batch_sizes, max_concurrency):
+    count = storage.delete_blobs(CONTAINER, remote_blobs, max_concurrency)
+
+    assert count == len(remote_blobs)
+    assert sorted(batch_sizes) == [88, DELETE_BATCH_SIZE, DELETE_BATCH_SIZE]
+    assert storage.get_list_blobs_name(CONTAINER) == ["dir_sibling", "other/a"]
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_delete_prefix(storage, remote_blobs, batch_sizes, max_concurrency):
+    count = storage.delete_prefix(CONTAINER, "dir/", max_concurrency)
+
+    assert count == len(remote_blobs)
+    assert sorted(batch_sizes) == [88, DELETE_BATCH_SIZE, DELETE_BATCH_SIZE]
+    assert storage.get_list_blobs_name(CONTAINER) == ["dir_sibling", "other/a"]
+
+
+def test_delete_prefix_async(run_async, storage, remote_blobs):
+    async def _main(client):
+        count = await client.delete_prefix(CONTAINER, "dir/", 4)
+        return count, await client.get_list_blobs_name(CONTAINER)
+
+    assert run_async(_main) == (len(remote_blobs), ["dir_sibling", "other/a"])
@@ -0,0 +1,225 @@
+import asyncio
+import os
+import time
+
+import pytest
+from conftest import CONTAINER
+
+NAMES = ["dir/a.txt", "dir/b/c.txt", "dir/b/d.txt", "dir/e/f/g.txt", "other/h.txt"]
+
+
+@pytest.fixture
+def remote_directory(storage):
+    for name in NAMES:
+        storage.upload_bytes(name.encode(), CONTAINER, name)
+    return [name for name in NAMES if name.startswith("dir/")]
+
+
+def _read_local_files(local_directory: str) -> dict:
+    files = {}
+    for root, _, file_names in os.walk(local_directory):
+        for file_name in file_names:
+            path = os.path.join(root, file_name)
+            with open(path, "rb") as f:
+                files[os.path.relpath(path, local_directory)] = f.read()
+    return files
+
+
+@pytest.mark.parametrize("max_workers", [None, 1, 4])
+def test_download_directory(storage, remote_directory, tmp_path, max_workers):
+    local_directory = str(tmp_path / "local") + "/"
+
+    results = storage.download_directory(
+        CONTAINER, "dir/", local_directory=local_directory, max_workers=max_workers
+    )
+
+    if max_workers is None:
+        assert results is None
+    else:
+        assert results == {name: None for name in remote_directory}
+    assert _read_local_files(local_directory) == {
+        name: name.encode() for name in remote_directory
+    }
+
+
+def test_download_directory_concurrent_failure_does_not_stop_others(
+    storage, remote_directory, tmp_path, monkeypatch
+):
+    local_directory = str(tmp_path / "local") + "/"
+    download_file = storage.download_file
+
+    def _download_file(container_name, blob_name, *args, **kwargs):
+        if blob_name == "dir/b/c.txt":
+            raise RuntimeError("download failed")
+        return download_file(container_name, blob_name, *args, **kwargs)
+
+    monkeypatch.setattr(storage, "download_file", _download_file)
+
+    results = storage.download_directory(
+        CONTAINER, "dir/", local_directory=local_directory, max_workers=4
+    )
+
+    assert isinstance(results.pop("dir/b/c.txt"), RuntimeError)
+    assert results == {name: None for name in remote_directory if name != "dir/b/c.txt"}
+    assert "dir/b/c.txt" not in _read_local_files(local_directory)
+    assert len(_read_local_files(local_directory)) == len(remote_directory) - 1
+
+
+@pytest.mark.parametrize("concurrency", [1, 4])
+def test_upload_and_download_directory_concurrently_async(
+    run_async, tmp_path, concurrency
+):
+    upload_directory = tmp_path / "upload"
+    for name in NAMES:
+        (upload_directory / name).parent.mkdir(parents=True, exist_ok=True)
+        (upload_directory / name).write_bytes(name.encode())
+    download_directory = str(tmp_path / "download") + "/"
+
+    async def _main(client):
+        uploaded = await client.upload_directory(
+            CONTAINER,
+            str(upload_directory) + "/",
+            "remote/",
+            concurrency=concurrency,
+        )
+        downloaded = await client.download_directory(
+            CONTAINER,
+            "remote/",
+            local_directory=download_directory,
+            concurrency=concurrency,
+        )
+        return uploaded, downloaded
+
+    uploaded, downloaded = run_async(_main)
+
+    assert len(uploaded) == len(NAMES)
+    assert set(uploaded.values()) == {None}
+    assert set(downloaded.values()) == {None}
+    assert sorted(_read_local_files(download_directory).values()) == sorted(
+        name.encode() for name in NAMES
+    )
+
+
+def test_download_directory_concurrent_failure_does_not_stop_others_async(
+    run_async, tmp_path
+):
+    local_directory = str(tmp_path / "local") + "/"
+
+    async def _main(client):
+        for name in NAMES:
+            await client.upload_bytes(name.encode(), CONTAINER, name)
+        download_file = client.download_file
+
+        async def _download_file(container_name, blob_name, *args, **kwargs):
+            if blob_name == "dir/b/c.txt":
+                raise RuntimeError("download failed")
+            return await download_file(container_name, blob_name, *args, **kwargs)
+
+        client.download_file = _download_file
+        return await client.download_directory(
+            CONTAINER, "dir/", local_directory=local_directory, concurrency=4
+        )
+
+    results = run_async(_main)
+
+    assert isinstance(results.pop("dir/b/c.txt"), RuntimeError)
+    assert results == {
+        name: None
+        for name in NAMES
+        if name.startswith("dir/") and name != "dir/b/c.txt"
+    }
+    assert len(_read_local_files(local_directory)) == len(results)
+
+
+def test_run_concurrently_cancels_in_flight_calls_when_items_fail(run_async):
+    started, finished = [], []
+
+    async def _func(item):
+        started.append(item)
+        await asyncio.sleep(10)
+        finished.append(item)
+
+    async def _items():
+        yield "a"
+        yield "b"
+        await asyncio.sleep(0)
+        raise RuntimeError("listing failed")
+
+    async def _main(client):
+        with pytest.raises(RuntimeError, match="listing failed"):
+            await client._run_concurrently(_func, _items(), 4)
+        return asyncio.all_tasks() - {asyncio.current_task()}
+
+    assert run_async(_main) == set()
+    assert started == ["a", "b"]
+    assert finished == []
+
+
+def _write_local_file(path, data: bytes, mtime: float):
+    path.parent.mkdir(parents=True, exist_ok=True)
+    path.write_bytes(data)
+    os.utime(path, (mtime, mtime))
+
+
+@pytest.fixture
+def local_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Blobs have a Last-Modified of second resolution, keep local files clearly older
+    for name in ["a.txt", "b/c.txt", "b/d.txt"]:
+        _write_local_file(tmp_path / "local" / name, name.encode(), time.time() - 60)
+    return tmp_path / "local"
+
+
+def test_upload_directory_incremental(storage, local_directory, monkeypatch):
+    summary = storage.upload_directory(CONTAINER, "local/", "remote/", incremental=True)
+    assert sorted(summary["uploaded"]) == [
+        "local/a.txt",
+        "local/b/c.txt",
+        "local/b/d.txt",
+    ]
+
+    uploaded = []
+    upload_file = storage.upload_file
+    monkeypatch.setattr(
+        storage,
+        "upload_file",
+        lambda container_name, filepath, *args: uploaded.append(filepath)
+        or upload_file(container_name, filepath, *args),
+    )
+    summary = storage.upload_directory(CONTAINER, "local/", "remote/", incremental=True)
+    assert uploaded == []
+    assert summary["uploaded"] == []
+    assert len(summary["unchanged"]) == 3
+
+    _write_local_file(local_directory / "b/c.txt", b"changed", time.time() + 60)
+    _write_local_file(local_directory / "e.txt", b"new", time.time() - 60)
+    os.remove(local_directory / "b/d.txt")
+    summary = storage.upload_directory(
+        CONTAINER, "local/", "remote/", incremental=True, delete_missing=True
+    )
+
+    assert sorted(uploaded) == ["local/b/c.txt", "local/e.txt"]
+    assert sorted(summary["uploaded"]) == ["local/b/c.txt", "local/e.txt"]
+    assert summary["unchanged"] == ["local/a.txt"]
+    assert summary["deleted"] == ["remote/local/b/d.txt"]
+    assert storage.get_list_blobs_name(CONTAINER) == [
+        "remote/local/a.txt",
+        "remote/local/b/c.txt",
+        "remote/local/e.txt",
+    ]
+    assert storage.get_file_as_bytes(CONTAINER, "remote/local/b/c.txt") == b"changed"
+
+
+def test_upload_directory_incremental_checksum(storage, local_directory):
+    storage.upload_directory(CONTAINER, "local/", incremental=True)
+    # Same size and an old modification time: only the checksum tells the change
+    _write_local_file(local_directory / "a.txt", b"A.txt", time.time() - 60)
+
+    without_checksum = storage.upload_directory(CONTAINER, "local/", incremental=True)
+    with_checksum = storage.upload_directory(
+        CONTAINER, "local/", incremental=True, checksum=True
+    )
+
+    assert without_checksum["uploaded"] == []
+    assert with_checksum["uploaded"] == ["local/a.txt"]
+    assert storage.get_file_as_bytes(CONTAINER, "local/a.txt") == b"A.txt"
@@ -0,0 +1,199 @@
+import asyncio
+import os
+
+import azure.storage.blob
+import azure.storage.blob.aio
+import pytest
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import BlobStorageBase, MetricsCollector
+
+
+def test_get_file_as_bytes_in_ranges(storage):
+    data = os.urandom(100 * 1024 + 7)
+    storage.upload_bytes(data, CONTAINER, "blob")
+
+    result = storage.get_file_as_bytes(
+        CONTAINER, "blob", max_concurrency=4, chunk_size=4096, large_file_threshold=0
+    )
+
+    assert result == data
+    assert type(result) is bytes
+
+
+def test_get_file_as_bytes_below_threshold_takes_two_requests(server, tmp_path):
+    data = os.urandom(100 * 1024)
+    metrics = MetricsCollector()
+    with BlobStorageBase(
+        server.connection_string,
+        local_base_path=str(tmp_path) + "/",
+        observers=[metrics],
+    ) as storage:
+        storage.upload_bytes(data, CONTAINER, "blob")
+        metrics.reset()
+
+        result = storage.get_file_as_bytes(
+            CONTAINER, "blob", max_concurrency=4, chunk_size=4096
+        )
+
+    assert result == data
+    assert type(result) is bytes
+    assert metrics.get_counters()["download"]["requests"] == 2
+
+
+def test_get_file_as_bytes_of_empty_blob(storage):
+    storage.upload_bytes(b"", CONTAINER, "empty")
+
+    assert storage.get_file_as_bytes(CONTAINER, "empty", max_concurrency=4) == b""
+
+
+def test_download_file_in_ranges(storage, tmp_path):
+    data = os.urandom(50 * 1024 + 3)
+    storage.upload_bytes(data, CONTAINER, "dir/blob")
+    local_file_name = str(tmp_path / "out.bin")
+
+    storage.download_file(
+        CONTAINER,
+        "dir/blob",
+        local_file_name,
+        chunk_size=4096,
+        max_concurrency=4,
+        large_file_threshold=0,
+    )
+
+    with open(local_file_name, "rb") as f:
+        assert f.read() == data
+    assert os.listdir(tmp_path) == ["out.bin"]
+
+
+def test_async_get_file_as_bytes_in_ranges(run_async):
+    data = os.urandom(100 * 1024 + 7)
+
+    async def _test(client):
+        await client.upload_bytes(data, CONTAINER, "blob")
+        return await client.get_file_as_bytes(
+            CONTAINER,
+            "blob",
+            max_concurrency=4,
+            chunk_size=4096,
+            large_file_threshold=0,
+        )
+
+    result = run_async(_test)
+    assert result == data
+    assert type(result) is bytes
+
+
+def test_async_download_ranges_cancels_pending_ranges_on_failure(run_async):
+    data = os.urandom(64 * 1024)
+    writes = []
+
+    def _write(offset: int, range_data: bytes):
+        if not writes:
+            writes.append(offset)
+            raise RuntimeError("write failed")
+        writes.append(offset)
+
+    async def _test(client):
+        await client.upload_bytes(data, CONTAINER, "blob")
+        blob_client = client.get_blob_client(CONTAINER, "blob")
+        with pytest.raises(RuntimeError):
+            await client._download_ranges(
+                blob_client, 0, len(data), 1024, 4, {}, _write
+            )
+        count = len(writes)
+        await asyncio.sleep(0.2)
+        return count
+
+    count = run_async(_test)
+    assert len(writes) == count
+    assert count < 64
+
+
+@pytest.fixture
+def download_lengths(monkeypatch):
+    lengths = []
+    download_blob = azure.storage.blob.BlobClient.download_blob
+
+    def _download_blob(self, *args, **kwargs):
+        lengths.append(kwargs.get("length"))
+        if len(lengths) == 3:
+            raise RuntimeError("connection lost")
+        return download_blob(self, *args, **kwargs)
+
+    monkeypatch.setattr(azure.storage.blob.BlobClient, "download_blob", _download_blob)
+    return lengths
+
+
+def test_download_file_streams_chunks(storage, tmp_path, monkeypatch):
+    data = os.urandom(10 * 1024 + 5)
+    storage.upload_bytes(data, CONTAINER, "blob")
+    local_file_name = str(tmp_path / "out.bin")
+    lengths = []
+    download_blob = azure.storage.blob.BlobClient.download_blob
+
+    def _download_blob(self, *args, **kwargs):
+        lengths.append(kwargs.get("length"))
+        return download_blob(self, *args, **kwargs)
+
+    monkeypatch.setattr(azure.storage.blob.BlobClient, "download_blob", _download_blob)
+
+    storage.download_file(CONTAINER, "blob", local_file_name, chunk_size=1024)
+
+    with open(local_file_name, "rb") as f:
+        assert f.read() == data
+    assert len(lengths) == 11
+    assert all(length is not None and length <= 1024 for length in lengths)
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_download_file_failure_leaves_no_partial_file(
+    storage, tmp_path, download_lengths, max_concurrency
+):
+    storage.upload_bytes(os.urandom(10 * 1024), CONTAINER, "blob")
+    local_file_name = str(tmp_path / "out.bin")
+    with open(local_file_name, "wb") as f:
+        f.write(b"previous")
+
+    with pytest.raises(RuntimeError):
+        storage.download_file(
+            CONTAINER,
+            "blob",
+            local_file_name,
+            chunk_size=1024,
+            max_concurrency=max_concurrency,
+            large_file_threshold=0,
+        )
+
+    assert os.listdir(tmp_path) == ["out.bin"]
+    with open(local_file_name, "rb") as f:
+        assert f.read() == b"previous"
+
+
+def test_async_download_file_failure_leaves_no_partial_file(
+    run_async, tmp_path, monkeypatch
+):
+    local_file_name = str(tmp_path / "out.bin")
+    calls = []
+    download_blob = azure.storage.blob.aio.BlobClient.download_blob
+
+    async def _download_blob(self, *args, **kwargs):
+        calls.append(kwargs.get("length"))
+        if len(calls) == 4:
+            raise RuntimeError("connection lost")
+        return await download_blob(self, *args, **kwargs)
+
+    async def _test(client):
+        await client.upload_bytes(os.urandom(10 * 1024), CONTAINER, "blob")
+        monkeypatch.setattr(
+            azure.storage.blob.aio.BlobClient, "download_blob", _download_blob
+        )
+        with pytest.raises(RuntimeError):
+            await client.download_file(
+                CONTAINER, "blob", local_file_name, chunk_size=1024
+            )
+
+    run_async(_test)
+
+    assert os.listdir(tmp_path) == []
+    assert calls[:3] == [1024] * 3
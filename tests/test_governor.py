@@ -0,0 +1,193 @@
+import asyncio
+import threading
+import time
+from types import SimpleNamespace
+
+import pytest
+
+from azure_blobstorage_utils import AsyncConcurrencyGovernor, ConcurrencyGovernor
+from azure_blobstorage_utils.governor import _AimdLimit, get_retry_after
+from azure_blobstorage_utils.metrics import bind_context
+
+
+def _response(status_code, **headers):
+    return SimpleNamespace(
+        http_response=SimpleNamespace(status_code=status_code, headers=headers)
+    )
+
+
+def test_aimd_limit_is_abstract():
+    with pytest.raises(TypeError):
+        _AimdLimit(4, 1, 64, 0.5, None, 1.0)
+
+
+def test_invalid_bounds():
+    with pytest.raises(ValueError):
+        ConcurrencyGovernor(initial=8, maximum=4)
+
+
+def test_additive_increase_up_to_maximum():
+    governor = ConcurrencyGovernor(initial=4, maximum=6)
+
+    for _ in range(4):
+        with governor.slot():
+            pass
+    assert governor.limit == 4
+    with governor.slot():
+        pass
+    assert governor.limit == 5
+
+    for _ in range(100):
+        with governor.slot():
+            pass
+    assert governor.limit == 6
+
+
+def test_slow_and_failed_operations_do_not_increase():
+    governor = ConcurrencyGovernor(initial=4, latency_target=0.01)
+
+    for _ in range(10):
+        governor.acquire()
+        governor.release(0.1)
+    for _ in range(10):
+        with pytest.raises(RuntimeError):
+            with governor.slot():
+                raise RuntimeError()
+
+    assert governor.limit == 4
+
+
+def test_multiplicative_decrease_with_cooldown():
+    governor = ConcurrencyGovernor(initial=32, minimum=3, cooldown=0.2)
+
+    governor.on_response(_response(503))
+    governor.on_response(_response(500))
+    assert governor.limit == 16
+
+    time.sleep(0.21)
+    governor.on_response(_response(429))
+    assert governor.limit == 8
+    for _ in range(3):
+        time.sleep(0.21)
+        governor.on_response(_response(503))
+    assert governor.limit == 3
+
+    governor.on_response(_response(404))
+    governor.on_response(_response(200))
+    assert governor.limit == 3
+
+
+def test_retry_after_pauses_new_operations():
+    governor = ConcurrencyGovernor(initial=4)
+
+    governor.on_response(_response(503, **{"x-ms-retry-after-ms": "100"}))
+    start = time.monotonic()
+    with governor.slot():
+        waited = time.monotonic() - start
+
+    assert waited >= 0.09
+
+
+def test_limit_bounds_threads_in_flight():
+    governor = ConcurrencyGovernor(initial=2, maximum=2)
+    in_flight = []
+    lock = threading.Lock()
+    peak = [0]
+
+    def _work():
+        with governor.slot():
+            with lock:
+                in_flight.append(1)
+                peak[0] = max(peak[0], len(in_flight))
+            time.sleep(0.01)
+            with lock:
+                in_flight.pop()
+
+    threads = [threading.Thread(target=_work) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert peak[0] == 2
+
+
+def test_async_governor_steps():
+    async def _main():
+        governor = AsyncConcurrencyGovernor(initial=2, maximum=2, cooldown=0.0)
+        in_flight = []
+        peak = [0]
+
+        async def _work():
+            async with governor.slot():
+                in_flight.append(1)
+                peak[0] = max(peak[0], len(in_flight))
+                await asyncio.sleep(0.01)
+                in_flight.pop()
+
+        await asyncio.gather(*(_work() for _ in range(8)))
+        governor.on_response(_response(503, **{"retry-after-ms": "100"}))
+        limit = governor.limit
+        start = time.monotonic()
+        async with governor.slot():
+            waited = time.monotonic() - start
+        return peak[0], limit, waited
+
+    peak, limit, waited = asyncio.run(_main())
+
+    assert peak == 2
+    assert limit == 1
+    assert waited >= 0.09
+
+
+def test_nested_slots_share_the_outer_slot():
+    governor = ConcurrencyGovernor(initial=1, maximum=1)
+
+    def _inner():
+        with governor.slot():
+            return governor._in_flight
+
+    with governor.slot():
+        with governor.slot():
+            assert governor._in_flight == 1
+        # Threads started within a slot inherit it
+        results = []
+        thread = threading.Thread(target=bind_context(lambda: results.append(_inner())))
+        thread.start()
+        thread.join(timeout=1)
+        assert results == [1]
+
+    assert governor._in_flight == 0
+    assert _inner() == 1
+
+
+def test_nested_slots_share_the_outer_slot_async():
+    async def _main():
+        governor = AsyncConcurrencyGovernor(initial=1, maximum=1)
+
+        async def _inner():
+            async with governor.slot():
+                return governor._in_flight
+
+        async with governor.slot():
+            nested = await asyncio.wait_for(
+                asyncio.gather(_inner(), asyncio.ensure_future(_inner())), 1
+            )
+        return nested, governor._in_flight
+
+    assert asyncio.run(_main()) == ([1, 1], 0)
+
+
+@pytest.mark.parametrize(
+    "headers, expected",
+    [
+        ({"retry-after-ms": "1500"}, 1.5),
+        ({"x-ms-retry-after-ms": "20"}, 0.02),
+        ({"Retry-After": "3"}, 3.0),
+        ({"Retry-After": "Thu, 01 Jan 1970 00:00:00 GMT"}, 0.0),
+        ({"Retry-After": "soon"}, None),
+        ({}, None),
+    ],
+)
+def test_get_retry_after(headers, expected):
+    assert get_retry_after(headers) == expected
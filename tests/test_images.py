@@ -0,0 +1,116 @@
+import threading
+
+import pytest
+from conftest import CONTAINER
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("pandas")
+simplejpeg = pytest.importorskip("simplejpeg")
+
+from azure_blobstorage_utils import (  # noqa: E402
+    BlobStorageExtended,
+    BlobStorageExtendedAsync,
+)
+from azure_blobstorage_utils import images  # noqa: E402
+
+
+def _encode_image(height: int, width: int, seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(
+        0, 256, (height, width, 3), dtype=np.uint8
+    )
+    return simplejpeg.encode_jpeg(pixels)
+
+
+@pytest.fixture
+def extended_storage(server, tmp_path):
+    with BlobStorageExtended(
+        server.connection_string, local_base_path=str(tmp_path) + "/"
+    ) as client:
+        yield client
+
+
+@pytest.mark.parametrize("max_workers", [None, 1])
+def test_get_images_as_numpy_batch(extended_storage, max_workers):
+    data = [_encode_image(16, 24, i) for i in range(5)]
+    for i, image in enumerate(data):
+        extended_storage.upload_bytes(image, CONTAINER, "{}.jpg".format(i))
+
+    batch = extended_storage.get_images_as_numpy_batch(
+        CONTAINER,
+        ["{}.jpg".format(i) for i in range(5)],
+        max_concurrency=3,
+        max_workers=max_workers,
+    )
+
+    assert batch.shape == (5, 16, 24, 3)
+    for image, array in zip(data, batch):
+        np.testing.assert_array_equal(array, simplejpeg.decode_jpeg(image))
+
+
+def test_get_images_as_numpy_batch_of_different_shapes(extended_storage):
+    data = [_encode_image(16, 24, 0), _encode_image(8, 8, 1), _encode_image(16, 24, 2)]
+    for i, image in enumerate(data):
+        extended_storage.upload_bytes(image, CONTAINER, "{}.jpg".format(i))
+
+    arrays = extended_storage.get_images_as_numpy_batch(
+        CONTAINER, ["0.jpg", "1.jpg", "2.jpg"], colorspace="GRAY"
+    )
+
+    assert [array.shape for array in arrays] == [(16, 24, 1), (8, 8, 1), (16, 24, 1)]
+    for image, array in zip(data, arrays):
+        np.testing.assert_array_equal(
+            array, simplejpeg.decode_jpeg(image, colorspace="GRAY")
+        )
+
+
+def test_get_images_as_numpy_batch_decodes_during_downloads(
+    extended_storage, monkeypatch
+):
+    for i in range(3):
+        extended_storage.upload_bytes(
+            _encode_image(16, 16, i), CONTAINER, "{}.jpg".format(i)
+        )
+    decoded = threading.Event()
+    decoded_before_last_download = []
+    decode_jpeg = images.decode_jpeg
+    get_file_as_bytes = extended_storage.get_file_as_bytes
+
+    def _decode_jpeg(*args, **kwargs):
+        decoded.set()
+        return decode_jpeg(*args, **kwargs)
+
+    def _get_file_as_bytes(container_name, remote_file_name):
+        if remote_file_name == "2.jpg":
+            decoded_before_last_download.append(decoded.wait(5))
+        return get_file_as_bytes(container_name, remote_file_name)
+
+    monkeypatch.setattr(images, "decode_jpeg", _decode_jpeg)
+    monkeypatch.setattr(extended_storage, "get_file_as_bytes", _get_file_as_bytes)
+
+    batch = extended_storage.get_images_as_numpy_batch(
+        CONTAINER, ["0.jpg", "1.jpg", "2.jpg"], max_concurrency=1
+    )
+
+    assert batch.shape == (3, 16, 16, 3)
+    assert decoded_before_last_download == [True]
+
+
+def test_get_images_as_numpy_batch_empty(extended_storage):
+    assert extended_storage.get_images_as_numpy_batch(CONTAINER, []) == []
+
+
+def test_get_images_as_numpy_batch_async(run_async):
+    data = [_encode_image(16, 24, i) for i in range(5)]
+
+    async def _main(client):
+        for i, image in enumerate(data):
+            await client.upload_bytes(image, CONTAINER, "{}.jpg".format(i))
+        return await client.get_images_as_numpy_batch(
+            CONTAINER, ["{}.jpg".format(i) for i in range(5)], concurrency=2
+        )
+
+    batch = run_async(_main, client_class=BlobStorageExtendedAsync)
+
+    assert batch.shape == (5, 16, 24, 3)
+    for image, array in zip(data, batch):
+        np.testing.assert_array_equal(array, simplejpeg.decode_jpeg(image))
@@ -0,0 +1,42 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+SRC = os.path.join(os.path.dirname(__file__), "..", "src")
+EXTRAS = ["numpy", "pandas", "pyarrow", "simplejpeg"]
+
+
+def _run(code: str) -> str:
+    # A fresh interpreter: the modules imported by other tests are not loaded yet
+    return subprocess.run(
+        [sys.executable, "-c", code],
+        env=dict(os.environ, PYTHONPATH=SRC),
+        check=True,
+        capture_output=True,
+        text=True,
+    ).stdout.strip()
+
+
+def test_package_import_does_not_import_extras():
+    loaded = _run(
+        "import sys, azure_blobstorage_utils; "
+        "print(sorted(m for m in {!r} if m in sys.modules))".format(EXTRAS)
+    )
+
+    assert loaded == "[]"
+
+
+@pytest.mark.parametrize("name", ["BlobStorageExtended", "BlobStorageExtendedAsync"])
+def test_extended_classes_are_imported_on_first_access(name):
+    pytest.importorskip("pandas")
+    pytest.importorskip("simplejpeg")
+
+    loaded = _run(
+        "import sys, azure_blobstorage_utils; "
+        "azure_blobstorage_utils.{}; "
+        "print('numpy' in sys.modules)".format(name)
+    )
+
+    assert loaded == "True"
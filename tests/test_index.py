@@ -0,0 +1,114 @@
+import pytest
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import BlobIndex, BlobStorageBase
+
+
+def test_written_blob_is_indexed_without_listing_again(storage):
+    storage.index = BlobIndex()
+    storage.upload_bytes(b"a", CONTAINER, "dir/a")
+    storage.upload_bytes(b"b", CONTAINER, "other/b")
+    assert storage.get_list_blobs_name(CONTAINER) == ["dir/a", "other/b"]
+
+    storage.upload_bytes(b"cc", CONTAINER, "dir/c")
+    storage.upload_bytes(b"aaa", CONTAINER, "dir/a", overwrite=True)
+
+    assert storage.index.is_fresh(CONTAINER)
+    assert storage.index.is_fresh(CONTAINER, "dir/")
+    blobs = storage.index.query(CONTAINER, "dir/", include_properties=True)
+    assert [(blob.name, blob.size) for blob in blobs] == [("dir/a", 3), ("dir/c", 2)]
+    properties = storage.get_blob_client(CONTAINER, "dir/a").get_blob_properties()
+    assert blobs[0].etag == properties.etag.strip('"')
+
+
+def test_deleted_blob_is_removed_from_index(storage):
+    storage.index = BlobIndex()
+    storage.upload_bytes(b"a", CONTAINER, "a")
+    storage.upload_bytes(b"b", CONTAINER, "b")
+    assert storage.get_list_blobs_name(CONTAINER) == ["a", "b"]
+
+    storage.delete_blobs(CONTAINER, ["a"])
+
+    assert storage.index.is_fresh(CONTAINER)
+    assert storage.index.query(CONTAINER) == ["b"]
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 4])
+def test_delete_prefix_lists_the_service(storage, server, max_concurrency):
+    storage.index = BlobIndex()
+    storage.upload_bytes(b"1", CONTAINER, "p/1")
+    assert storage.get_list_blobs_name(CONTAINER, "p/") == ["p/1"]
+    # Written by another client, the index of storage does not know it
+    with BlobStorageBase(server.connection_string) as other:
+        other.upload_bytes(b"2", CONTAINER, "p/2")
+
+    assert storage.delete_prefix(CONTAINER, "p/", max_concurrency) == 2
+
+    assert storage.index.query(CONTAINER, "p/") == []
+    storage.index = None
+    assert storage.get_list_blobs_name(CONTAINER, "p/") == []
+
+
+def test_delete_prefix_lists_the_service_async(run_async, storage):
+    index = BlobIndex()
+
+    async def _main(client):
+        await client.upload_bytes(b"1", CONTAINER, "p/1")
+        assert await client.get_list_blobs_name(CONTAINER, "p/") == ["p/1"]
+        storage.upload_bytes(b"2", CONTAINER, "p/2")
+        return await client.delete_prefix(CONTAINER, "p/")
+
+    assert run_async(_main, index=index) == 2
+    assert index.query(CONTAINER, "p/") == []
+    assert storage.get_list_blobs_name(CONTAINER, "p/") == []
+
+
+def test_refresh_lists_before_locking(storage):
+    index = BlobIndex()
+    storage.upload_bytes(b"a", CONTAINER, "a")
+    listing = storage.get_list_blobs_name(CONTAINER, include_properties=True)
+
+    def _blobs():
+        for blob in listing:
+            assert not index._lock.locked()
+            yield blob
+
+    index.refresh(CONTAINER, None, _blobs())
+
+    assert index.query(CONTAINER) == ["a"]
+
+
+def test_refresh_replaces_prefix(storage):
+    index = BlobIndex()
+    storage.upload_bytes(b"a", CONTAINER, "dir/a")
+    storage.upload_bytes(b"b", CONTAINER, "dir/b")
+    storage.upload_bytes(b"c", CONTAINER, "other/c")
+    index.refresh(
+        CONTAINER, None, storage.get_list_blobs_name(CONTAINER, include_properties=True)
+    )
+    storage.delete_blobs(CONTAINER, ["dir/a"])
+
+    index.refresh(
+        CONTAINER,
+        "dir/",
+        storage.get_list_blobs_name(CONTAINER, "dir/", include_properties=True),
+    )
+
+    assert index.query(CONTAINER) == ["dir/b", "other/c"]
+    assert index.is_fresh(CONTAINER, "other/")
+
+
+def test_written_blob_is_indexed_async(run_async):
+    index = BlobIndex()
+
+    async def _main(client):
+        await client.upload_bytes(b"a", CONTAINER, "a")
+        assert await client.get_list_blobs_name(CONTAINER) == ["a"]
+        async with await client.open_blob(CONTAINER, "b", mode="wb") as writer:
+            await writer.write(b"bb")
+        return await client.get_list_blobs_name(CONTAINER, include_properties=True)
+
+    blobs = run_async(_main, index=index)
+
+    assert [(blob.name, blob.size) for blob in blobs] == [("a", 1), ("b", 2)]
+    assert index.is_fresh(CONTAINER)
@@ -0,0 +1,175 @@
+import fake_blob_server
+import pytest
+from conftest import CONTAINER
+
+NAMES = ["a/1", "a/2", "a/b/3", "c/4", "c/d/e/5", "f", "g/6"]
+
+
+@pytest.fixture
+def list_requests(monkeypatch):
+    requests = []
+    list_blobs = fake_blob_server._Handler._list
+
+    def _list(self, container, blobs, query):
+        requests.append(query)
+        return list_blobs(self, container, blobs, query)
+
+    monkeypatch.setattr(fake_blob_server._Handler, "_list", _list)
+    return requests
+
+
+@pytest.fixture
+def remote_blobs(server):
+    server.put_blobs(CONTAINER, {name: name.encode() for name in NAMES})
+    return NAMES
+
+
+def test_get_list_blobs_name_async_generator_streams_pages(
+    run_async, remote_blobs, list_requests
+):
+    async def _main(client):
+        blobs = await client.get_list_blobs_name(
+            CONTAINER, return_list=False, results_per_page=2
+        )
+        assert not isinstance(blobs, list)
+        first = await blobs.__anext__()
+        requests_before_first = len(list_requests)
+        rest = [name async for name in blobs]
+        return [first] + rest, requests_before_first
+
+    names, requests_before_first = run_async(_main)
+
+    assert names == remote_blobs
+    assert requests_before_first == 1
+    assert len(list_requests) == 4
+    assert {request["maxresults"] for request in list_requests} == {"2"}
+
+
+def test_get_list_blobs_name_async_with_properties(run_async, remote_blobs):
+    async def _main(client):
+        blobs = await client.get_list_blobs_name(
+            CONTAINER, prefix="a/", return_list=False, include_properties=True
+        )
+        listed = [blob async for blob in blobs]
+        properties = await client.get_blob_client(
+            CONTAINER, "a/b/3"
+        ).get_blob_properties()
+        return listed, properties
+
+    listed, properties = run_async(_main)
+
+    assert [(blob.name, blob.size) for blob in listed] == [
+        ("a/1", 3),
+        ("a/2", 3),
+        ("a/b/3", 5),
+    ]
+    # Listings return ETags without the quotes of the ETag header
+    assert listed[-1].etag == properties.etag.strip('"')
+    assert listed[-1].last_modified == properties.last_modified
+    assert (
+        listed[-1].content_settings.content_md5
+        == properties.content_settings.content_md5
+    )
+
+
+def test_get_list_blobs_name_async_list(run_async, remote_blobs):
+    async def _main(client):
+        return (
+            await client.get_list_blobs_name(CONTAINER, results_per_page=3),
+            await client.get_list_blobs_name(CONTAINER, prefix="c/"),
+        )
+
+    assert run_async(_main) == (remote_blobs, ["c/4", "c/d/e/5"])
+
+
+@pytest.fixture
+def tree_blobs(server):
+    names = sorted(
+        ["root_{}".format(i) for i in range(3)]
+        + ["d{}/f_{}".format(d, i) for d in range(6) for i in range(4)]
+        + ["d{}/s{}/f".format(d, s) for d in range(6) for s in range(3)]
+        + ["d1/s1/deep/f", "d1/t", "e/f"]
+    )
+    server.put_blobs(CONTAINER, {name: name.encode() for name in names})
+    return names
+
+
+@pytest.mark.parametrize("max_concurrency", [1, 2, 8])
+@pytest.mark.parametrize("prefix", [None, "d1/", "d", "missing/"])
+def test_list_blobs_parallel_matches_flat_listing(
+    storage, tree_blobs, max_concurrency, prefix
+):
+    expected = storage.get_list_blobs_name(CONTAINER, prefix=prefix)
+
+    unsorted = list(
+        storage.list_blobs_parallel(
+            CONTAINER, prefix, max_concurrency=max_concurrency, results_per_page=3
+        )
+    )
+    in_order = list(
+        storage.list_blobs_parallel(
+            CONTAINER, prefix, max_concurrency=max_concurrency, sort=True
+        )
+    )
+
+    assert sorted(unsorted) == expected
+    assert len(unsorted) == len(expected)
+    assert in_order == expected
+
+
+def test_list_blobs_parallel_with_properties(storage, tree_blobs):
+    blobs = list(
+        storage.list_blobs_parallel(
+            CONTAINER, "d1/", max_concurrency=4, sort=True, include_properties=True
+        )
+    )
+
+    assert [(blob.name, blob.size) for blob in blobs] == [
+        (name, len(name)) for name in tree_blobs if name.startswith("d1/")
+    ]
+
+
+def test_list_blobs_parallel_streams_flat_prefix(storage, remote_blobs, list_requests):
+    for sort in [False, True]:
+        list_requests.clear()
+        blobs = storage.list_blobs_parallel(
+            CONTAINER, "a/", max_concurrency=4, sort=sort, results_per_page=1
+        )
+
+        assert next(blobs) == "a/1"
+        assert len(list_requests) == 1
+        assert list(blobs) == ["a/2", "a/b/3"]
+
+
+@pytest.mark.parametrize("sort", [False, True])
+@pytest.mark.parametrize("concurrency", [1, 8])
+def test_list_blobs_parallel_matches_flat_listing_async(
+    run_async, tree_blobs, sort, concurrency
+):
+    async def _main(client):
+        blobs = [
+            name
+            async for name in client.list_blobs_parallel(
+                CONTAINER, concurrency=concurrency, sort=sort, results_per_page=3
+            )
+        ]
+        return blobs, await client.get_list_blobs_name(CONTAINER)
+
+    blobs, expected = run_async(_main)
+
+    assert (blobs if sort else sorted(blobs)) == expected
+    assert len(blobs) == len(expected)
+
+
+def test_list_blobs_parallel_streams_flat_prefix_async(
+    run_async, remote_blobs, list_requests
+):
+    async def _main(client):
+        blobs = client.list_blobs_parallel(
+            CONTAINER, "c/", concurrency=4, sort=True, results_per_page=1
+        )
+        first = await blobs.__anext__()
+        requests_before_first = len(list_requests)
+        return [first] + [name async for name in blobs], requests_before_first
+
+    assert run_async(_main) == (["c/4", "c/d/e/5"], 1)
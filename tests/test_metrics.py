@@ -0,0 +1,84 @@
+import os
+
+import fake_blob_server
+import pytest
+from azure.core.exceptions import HttpResponseError
+from azure.storage.blob._shared.policies import StorageRetryPolicy
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import BlobStorageBase, CallbackObserver, MetricsCollector
+from azure_blobstorage_utils.metrics import _current_operation, instrumented
+
+
+class _SyncingStorage(BlobStorageBase):
+    @instrumented("sync", None)
+    def sync_directory(self, container_name: str, remote_directory: str):
+        return self.download_directory(container_name, remote_directory, max_workers=4)
+
+
+def test_metrics_collector_counts_bytes_status_and_parent_operation(server, tmp_path):
+    data = {"dir/a": os.urandom(1000), "dir/b": os.urandom(2000)}
+    server.put_blobs(CONTAINER, data)
+    metrics = MetricsCollector()
+    records = []
+
+    def _on_operation(record):
+        records.append((record, _current_operation.get()))
+
+    with _SyncingStorage(
+        server.connection_string,
+        local_base_path=str(tmp_path) + "/",
+        observers=[metrics, CallbackObserver(_on_operation)],
+    ) as storage:
+        storage.upload_bytes(b"x" * 10, CONTAINER, "c")
+        assert storage.sync_directory(CONTAINER, "dir/") == {
+            "dir/a": None,
+            "dir/b": None,
+        }
+
+    counters = metrics.get_counters()
+    assert counters["upload"]["bytes_sent"] == 10
+    assert counters["download"]["operations"] == 2
+    assert counters["download"]["bytes_received"] == 3000
+    assert counters["sync"]["requests"] == 1
+    assert counters["sync"]["retries"] == 0
+    downloads = [
+        (record, parent) for record, parent in records if record.operation == "download"
+    ]
+    sync = next(record for record, _ in records if record.operation == "sync")
+    # Downloads run on a thread pool, within the operation that submitted them
+    assert sorted(record.blob_name for record, _ in downloads) == ["dir/a", "dir/b"]
+    assert all(parent is sync for _, parent in downloads)
+    assert {record.status_code for record, _ in downloads} == {206}
+    assert metrics.get_latency_quantile("download", 0.5) is not None
+
+
+@pytest.mark.parametrize("failures", [2, 100])
+def test_retries_count_attempts_after_the_first(server, storage, monkeypatch, failures):
+    monkeypatch.setattr(StorageRetryPolicy, "sleep", lambda *args: None)
+    storage.upload_bytes(b"a", CONTAINER, "a")
+    get = fake_blob_server._Handler.do_GET
+    failed = []
+
+    def _do_get(handler):
+        if len(failed) < failures:
+            failed.append(1)
+            return handler._send_error(503, "ServerBusy")
+        return get(handler)
+
+    monkeypatch.setattr(fake_blob_server._Handler, "do_GET", _do_get)
+    metrics = MetricsCollector()
+    storage.observers = [metrics]
+
+    if failures < 100:
+        assert storage.get_file_as_bytes(CONTAINER, "a") == b"a"
+        requests = failures + 1
+    else:
+        # The retry policy gives up: its last failed attempt is not retried
+        with pytest.raises(HttpResponseError):
+            storage.get_file_as_bytes(CONTAINER, "a")
+        requests = len(failed)
+
+    counters = metrics.get_counters()["download"]
+    assert counters["requests"] == requests
+    assert counters["retries"] == requests - 1
@@ -0,0 +1,131 @@
+import io
+
+import azure.storage.blob
+import azure.storage.blob.aio
+
+import pytest
+from conftest import CONTAINER
+
+pd = pytest.importorskip("pandas")
+pytest.importorskip("pyarrow")
+pytest.importorskip("simplejpeg")
+
+from azure_blobstorage_utils import (  # noqa: E402
+    BlobCache,
+    BlobStorageExtended,
+    BlobStorageExtendedAsync,
+)
+
+PROJECTIONS = [
+    {"columns": ["x"]},
+    {"columns": ["y"], "filters": [("x", ">=", 40)]},
+    {"columns": ["y"], "filters": [("x", "not in", [1, 2, 50])]},
+    {"filters": [("x", "in", [3, 70]), ("y", "!=", "v3")]},
+    {"columns": ["x"], "filters": [("x", "==", 1000)]},
+]
+
+
+@pytest.fixture(params=["stored", "range"])
+def parquet_data(request):
+    df = pd.DataFrame({"x": range(100), "y": ["v{}".format(i) for i in range(100)]})
+    if request.param == "stored":
+        df.index = pd.Index([(i * 37) % 100 for i in range(100)], name="id")
+    data = io.BytesIO()
+    df.to_parquet(data, row_group_size=10)
+    return data.getvalue()
+
+
+@pytest.mark.parametrize("kwargs", PROJECTIONS)
+def test_get_file_as_pandas_df_projection_matches_pandas(
+    server, tmp_path, parquet_data, kwargs
+):
+    with BlobStorageExtended(
+        server.connection_string, local_base_path=str(tmp_path) + "/"
+    ) as storage:
+        storage.upload_bytes(parquet_data, CONTAINER, "df.parquet")
+        result = storage.get_file_as_pandas_df(CONTAINER, "df.parquet", **kwargs)
+
+    expected = pd.read_parquet(io.BytesIO(parquet_data), **kwargs)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+@pytest.mark.parametrize("kwargs", PROJECTIONS)
+def test_get_file_as_pandas_df_projection_matches_pandas_async(
+    run_async, parquet_data, kwargs
+):
+    async def _main(client):
+        await client.upload_bytes(parquet_data, CONTAINER, "df.parquet")
+        return await client.get_file_as_pandas_df(CONTAINER, "df.parquet", **kwargs)
+
+    expected = pd.read_parquet(io.BytesIO(parquet_data), **kwargs)
+    pd.testing.assert_frame_equal(
+        run_async(_main, client_class=BlobStorageExtendedAsync), expected
+    )
+
+
+def test_get_parquet_as_pandas_df_invalid_operator(server, tmp_path, parquet_data):
+    with BlobStorageExtended(
+        server.connection_string, local_base_path=str(tmp_path) + "/"
+    ) as storage:
+        storage.upload_bytes(parquet_data, CONTAINER, "df.parquet")
+        with pytest.raises(ValueError):
+            storage.get_parquet_as_pandas_df(
+                CONTAINER, "df.parquet", filters=[("x", "~", 1)]
+            )
+
+
+def test_get_parquet_as_pandas_df_empty_blob(server, tmp_path):
+    with BlobStorageExtended(
+        server.connection_string, local_base_path=str(tmp_path) + "/"
+    ) as storage:
+        storage.upload_bytes(b"", CONTAINER, "empty.parquet")
+        with pytest.raises(ValueError, match="empty"):
+            storage.get_parquet_as_pandas_df(CONTAINER, "empty.parquet", columns=["x"])
+
+
+def test_get_parquet_as_pandas_df_empty_blob_async(run_async):
+    async def _main(client):
+        await client.upload_bytes(b"", CONTAINER, "empty.parquet")
+        with pytest.raises(ValueError, match="empty"):
+            await client.get_parquet_as_pandas_df(
+                CONTAINER, "empty.parquet", columns=["x"]
+            )
+
+    run_async(_main, client_class=BlobStorageExtendedAsync)
+
+
+@pytest.mark.parametrize("ttl", [None, 60])
+def test_get_parquet_as_pandas_df_reads_cached_blob(
+    server, tmp_path, parquet_data, monkeypatch, ttl
+):
+    kwargs = {"columns": ["y"], "filters": [("x", ">=", 40)]}
+    with BlobStorageExtended(
+        server.connection_string,
+        local_base_path=str(tmp_path) + "/",
+        cache=BlobCache(ttl=ttl),
+    ) as storage:
+        storage.upload_bytes(parquet_data, CONTAINER, "df.parquet")
+        storage.get_file_as_bytes(CONTAINER, "df.parquet")
+        monkeypatch.setattr(azure.storage.blob.BlobClient, "download_blob", None)
+
+        result = storage.get_parquet_as_pandas_df(CONTAINER, "df.parquet", **kwargs)
+
+    expected = pd.read_parquet(io.BytesIO(parquet_data), **kwargs)
+    pd.testing.assert_frame_equal(result, expected)
+
+
+def test_get_parquet_as_pandas_df_reads_cached_blob_async(
+    run_async, parquet_data, monkeypatch
+):
+    kwargs = {"columns": ["y"], "filters": [("x", ">=", 40)]}
+
+    async def _main(client):
+        await client.upload_bytes(parquet_data, CONTAINER, "df.parquet")
+        await client.get_file_as_bytes(CONTAINER, "df.parquet")
+        monkeypatch.setattr(azure.storage.blob.aio.BlobClient, "download_blob", None)
+        return await client.get_parquet_as_pandas_df(CONTAINER, "df.parquet", **kwargs)
+
+    result = run_async(_main, client_class=BlobStorageExtendedAsync, cache=BlobCache())
+
+    expected = pd.read_parquet(io.BytesIO(parquet_data), **kwargs)
+    pd.testing.assert_frame_equal(result, expected)
@@ -0,0 +1,96 @@
+import io
+import os
+
+import azure.storage.blob
+import azure.storage.blob.aio
+import pytest
+from azure.core.exceptions import ResourceModifiedError
+from conftest import CONTAINER
+
+DATA = os.urandom(10 * 1024 + 5)
+
+
+@pytest.fixture
+def ranges(storage, monkeypatch):
+    storage.upload_bytes(DATA, CONTAINER, "blob")
+    requested = []
+    download_blob = azure.storage.blob.BlobClient.download_blob
+
+    def _download_blob(self, *args, **kwargs):
+        requested.append((kwargs.get("offset"), kwargs.get("length")))
+        return download_blob(self, *args, **kwargs)
+
+    monkeypatch.setattr(azure.storage.blob.BlobClient, "download_blob", _download_blob)
+    return requested
+
+
+def test_open_blob_sequential_read_ahead(storage, ranges):
+    with storage.open_blob(
+        CONTAINER, "blob", block_size=1024, read_ahead=3
+    ) as blob_file:
+        chunks = list(iter(lambda: blob_file.read(1000), b""))
+
+    assert b"".join(chunks) == DATA
+    assert ranges == [(0, 4096), (4096, 4096), (8192, 2053)]
+
+
+def test_open_blob_seek(storage, ranges):
+    with storage.open_blob(
+        CONTAINER, "blob", block_size=1024, read_ahead=3
+    ) as blob_file:
+        assert blob_file.seekable()
+        assert blob_file.seek(5000) == 5000
+        assert blob_file.read(10) == DATA[5000:5010]
+        assert blob_file.seek(-10, io.SEEK_END) == len(DATA) - 10
+        assert blob_file.read() == DATA[-10:]
+        blob_file.seek(4100)
+        assert blob_file.read(20) == DATA[4100:4120]
+        blob_file.seek(-30, io.SEEK_CUR)
+        assert blob_file.read(30) == DATA[4090:4120]
+        with pytest.raises(ValueError):
+            blob_file.seek(-1)
+
+    # Random reads fetch single blocks, and cached blocks are not fetched again
+    assert ranges == [(4096, 1024), (9216, 1024), (10240, 5), (3072, 1024)]
+
+
+def test_open_blob_reads_a_single_version(storage, ranges):
+    with storage.open_blob(
+        CONTAINER, "blob", block_size=1024, read_ahead=0
+    ) as blob_file:
+        assert blob_file.read(1024) == DATA[:1024]
+        storage.upload_bytes(b"new", CONTAINER, "blob", overwrite=True)
+
+        with pytest.raises(ResourceModifiedError):
+            blob_file.read(1024)
+
+
+def test_open_blob_async(run_async, monkeypatch):
+    requested = []
+    download_blob = azure.storage.blob.aio.BlobClient.download_blob
+
+    async def _download_blob(self, *args, **kwargs):
+        requested.append((kwargs.get("offset"), kwargs.get("length")))
+        return await download_blob(self, *args, **kwargs)
+
+    async def _main(client):
+        await client.upload_bytes(DATA, CONTAINER, "blob")
+        monkeypatch.setattr(
+            azure.storage.blob.aio.BlobClient, "download_blob", _download_blob
+        )
+        async with await client.open_blob(
+            CONTAINER, "blob", block_size=1024, read_ahead=3
+        ) as blob_file:
+            sequential = [await blob_file.read(1000) for _ in range(11)]
+            blob_file.seek(-10, io.SEEK_END)
+            end = await blob_file.read()
+            blob_file.seek(5000)
+            middle = await blob_file.read(10)
+        return b"".join(sequential), end, middle
+
+    sequential, end, middle = run_async(_main)
+
+    assert sequential == DATA
+    assert end == DATA[-10:]
+    assert middle == DATA[5000:5010]
+    assert requested == [(0, 4096), (4096, 4096), (8192, 2053)]
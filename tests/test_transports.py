@@ -0,0 +1,81 @@
+import asyncio
+
+import pytest
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import BlobStorageBase, BlobStorageBaseAsync
+from azure_blobstorage_utils.transports import (
+    PooledAioHttpTransport,
+    PooledRequestsTransport,
+)
+
+
+def test_pooled_requests_transport_cannot_be_opened_after_close():
+    transport = PooledRequestsTransport(pool_size=32, keep_alive=False)
+    with transport:
+        adapter = transport.session.get_adapter("https://account.blob.core.windows.net")
+        pool_kwargs = adapter.poolmanager.connection_pool_kw
+        assert (pool_kwargs["maxsize"], pool_kwargs["blocksize"]) == (32, 32768)
+        assert adapter.max_retries.total is False
+        assert transport.session.headers["Connection"] == "close"
+    assert transport.session is None
+    with pytest.raises(ValueError):
+        transport.open()
+
+
+def test_sync_client_with_connection_pool(server, tmp_path):
+    with BlobStorageBase(
+        server.connection_string,
+        local_base_path=str(tmp_path) + "/",
+        connection_pool_size=32,
+        keep_alive=False,
+    ) as client:
+        transport = client.blob_service_client._pipeline._transport
+        assert isinstance(transport, PooledRequestsTransport)
+        client.upload_bytes(b"a", CONTAINER, "a")
+        assert client.get_file_as_bytes(CONTAINER, "a") == b"a"
+    assert transport.session is None
+
+
+def test_pooled_aiohttp_transport_cannot_be_opened_after_close():
+    async def _main():
+        transport = PooledAioHttpTransport(pool_size=4)
+        async with transport:
+            assert transport.session.connector.limit == 4
+        with pytest.raises(ValueError):
+            await transport.open()
+        assert transport.session is None
+
+    asyncio.run(_main())
+
+
+def test_pooled_aiohttp_transport_with_client(server, tmp_path):
+    async def _main():
+        transport = PooledAioHttpTransport(pool_size=4, use_env_settings=False)
+        async with BlobStorageBaseAsync(
+            server.connection_string,
+            local_base_path=str(tmp_path) + "/",
+            transport=transport,
+        ) as client:
+            await client.upload_bytes(b"a", CONTAINER, "a")
+            assert not transport.session.trust_env
+            return await client.get_file_as_bytes(CONTAINER, "a"), transport.session
+
+    data, session = asyncio.run(_main())
+
+    assert data == b"a"
+    assert session.closed
+
+
+def test_async_client_cannot_be_used_after_close(server, tmp_path):
+    async def _main():
+        client = BlobStorageBaseAsync(
+            server.connection_string, local_base_path=str(tmp_path) + "/"
+        )
+        async with client:
+            await client.upload_bytes(b"a", CONTAINER, "a")
+            assert await client.get_file_as_bytes(CONTAINER, "a") == b"a"
+        with pytest.raises(ValueError):
+            await client.get_file_as_bytes(CONTAINER, "a")
+
+    asyncio.run(_main())
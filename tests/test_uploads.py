@@ -0,0 +1,154 @@
+import asyncio
+import base64
+import math
+import os
+
+import pytest
+from azure.storage.blob import BlobClient
+from azure.storage.blob.aio import BlobClient as AsyncBlobClient
+from conftest import CONTAINER
+
+from azure_blobstorage_utils import AsyncConcurrencyGovernor, ConcurrencyGovernor
+
+
+def _get_block_index(block_id: str) -> int:
+    return int(base64.b64decode(block_id))
+
+
+def test_upload_file_in_blocks_resumes_after_failure(storage, local_file, monkeypatch):
+    file_name, data = local_file
+    stage_block = BlobClient.stage_block
+    staged = []
+    failures = []
+
+    def _failing_stage_block(self, block_id, data, **kwargs):
+        if _get_block_index(block_id) == 2 and not failures:
+            failures.append(block_id)
+            raise RuntimeError("stage failed")
+        staged.append(block_id)
+        return stage_block(self, block_id, data, **kwargs)
+
+    monkeypatch.setattr(BlobClient, "stage_block", _failing_stage_block)
+    with pytest.raises(RuntimeError):
+        storage.upload_file(CONTAINER, file_name, "blob", block_size=1024)
+    first_attempt = set(staged)
+    staged.clear()
+
+    storage.upload_file(CONTAINER, file_name, "blob", block_size=1024)
+
+    # Only the missing blocks are sent again
+    assert 2 in [_get_block_index(block_id) for block_id in staged]
+    assert first_attempt and not first_attempt & set(staged)
+    assert len(first_attempt) + len(staged) == math.ceil(len(data) / 1024)
+    assert storage.get_file_as_bytes(CONTAINER, "blob") == data
+
+
+def test_async_upload_file_in_blocks_cancels_pending_blocks_on_failure(
+    run_async, local_file, monkeypatch
+):
+    file_name, _ = local_file
+    stage_block = AsyncBlobClient.stage_block
+    completed = []
+    errors = []
+
+    async def _slow_stage_block(self, block_id, data, **kwargs):
+        if _get_block_index(block_id) == 1:
+            raise RuntimeError("stage failed")
+        await asyncio.sleep(0.05)
+        result = await stage_block(self, block_id, data, **kwargs)
+        completed.append(block_id)
+        return result
+
+    monkeypatch.setattr(AsyncBlobClient, "stage_block", _slow_stage_block)
+
+    async def _test(client):
+        asyncio.get_running_loop().set_exception_handler(
+            lambda loop, context: errors.append(context)
+        )
+        with pytest.raises(RuntimeError):
+            await client.upload_file(
+                CONTAINER, file_name, "blob", block_size=1024, max_concurrency=3
+            )
+        count = len(completed)
+        await asyncio.sleep(0.3)
+        return count
+
+    count = run_async(_test)
+    assert len(completed) == count
+    assert errors == []
+
+
+def test_upload_directory_skips_upload_journals(storage, local_file, monkeypatch):
+    file_name, _ = local_file
+
+    def _failing_stage_block(self, block_id, data, **kwargs):
+        raise RuntimeError("stage failed")
+
+    with monkeypatch.context() as patch:
+        patch.setattr(BlobClient, "stage_block", _failing_stage_block)
+        with pytest.raises(RuntimeError):
+            storage.upload_file(CONTAINER, file_name, "blob", block_size=1024)
+    assert os.listdir(os.path.join(storage.local_base_path, ".upload_journals"))
+
+    storage.upload_directory(CONTAINER, storage.local_base_path)
+
+    names = storage.get_list_blobs_name(CONTAINER)
+    assert any(name.endswith("data.bin") for name in names)
+    assert not any(".upload_journals" in name for name in names)
+
+
+def test_upload_directory_skips_download_manifests(storage, tmp_path):
+    storage.upload_bytes(b"data", CONTAINER, "remote/a.txt")
+    local_directory = str(tmp_path / "local") + "/"
+    storage.download_directory(
+        CONTAINER, "remote/", local_directory=local_directory, incremental=True
+    )
+    assert any(name.startswith(".manifest-") for name in os.listdir(local_directory))
+
+    storage.upload_directory(CONTAINER, local_directory, "copy/")
+
+    names = storage.get_list_blobs_name(CONTAINER, prefix="copy/")
+    assert names and not any(".manifest-" in name for name in names)
+
+
+def test_upload_file_in_blocks_is_governed_async(run_async, local_file):
+    file_name, data = local_file
+    governor = AsyncConcurrencyGovernor(initial=2)
+    acquired = []
+    acquire = governor.acquire
+    governor.acquire = lambda: acquired.append(1) or acquire()
+
+    async def _main(client):
+        await client.upload_file(
+            CONTAINER, file_name, "data.bin", block_size=16 * 1024, max_concurrency=4
+        )
+        return await client.get_file_as_bytes(CONTAINER, "data.bin")
+
+    assert run_async(_main, governor=governor) == data
+    assert len(acquired) == -(-len(data) // (16 * 1024))
+
+
+def test_upload_directory_governs_each_file(storage, local_file, tmp_path):
+    _, data = local_file
+    for name in ["a.bin", "b/c.bin"]:
+        (tmp_path / "dir" / name).parent.mkdir(parents=True, exist_ok=True)
+        (tmp_path / "dir" / name).write_bytes(data)
+    # With a limit of 1, the blocks of a file must run within the slot of the file
+    storage.governor = ConcurrencyGovernor(initial=1, maximum=1)
+    acquired = []
+    acquire = storage.governor.acquire
+    storage.governor.acquire = lambda: acquired.append(1) or acquire()
+
+    storage.upload_directory(
+        CONTAINER,
+        str(tmp_path / "dir") + "/",
+        "remote/",
+        block_size=16 * 1024,
+        max_concurrency=4,
+    )
+
+    assert len(acquired) == 2
+    assert storage.governor._in_flight == 0
+    names = storage.get_list_blobs_name(CONTAINER, "remote/")
+    assert len(names) == 2
+    assert {storage.get_file_as_bytes(CONTAINER, name) for name in names} == {data}